@@ -1,7 +1,11 @@
 import { Ora } from "ora";
-import { readFiles, readMetadata } from "../io";
+import { hashFile, readFiles, readMetadata } from "../io";
 import chalk from "chalk";
-import { s3fetchAllMetadata, s3uploadObject } from "../s3";
+import {
+  s3fetchAllMetadata,
+  s3uploadMetadata,
+  s3uploadObject,
+} from "../s3";
 import { splitFile } from "../io";
 
 export async function uploadDirectory(directoryPath: string, spinner: Ora) {
@@ -46,6 +50,13 @@ export async function uploadDirectory(directoryPath: string, spinner: Ora) {
 
     // Upload if the image metadata isn't on the registry or the revision has changed
     if (!remoteMetadata || remoteMetadata.revision !== metadata.revision) {
+      spinner.start(
+        `Hashing ${chalk.cyan(imagePath)} (${chalk.yellow(index + 1)}/${chalk.yellow(images.length)})...`,
+      );
+
+      // Nodes verify the image they download against this digest
+      metadata.sha256 = await hashFile(imagePath);
+
       spinner.start(
         `Uploading ${chalk.cyan(imagePath)} (${chalk.yellow(index + 1)}/${chalk.yellow(images.length)})...`,
       );
@@ -58,7 +69,7 @@ export async function uploadDirectory(directoryPath: string, spinner: Ora) {
         `Uploading ${chalk.cyan(configPath)} (${chalk.yellow(index + 1)}/${chalk.yellow(images.length)})...`,
       );
 
-      await s3uploadObject(configPath, configFilename);
+      await s3uploadMetadata(metadata, configFilename);
     } else {
       console.log(
         chalk.cyan(
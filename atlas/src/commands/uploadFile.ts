@@ -1,6 +1,6 @@
-import { isQcow2Image, readMetadata, splitFile } from "../io";
+import { hashFile, isQcow2Image, readMetadata, splitFile } from "../io";
 import chalk from "chalk";
-import { s3fetchMetadata, s3uploadObject } from "../s3";
+import { s3fetchMetadata, s3uploadMetadata, s3uploadObject } from "../s3";
 import { Ora } from "ora";
 
 export async function uploadFile(path: string, spinner: Ora) {
@@ -32,9 +32,12 @@ export async function uploadFile(path: string, spinner: Ora) {
 
   // Upload if the image metadata isn't on the registry or the revision has changed
   if (!remoteMetadata || remoteMetadata.revision !== metadata.revision) {
+    spinner.start(`Hashing ${chalk.cyan(filename)}...`);
+    // Nodes verify the image they download against this digest
+    metadata.sha256 = await hashFile(path);
     spinner.start(`Uploading ${chalk.cyan(filename)}...`);
     await s3uploadObject(path, filename);
-    await s3uploadObject(configPath, configFilename);
+    await s3uploadMetadata(metadata, configFilename);
   } else {
     console.log(
       chalk.yellow(
@@ -3,3 +3,4 @@ export * from "./is-qcow2-image";
 export * from "./split-file";
 export * from "./read-files";
 export * from "./read-metadata";
+export * from "./hash-file";
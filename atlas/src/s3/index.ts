@@ -1,3 +1,4 @@
 export * from "./upload-image";
+export * from "./upload-metadata";
 export * from "./fetch-metadata-files";
 export * from "./remove";
@@ -0,0 +1,23 @@
+import { PutObjectCommand } from "@aws-sdk/client-s3";
+import yaml from "js-yaml";
+import chalk from "chalk";
+import { s3 } from "./client";
+import { getBucket } from "./bucket";
+import { Metadata } from "../schemas";
+
+export async function s3uploadMetadata(metadata: Metadata, configName: string) {
+  const bucket = getBucket();
+
+  await s3.send(
+    new PutObjectCommand({
+      Bucket: bucket,
+      Key: configName,
+      Body: yaml.dump(metadata),
+      ContentType: "application/yaml",
+    }),
+  );
+
+  console.log(
+    `Object ${chalk.green(configName)} uploaded to ${chalk.yellow(bucket)}`,
+  );
+}
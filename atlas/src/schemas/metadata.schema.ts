@@ -7,6 +7,7 @@ export const MetadataSchema = z.object({
   distribution: z.string(),
   family: z.string(),
   revision: z.number(),
+  sha256: z.string().optional(),
 });
 
 export type Metadata = z.infer<typeof MetadataSchema>;
@@ -29,10 +29,28 @@ db_host = get_env_or_default("POSTGRES_HOST", "localhost")
 database_url = f"postgresql+psycopg2://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}"
 engine = create_engine(database_url, echo=True)
 
+# Optional S3-compatible endpoint (e.g. MinIO) and credentials. Without
+# credentials the registry is accessed anonymously.
+s3_endpoint_url = get_env_or_default("S3_ENDPOINT_URL", "")
+s3_access_key_id = get_env_or_default("S3_ACCESS_KEY_ID", "")
+s3_secret_access_key = get_env_or_default("S3_SECRET_ACCESS_KEY", "")
+
+# Parallel ranged downloads of registry images
+IMAGE_DOWNLOAD_WORKERS = int(get_env_or_default("IMAGE_DOWNLOAD_WORKERS", "8"))
+IMAGE_DOWNLOAD_CHUNK_MB = int(
+    get_env_or_default("IMAGE_DOWNLOAD_CHUNK_MB", "64"))
+
 s3 = boto3.client(
     "s3",
-    config=Config(signature_version=UNSIGNED),
-    region_name=aws_region
+    config=Config(
+        signature_version=None if s3_access_key_id else UNSIGNED,
+        max_pool_connections=max(10, IMAGE_DOWNLOAD_WORKERS),
+        s3={"addressing_style": "path"} if s3_endpoint_url else None,
+    ),
+    region_name=aws_region,
+    endpoint_url=s3_endpoint_url or None,
+    aws_access_key_id=s3_access_key_id or None,
+    aws_secret_access_key=s3_secret_access_key or None,
 )
 
 
@@ -79,6 +97,42 @@ def init_db():
                         "REFERENCES slaves(id)"
                     )
                 )
+            if "pool_profile_id" not in vm_columns:
+                conn.execute(
+                    text(
+                        "ALTER TABLE vms ADD COLUMN pool_profile_id UUID "
+                        "REFERENCES vm_pool_profiles(id)"
+                    )
+                )
+                conn.execute(
+                    text(
+                        "CREATE INDEX IF NOT EXISTS ix_vms_pool_profile_id "
+                        "ON vms (pool_profile_id)"
+                    )
+                )
+            if "shutdown_grace" not in vm_columns:
+                conn.execute(
+                    text("ALTER TABLE vms ADD COLUMN shutdown_grace INTEGER")
+                )
+            if "hibernated_at" not in vm_columns:
+                conn.execute(
+                    text("ALTER TABLE vms ADD COLUMN hibernated_at TIMESTAMP")
+                )
+            # Filters and keyset pagination of GET /vms
+            for index in (
+                "ix_vms_name_id ON vms (name, id)",
+                "ix_vms_name_pattern ON vms (name varchar_pattern_ops)",
+                "ix_vms_os ON vms (os)",
+                "ix_vms_slave_id ON vms (slave_id)",
+            ):
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS {index}"))
+
+        if "event_participants" in inspector.get_table_names():
+            for column in ("event_id", "vm_id"):
+                conn.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_event_participants_{column} "
+                    f"ON event_participants ({column})"
+                ))
 
         if "events" in inspector.get_table_names():
             event_columns = {
@@ -90,6 +144,43 @@ def init_db():
                         "ALTER TABLE events ADD COLUMN keyboard_layout VARCHAR"
                     )
                 )
+            if "shutdown_grace" not in event_columns:
+                conn.execute(
+                    text(
+                        "ALTER TABLE events ADD COLUMN shutdown_grace INTEGER"
+                    )
+                )
+
+        if "vm_pool_profiles" in inspector.get_table_names():
+            pool_columns = {
+                col["name"] for col in inspector.get_columns("vm_pool_profiles")
+            }
+            if "event_id" not in pool_columns:
+                conn.execute(
+                    text(
+                        "ALTER TABLE vm_pool_profiles ADD COLUMN event_id UUID "
+                        "REFERENCES events(id)"
+                    )
+                )
+                conn.execute(
+                    text(
+                        "CREATE INDEX IF NOT EXISTS "
+                        "ix_vm_pool_profiles_event_id "
+                        "ON vm_pool_profiles (event_id)"
+                    )
+                )
+
+        if "provision_jobs" in inspector.get_table_names():
+            job_columns = {
+                col["name"] for col in inspector.get_columns("provision_jobs")
+            }
+            if "slave_job_id" not in job_columns:
+                conn.execute(
+                    text(
+                        "ALTER TABLE provision_jobs "
+                        "ADD COLUMN slave_job_id UUID"
+                    )
+                )
 
         if "vm_credentials" in inspector.get_table_names():
             cred_columns = {
@@ -104,6 +195,9 @@ def init_db():
                 )
 
 
+LIBVIRT_URI = "qemu:///system"
+
+
 class QEMUConfig:
     qemu_conn = None
 
@@ -111,7 +205,7 @@ class QEMUConfig:
     def get_connection(cls):
         if cls.qemu_conn is None or cls.qemu_conn.isAlive() == 0:
             try:
-                cls.qemu_conn = libvirt.open("qemu:///system")
+                cls.qemu_conn = libvirt.open(LIBVIRT_URI)
             except libvirt.libvirtError:
                 raise
         return cls.qemu_conn
@@ -131,6 +225,90 @@ DISTRIBOX_MODE = get_env_or_default("DISTRIBOX_MODE", "master")
 # Slave-specific config (only used when DISTRIBOX_MODE=slave)
 MASTER_URL = get_env_or_default("MASTER_URL", "")
 SLAVE_API_KEY = get_env_or_default("SLAVE_API_KEY", "")
+# What a slave does with its running VMs when it shuts down: "save" their
+# memory to disk, to restore them on its next start, or "destroy" them
+SLAVE_SHUTDOWN_MODE = get_env_or_default("SLAVE_SHUTDOWN_MODE", "save")
+# VMs saved (and restored) at once, and seconds the saves may take before
+# the VMs left are destroyed
+SLAVE_SHUTDOWN_SAVE_WORKERS = int(
+    get_env_or_default("SLAVE_SHUTDOWN_SAVE_WORKERS", "4"))
+SLAVE_SHUTDOWN_BUDGET = float(
+    get_env_or_default("SLAVE_SHUTDOWN_BUDGET", "60"))
+
+# VMs without a tunnel session using under VM_IDLE_CPU_PERCENT of the host
+# CPU for VM_IDLE_HIBERNATE_AFTER seconds are saved to disk, and restored
+# when a tunnel to them opens; 0 disables hibernation
+VM_IDLE_HIBERNATE_AFTER = float(
+    get_env_or_default("VM_IDLE_HIBERNATE_AFTER", "0"))
+VM_IDLE_CPU_PERCENT = float(get_env_or_default("VM_IDLE_CPU_PERCENT", "1"))
 
 # Virtualization type: "kvm" (default, hardware accel) or "qemu" (software emulation)
 VIRT_TYPE = get_env_or_default("VIRT_TYPE", "kvm")
+
+# Disk provisioning: "linked" (default, thin qcow2 overlay on a shared base
+# image) or "full" (independent copy of the base image per VM)
+DISK_PROVISIONING = get_env_or_default("DISK_PROVISIONING", "linked")
+# Bandwidth (MB/s) shared by full disk copies on this node, 0 is unlimited
+DISK_COPY_RATE_LIMIT_MB = float(
+    get_env_or_default("DISK_COPY_RATE_LIMIT_MB", "0"))
+
+# Local image cache: size budget before least recently used images are
+# evicted, and how often (seconds) registry revisions are checked
+IMAGE_CACHE_MAX_GB = float(get_env_or_default("IMAGE_CACHE_MAX_GB", "100"))
+IMAGE_REVISION_CHECK_INTERVAL = int(
+    get_env_or_default("IMAGE_REVISION_CHECK_INTERVAL", "600"))
+
+# Domain XML of this many VM shapes is kept validated and ready to render,
+# 0 disables the cache
+DOMAIN_XML_CACHE_SIZE = int(get_env_or_default("DOMAIN_XML_CACHE_SIZE", "256"))
+
+# How long (seconds) a guest IP address is cached before it is looked up
+# again; VM lifecycle changes drop it sooner
+VM_IP_CACHE_TTL = float(get_env_or_default("VM_IP_CACHE_TTL", "30"))
+
+# Running VMs without an address are looked up in the background, first
+# after the min delay (seconds) then twice as late each time up to the max
+VM_IP_REFRESH_MIN_DELAY = float(
+    get_env_or_default("VM_IP_REFRESH_MIN_DELAY", "2"))
+VM_IP_REFRESH_MAX_DELAY = float(
+    get_env_or_default("VM_IP_REFRESH_MAX_DELAY", "60"))
+
+# Deadline (seconds) for a slave to list its VMs before they are shown with
+# an unknown state
+SLAVE_INVENTORY_TIMEOUT = float(
+    get_env_or_default("SLAVE_INVENTORY_TIMEOUT", "5"))
+
+# Oldest (seconds) a cached domain state may be before reads go to libvirt;
+# the cache is rebuilt every half of it and kept current by libvirt events
+VM_STATE_CACHE_MAX_AGE = float(
+    get_env_or_default("VM_STATE_CACHE_MAX_AGE", "60"))
+
+# Changes kept for clients of the change stream to resume from after a
+# reconnection, older ones get a reset
+CHANGE_STREAM_BUFFER = int(get_env_or_default("CHANGE_STREAM_BUFFER", "1000"))
+
+# Seconds a VM start waits for the domain to run, and a VM stop gives the
+# guest to power off before destroying it, unless the VM or its event sets
+# its own shutdown grace
+VM_START_TIMEOUT = float(get_env_or_default("VM_START_TIMEOUT", "5"))
+VM_STOP_TIMEOUT = float(get_env_or_default("VM_STOP_TIMEOUT", "50"))
+
+# Number of VM provisioning jobs run concurrently on this node
+PROVISION_WORKERS = int(get_env_or_default("PROVISION_WORKERS", "4"))
+# VMs created at once on a single node by a bulk request
+BULK_CREATE_NODE_CONCURRENCY = int(
+    get_env_or_default("BULK_CREATE_NODE_CONCURRENCY", "4"))
+# Power operations and deletions run at once on a single node by a bulk
+# request
+BULK_ACTION_NODE_CONCURRENCY = int(
+    get_env_or_default("BULK_ACTION_NODE_CONCURRENCY", "8"))
+
+# Warm pools: how often (seconds) pools are refilled, and the free memory
+# (GB) below which a node stops refilling and shuts down idle pool members
+WARM_POOL_INTERVAL = int(get_env_or_default("WARM_POOL_INTERVAL", "30"))
+WARM_POOL_MIN_FREE_MEM_GB = float(
+    get_env_or_default("WARM_POOL_MIN_FREE_MEM_GB", "4"))
+# Seconds a node is left out of refills after pool members were reclaimed
+# from it
+WARM_POOL_RECLAIM_BACKOFF = int(
+    get_env_or_default("WARM_POOL_RECLAIM_BACKOFF", "600"))
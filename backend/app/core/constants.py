@@ -4,6 +4,12 @@ import libvirt
 BASE_DIR = Path('/var/lib/distribox/')
 VMS_DIR = BASE_DIR / 'vms'
 IMAGES_DIR = BASE_DIR / 'images'
+# Content-addressed registry images, see app/services/image_cache.py
+IMAGE_CACHE_DIR = IMAGES_DIR / 'cache'
+# Immutable qcow2 layers backing linked-clone VM disks
+BASES_DIR = IMAGES_DIR / 'bases'
+# cloud-init seed ISOs keyed by the hash of their content
+SEEDS_DIR = IMAGES_DIR / 'seeds'
 
 # If this ever changes, the frontend needs to be updated as well
 # See there `frontend/app/lib/types/vm-state.ts`
@@ -17,3 +23,5 @@ VM_STATE_NAMES = {
     libvirt.VIR_DOMAIN_CRASHED: "Crashed",
     libvirt.VIR_DOMAIN_PMSUSPENDED: "Suspended (power management)",
 }
+# Shut off VM saved to disk while idle, restored when a tunnel opens
+VM_HIBERNATED_STATE = "Hibernated"
@@ -0,0 +1,128 @@
+"""Version of the VM, slave and host inventory, for conditional GETs.
+
+The version is a counter of this process, bumped after every commit that
+changes an inventory table, by the domain state cache whenever a libvirt
+event changes a domain, after power operations proxied to a slave and by
+slave heartbeats that report new VM states or usage. The columns every
+heartbeat rewrites do not count as a change by themselves. Read endpoints
+send it as a weak ETag along with ``Cache-Control: no-cache``, so browsers
+revalidate every poll and get a 304 without the response being rebuilt
+while nothing changed. VM reads send none while the libvirt events of the
+domain state cache are not received, as nothing bumps the version then.
+"""
+import itertools
+import threading
+import uuid
+from typing import Optional
+
+from fastapi import Request, Response, status
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import ORMExecuteState, Session
+
+# Tables whose rows show up in VM, slave or host reads
+INVENTORY_TABLES = frozenset({
+    "vms",
+    "vm_credentials",
+    "event_participants",
+    "slaves",
+})
+
+# Columns a slave heartbeat sets every time, whether or not they changed.
+# The heartbeat bumps the version itself when what it reports changed.
+HEARTBEAT_COLUMNS = frozenset({
+    "last_heartbeat",
+    "available_cpu",
+    "available_mem",
+    "available_disk",
+})
+
+_CHANGED_KEY = "inventory_changed"
+
+
+class InventoryVersion:
+    def __init__(self):
+        # Tells versions of two runs of the backend apart
+        self.epoch = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._value = 0
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+    def bump(self) -> None:
+        with self._lock:
+            self._value += 1
+
+    def etag(self, *parts) -> str:
+        """Weak ETag of the current version, plus whatever else the
+        response depends on."""
+        tag = "-".join(str(part) for part in (self.epoch, self._value, *parts))
+        return f'W/"{tag}"'
+
+
+inventory_version = InventoryVersion()
+
+
+def not_modified(request: Request, response: Response,
+                 etag: str) -> Optional[Response]:
+    """Answer ``If-None-Match`` for a read whose ETag is ``etag``.
+
+    Returns the 304 to send if the client already has this version,
+    otherwise sets the validators on ``response`` and returns None. The
+    ETag must be computed before the response is built, so a change made
+    meanwhile yields a newer ETag on the next request.
+    """
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = {tag.strip() for tag in if_none_match.split(",")}
+        if etag in candidates or "*" in candidates:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                            headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+def _table_name(obj) -> Optional[str]:
+    return getattr(obj, "__tablename__", None)
+
+
+def _changed(obj) -> bool:
+    """Whether a dirty row has a column with a new value, other than the
+    ones a heartbeat rewrites."""
+    return any(attr.history.has_changes()
+               for attr in inspect(obj).attrs
+               if attr.key not in HEARTBEAT_COLUMNS)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flushed_rows(session: Session, _flush_context) -> None:
+    for obj in itertools.chain(session.new, session.deleted):
+        if _table_name(obj) in INVENTORY_TABLES:
+            session.info[_CHANGED_KEY] = True
+            return
+    for obj in session.dirty:
+        if _table_name(obj) in INVENTORY_TABLES and _changed(obj):
+            session.info[_CHANGED_KEY] = True
+            return
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_bulk_statements(state: ORMExecuteState) -> None:
+    if not (state.is_update or state.is_delete or state.is_insert):
+        return
+    table = getattr(state.statement, "table", None)
+    if getattr(table, "name", None) in INVENTORY_TABLES:
+        state.session.info[_CHANGED_KEY] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_on_commit(session: Session) -> None:
+    if session.info.pop(_CHANGED_KEY, False):
+        inventory_version.bump()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_on_rollback(session: Session) -> None:
+    session.info.pop(_CHANGED_KEY, None)
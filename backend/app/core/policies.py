@@ -25,6 +25,10 @@ POLICIES: list[dict[str, str]] = [
         "policy": "images:get",
         "description": "Allows the user to fetch images metadata from the registry.",
     },
+    {
+        "policy": "images:prefetch",
+        "description": "Allows the user to pre-stage images on cluster nodes.",
+    },
     {
         "policy": "policies:get",
         "description": "Allows the user to fetch policies.",
@@ -89,6 +93,10 @@ POLICIES: list[dict[str, str]] = [
         "policy": "vms:screenshot",
         "description": "Allows the user to make virtual machine screenshots.",
     },
+    {
+        "policy": "vms:setShutdownPolicy",
+        "description": "Allows the user to set how long a virtual machine is given to shut down before it is destroyed.",
+    },
     {
         "policy": "vms:duplicate",
         "description": "Allows the user to duplicate a virtual machine.",
@@ -157,6 +165,14 @@ POLICIES: list[dict[str, str]] = [
         "policy": "slaves:delete",
         "description": "Allows the user to unregister a slave node.",
     },
+    {
+        "policy": "pools:get",
+        "description": "Allows the user to list warm VM pools.",
+    },
+    {
+        "policy": "pools:manage",
+        "description": "Allows the user to create, resize and delete warm VM pools.",
+    },
 ]
 
 VALID_POLICIES = {entry["policy"] for entry in POLICIES}
@@ -1,7 +1,13 @@
+import re
+import uuid
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+from xml.sax.saxutils import escape
 from lxml import etree
-from app.models.vm import VmCreateXML
+from app.models.vm import VmBase, VmCreateXML
 from app.core.constants import VMS_DIR, IMAGES_DIR
-from app.core.config import VIRT_TYPE
+from app.core.config import VIRT_TYPE, VNC_LISTEN, DOMAIN_XML_CACHE_SIZE
 
 LAYOUT_TO_KEYMAP = {
     "en-us-qwerty": "en-us",
@@ -32,40 +38,28 @@ LAYOUT_TO_KEYMAP = {
 }
 
 
-def build_xml(vm_read: VmCreateXML):
+# Stands in for the VM id while a domain template is built
+TEMPLATE_ID = uuid.UUID(int=0)
+# Fields of a skeleton are written as @@name@@ until they are rendered
+FIELD_PATTERN = re.compile(r"@@(\w+)@@")
+SHARED_SEED_ISO = IMAGES_DIR / "seed.iso"
+DEFAULT_DEVICE_PROFILE = "virtio"
 
-    domain = etree.Element("domain", type=VIRT_TYPE)
 
-    etree.SubElement(domain, "name").text = str(vm_read.id)
-    # Frontend sends memory in GiB; libvirt XML expects MiB here.
-    memory_mib = vm_read.mem * 1024
-    etree.SubElement(domain, "memory", unit="MiB").text = str(memory_mib)
-    etree.SubElement(domain, "vcpu", placement="static").text = str(
-        vm_read.vcpus)
+def _field(name: str) -> str:
+    return f"@@{name}@@"
 
-    os_el = etree.SubElement(domain, "os")
-    etree.SubElement(os_el, "type", arch="x86_64", machine="pc").text = "hvm"
-    etree.SubElement(os_el, "boot", dev="hd")
 
-    features = etree.SubElement(domain, "features")
-    for feature in ["acpi", "apic", "pae"]:
-        etree.SubElement(features, feature)
+def _escape(value) -> str:
+    return escape(str(value), {'"': "&quot;"})
 
-    if VIRT_TYPE == "kvm":
-        etree.SubElement(domain, "cpu", mode="host-passthrough")
-
-    etree.SubElement(domain, "clock", offset="utc")
-
-    etree.SubElement(domain, "on_poweroff").text = "destroy"
-    etree.SubElement(domain, "on_reboot").text = "restart"
-    etree.SubElement(domain, "on_crash").text = "destroy"
-
-    devices = etree.SubElement(domain, "devices")
 
+def _virtio_devices(devices: etree._Element, keymap: Optional[str]) -> None:
+    """qcow2 system disk on virtio, seed ISO on IDE, VNC and a guest agent."""
     disk_main = etree.SubElement(devices, "disk", type="file", device="disk")
     etree.SubElement(disk_main, "driver", name="qemu", type="qcow2")
     etree.SubElement(disk_main, "source", file=str(
-        VMS_DIR / str(vm_read.id) / vm_read.os))
+        VMS_DIR / _field("id") / _field("os")))
     etree.SubElement(disk_main, "target", dev="vda", bus="virtio")
 
     channel = etree.SubElement(devices, "channel", type="unix")
@@ -75,13 +69,7 @@ def build_xml(vm_read: VmCreateXML):
 
     disk_seed = etree.SubElement(devices, "disk", type="file", device="cdrom")
     etree.SubElement(disk_seed, "driver", name="qemu", type="raw")
-    per_vm_seed = VMS_DIR / str(vm_read.id) / "seed.iso"
-    seed_iso_path = (
-        str(per_vm_seed)
-        if per_vm_seed.exists()
-        else str(IMAGES_DIR / "seed.iso")
-    )
-    etree.SubElement(disk_seed, "source", file=seed_iso_path)
+    etree.SubElement(disk_seed, "source", file=_field("seed"))
     etree.SubElement(disk_seed, "target", dev="hdb", bus="ide")
     etree.SubElement(disk_seed, "readonly")
 
@@ -89,17 +77,14 @@ def build_xml(vm_read: VmCreateXML):
     etree.SubElement(iface, "source", network="default")
     etree.SubElement(iface, "model", type="virtio")
 
-    from app.core.config import VNC_LISTEN
     vnc_attrs = {
         "type": "vnc",
         "port": "-1",
         "autoport": "yes",
         "listen": VNC_LISTEN,
     }
-    if vm_read.keyboard_layout:
-        keymap = LAYOUT_TO_KEYMAP.get(vm_read.keyboard_layout)
-        if keymap:
-            vnc_attrs["keymap"] = keymap
+    if keymap:
+        vnc_attrs["keymap"] = keymap
     etree.SubElement(devices, "graphics", **vnc_attrs)
 
     video = etree.SubElement(devices, "video")
@@ -109,6 +94,147 @@ def build_xml(vm_read: VmCreateXML):
     etree.SubElement(devices, "input", type="keyboard", bus="ps2")
     etree.SubElement(devices, "input", type="tablet", bus="usb")
 
-    xml_string = etree.tostring(
-        domain, pretty_print=True, encoding="utf-8").decode()
-    return xml_string
+
+DEVICE_PROFILES = {
+    "virtio": _virtio_devices,
+}
+
+
+class DomainSkeleton:
+    """Domain XML compiled into literal chunks and named fields.
+
+    Rendering only joins strings, so the lxml tree is built and serialized
+    once per skeleton instead of once per VM. ``bind`` fills in some fields
+    and returns a narrower skeleton; ``render`` needs every remaining one.
+    Values are escaped for use in text and attributes.
+    """
+
+    def __init__(self, parts: list[str]):
+        # Even indexes are literal XML, odd indexes are field names
+        self.parts = parts
+
+    @classmethod
+    def compile(
+        cls,
+        virt_type: str,
+        profile: str,
+        keymap: Optional[str],
+    ) -> "DomainSkeleton":
+        domain = etree.Element("domain", type=virt_type)
+
+        etree.SubElement(domain, "name").text = _field("id")
+        etree.SubElement(domain, "memory", unit="MiB").text = _field("mem")
+        etree.SubElement(domain, "vcpu", placement="static").text = _field(
+            "vcpus")
+
+        os_el = etree.SubElement(domain, "os")
+        etree.SubElement(os_el, "type", arch="x86_64",
+                         machine="pc").text = "hvm"
+        etree.SubElement(os_el, "boot", dev="hd")
+
+        features = etree.SubElement(domain, "features")
+        for feature in ["acpi", "apic", "pae"]:
+            etree.SubElement(features, feature)
+
+        if virt_type == "kvm":
+            etree.SubElement(domain, "cpu", mode="host-passthrough")
+
+        etree.SubElement(domain, "clock", offset="utc")
+
+        etree.SubElement(domain, "on_poweroff").text = "destroy"
+        etree.SubElement(domain, "on_reboot").text = "restart"
+        etree.SubElement(domain, "on_crash").text = "destroy"
+
+        devices = etree.SubElement(domain, "devices")
+        DEVICE_PROFILES[profile](devices, keymap)
+
+        xml_string = etree.tostring(
+            domain, pretty_print=True, encoding="utf-8").decode()
+        return cls(FIELD_PATTERN.split(xml_string))
+
+    @property
+    def fields(self) -> set[str]:
+        return set(self.parts[1::2])
+
+    def bind(self, **values) -> "DomainSkeleton":
+        parts = [self.parts[0]]
+        for index in range(1, len(self.parts), 2):
+            name = self.parts[index]
+            if name in values:
+                parts[-1] += _escape(values[name]) + self.parts[index + 1]
+            else:
+                parts += [name, self.parts[index + 1]]
+        return DomainSkeleton(parts)
+
+    def render(self, **values) -> str:
+        parts = self.parts.copy()
+        for index in range(1, len(parts), 2):
+            parts[index] = _escape(values[parts[index]])
+        return "".join(parts)
+
+
+@lru_cache(maxsize=None)
+def get_skeleton(
+    virt_type: str,
+    profile: str,
+    keymap: Optional[str],
+) -> DomainSkeleton:
+    """Compiled skeleton, built once per (virt type, profile, keymap)."""
+    return DomainSkeleton.compile(virt_type, profile, keymap)
+
+
+@lru_cache(maxsize=DOMAIN_XML_CACHE_SIZE)
+def _shape_skeleton(
+    virt_type: str,
+    profile: str,
+    keymap: Optional[str],
+    mem: int,
+    vcpus: int,
+    os: str,
+) -> DomainSkeleton:
+    """Skeleton for one VM shape, checked to render well-formed XML."""
+    skeleton = get_skeleton(virt_type, profile, keymap).bind(
+        # Frontend sends memory in GiB; libvirt XML expects MiB here.
+        mem=mem * 1024,
+        vcpus=vcpus,
+        os=os,
+    )
+    etree.fromstring(skeleton.render(
+        id=TEMPLATE_ID, seed=SHARED_SEED_ISO).encode())
+    return skeleton
+
+
+class DomainTemplate:
+    """Domain XML for one VM shape, rendered per VM by filling in its id.
+
+    The XML only depends on the VM id through its name and file paths, so
+    VMs of the same shape share one validated skeleton and rendering is a
+    string join. Set ``DOMAIN_XML_CACHE_SIZE`` to 0 to disable the shape
+    cache.
+    """
+
+    def __init__(self, vm: VmBase, profile: str = DEFAULT_DEVICE_PROFILE):
+        keymap = LAYOUT_TO_KEYMAP.get(vm.keyboard_layout or "")
+        self.skeleton = _shape_skeleton(
+            VIRT_TYPE, profile, keymap, vm.mem, vm.vcpus, vm.os)
+
+    def render(
+        self,
+        vm_id: uuid.UUID,
+        seed_iso: Optional[Path] = None,
+    ) -> str:
+        """Domain XML for ``vm_id``.
+
+        ``seed_iso`` defaults to the VM's own seed ISO when it exists and to
+        the shared one otherwise; callers that just created the seed pass
+        it to skip the filesystem check.
+        """
+        if seed_iso is None:
+            seed_iso = VMS_DIR / str(vm_id) / "seed.iso"
+            if not seed_iso.exists():
+                seed_iso = SHARED_SEED_ISO
+        return self.skeleton.render(id=vm_id, seed=seed_iso)
+
+
+def build_xml(vm_read: VmCreateXML, seed_iso: Optional[Path] = None) -> str:
+    return DomainTemplate(vm_read).render(vm_read.id, seed_iso)
@@ -7,17 +7,26 @@ from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlmodel import Session, select
 from app.core.policies import DISTRIBOX_ADMIN_POLICY
-from app.routes import vm, image, host, auth, user_management, tunnel, event, slave
-from app.routes import slave_agent
+from app.routes import vm, image, host, auth, user_management, tunnel, event, slave, pool
+from app.routes import slave_agent, changes
 from app.orm.user import UserORM
 from app.orm.vm_credential import VmCredentialORM  # noqa: F401
 from app.orm.event import EventORM, EventParticipantORM  # noqa: F401
 from app.orm.user_settings import UserSettingsORM  # noqa: F401
 from app.orm.slave import SlaveORM  # noqa: F401
+from app.orm.provision_job import ProvisionJobORM  # noqa: F401
+from app.orm.vm_pool import VmPoolProfileORM  # noqa: F401
 from app.utils.auth import hash_password
-from app.core.config import engine, get_env_or_default, init_db, DISTRIBOX_MODE, QEMUConfig
+from app.core.config import engine, get_env_or_default, init_db, DISTRIBOX_MODE, WARM_POOL_INTERVAL
+from app.core.config import SLAVE_SHUTDOWN_BUDGET, SLAVE_SHUTDOWN_MODE, SLAVE_SHUTDOWN_SAVE_WORKERS
+from app.core.config import VM_IDLE_HIBERNATE_AFTER
 from app.utils.crypto import encrypt_secret, is_encrypted_secret
 from app.services.vm_service import VmService
+from app.services.image_cache import image_cache
+from app.services.domain_state_cache import domain_state_cache
+from app.services.change_stream import change_stream
+from app.services.provision_service import ProvisionService
+from app.services.vm_hibernation import HibernationService, idle_tracker
 
 logger = logging.getLogger(__name__)
 
@@ -30,16 +39,18 @@ app.add_middleware(
     allow_origins=[frontend_url],
     allow_credentials=True,
     allow_methods=["GET", "PUT", "POST", "DELETE", "OPTIONS", "PATCH"],
-    allow_headers=["Content-Type", "Authorization"],
+    allow_headers=["Content-Type", "Authorization", "If-None-Match"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    image_cache.flush()
     if DISTRIBOX_MODE != "slave":
         return
 
-    _stop_all_local_vms()
+    await asyncio.to_thread(_stop_all_local_vms)
 
     import httpx
     from app.core.config import MASTER_URL, SLAVE_API_KEY
@@ -59,25 +70,36 @@ async def shutdown_event():
 
 def _stop_all_local_vms():
     try:
-        conn = QEMUConfig.get_connection()
-        domains = conn.listAllDomains(0)
-        for domain in domains:
-            if domain.isActive():
-                try:
-                    domain.destroy()
-                    logger.info("Destroyed VM %s", domain.name())
-                except Exception:
-                    logger.warning("Failed to destroy VM %s", domain.name())
+        if SLAVE_SHUTDOWN_MODE == "save":
+            HibernationService.save_running(
+                SLAVE_SHUTDOWN_BUDGET, SLAVE_SHUTDOWN_SAVE_WORKERS)
+        else:
+            HibernationService.destroy_running()
+    except Exception:
+        logger.warning("Failed to stop local VMs during shutdown",
+                       exc_info=True)
+
+
+async def _restore_saved_vms():
+    try:
+        await asyncio.to_thread(HibernationService.restore_saved,
+                                SLAVE_SHUTDOWN_SAVE_WORKERS)
     except Exception:
-        logger.warning("Failed to stop local VMs during shutdown")
+        logger.exception("Failed to restore saved VMs")
 
 
 @app.on_event("startup")
 async def startup_event():
     init_db()
+    image_cache.start()
+    for vm_id in VmService.get_hibernated_ids():
+        domain_state_cache.mark_hibernated(vm_id, True)
+    domain_state_cache.start()
+    ProvisionService.resume_interrupted_jobs()
 
     if DISTRIBOX_MODE == "slave":
         logger.info("Starting in SLAVE mode")
+        asyncio.create_task(_restore_saved_vms())
         asyncio.create_task(_slave_heartbeat_loop())
         return
 
@@ -135,10 +157,17 @@ async def startup_event():
 
     asyncio.create_task(_enforce_event_deadlines())
     asyncio.create_task(_check_stale_slaves())
+    asyncio.create_task(_refill_warm_pools())
+    asyncio.create_task(_host_metrics_loop())
+    if VM_IDLE_HIBERNATE_AFTER > 0:
+        asyncio.create_task(_hibernate_idle_vms())
     logger.info("Starting in MASTER mode")
 
 
 async def _enforce_event_deadlines():
+    from app.models.vm import VmBulkSelection
+    from app.services.warm_pool_service import WarmPoolService
+    from app.services.vm_bulk_action_service import VmBulkActionService
     while True:
         try:
             with Session(engine) as session:
@@ -146,31 +175,27 @@ async def _enforce_event_deadlines():
                     select(EventORM).where(
                         EventORM.deadline < datetime.utcnow())
                 ).all()
-                for ev in expired_events:
-                    participants = session.exec(
-                        select(EventParticipantORM)
-                        .where(EventParticipantORM.event_id == ev.id)
-                    ).all()
-                    for p in participants:
-                        try:
-                            vm = await asyncio.to_thread(
-                                VmService.get_vm, str(p.vm_id)
-                            )
-                            if vm and vm.state.lower() == "running":
-                                await asyncio.to_thread(
-                                    VmService.stop_vm, str(p.vm_id)
-                                )
-                                logger.info(
-                                    "Stopped VM %s for expired event %s",
-                                    p.vm_id, ev.slug,
-                                )
-                        except HTTPException:
-                            pass
-                        except Exception:
-                            logger.exception(
-                                "Failed to stop VM %s for event %s",
-                                p.vm_id, ev.slug,
-                            )
+            # Running VMs of every expired event, stopped in one batch
+            rows, slugs = [], {}
+            for ev in expired_events:
+                await asyncio.to_thread(WarmPoolService.release_event, ev.id)
+                event_rows = await asyncio.to_thread(
+                    VmBulkActionService.select,
+                    VmBulkSelection(event_id=ev.id, state="running"),
+                )
+                for row in event_rows:
+                    if row.vm.id not in slugs:
+                        rows.append(row)
+                        slugs[row.vm.id] = ev.slug
+            async for result in VmBulkActionService.run("stop", rows):
+                if result.status == "succeeded":
+                    logger.info("Stopped VM %s for expired event %s",
+                                result.vm_id, slugs[result.vm_id])
+                else:
+                    logger.warning(
+                        "Failed to stop VM %s for event %s: %s",
+                        result.vm_id, slugs[result.vm_id], result.error,
+                    )
         except Exception:
             logger.exception("Error in deadline enforcement loop")
         await asyncio.sleep(30)
@@ -186,9 +211,56 @@ async def _check_stale_slaves():
         await asyncio.sleep(30)
 
 
+async def _refill_warm_pools():
+    from app.services.warm_pool_service import WarmPoolService
+    while True:
+        try:
+            await asyncio.to_thread(WarmPoolService.refill)
+        except Exception:
+            logger.exception("Error in warm pool refill")
+        await asyncio.sleep(WARM_POOL_INTERVAL)
+
+
+async def _host_metrics_loop():
+    """Publish the usage of the master on the change stream as it is
+    sampled."""
+    from app.core.config import system_monitor
+    from app.services.host_service import HostService
+    generation = None
+    while True:
+        try:
+            if system_monitor.generation != generation:
+                generation = system_monitor.generation
+                change_stream.publish_host_metrics(
+                    None, await asyncio.to_thread(HostService.get_usage))
+        except Exception:
+            logger.exception("Error publishing host metrics")
+        await asyncio.sleep(system_monitor.interval)
+
+
+async def _hibernate_idle_vms():
+    """Hibernate VMs idle for ``VM_IDLE_HIBERNATE_AFTER`` seconds. Slave
+    VMs are observed through heartbeats, master VMs here."""
+    from app.core.config import system_monitor
+    while True:
+        try:
+            idle_tracker.observe(None, dict(system_monitor.percent_used_by_vm))
+            for vm_id in idle_tracker.idle_vms(VM_IDLE_HIBERNATE_AFTER):
+                try:
+                    await asyncio.to_thread(HibernationService.hibernate_vm,
+                                            vm_id)
+                except Exception:
+                    logger.warning("Failed to hibernate idle VM %s", vm_id,
+                                   exc_info=True)
+                idle_tracker.forget(vm_id)
+        except Exception:
+            logger.exception("Error in idle VM hibernation loop")
+        await asyncio.sleep(30)
+
+
 async def _slave_heartbeat_loop():
     import httpx
-    from app.core.config import MASTER_URL, SLAVE_API_KEY
+    from app.core.config import MASTER_URL, SLAVE_API_KEY, system_monitor
     from app.services.host_service import HostService
     import psutil
 
@@ -212,6 +284,18 @@ async def _slave_heartbeat_loop():
                 "available_mem": round(host_info.mem.available, 2),
                 "available_disk": round(host_info.disk.available, 2),
             }
+            domains = domain_state_cache.entries()
+            if domains is not None:
+                heartbeat["vms"] = [
+                    {
+                        "id": name,
+                        "state": domain_state_cache.state_name(
+                            name, domain.state),
+                        "ipv4": domain.ipv4,
+                        "cpu": system_monitor.percent_used_by_vm.get(name),
+                    }
+                    for name, domain in domains.items()
+                ]
             async with httpx.AsyncClient(timeout=10.0) as client:
                 await client.post(
                     f"{MASTER_URL}/slaves/heartbeat",
@@ -250,3 +334,5 @@ else:
     app.include_router(tunnel.router, tags=["tunnel"])
     app.include_router(event.router, prefix="/events", tags=["events"])
     app.include_router(slave.router, prefix="/slaves", tags=["slaves"])
+    app.include_router(pool.router, prefix="/pools", tags=["pools"])
+    app.include_router(changes.router, prefix="/changes", tags=["changes"])
@@ -15,6 +15,11 @@ class EventCreate(BaseModel):
     keyboard_layout: Optional[str] = None
     deadline: datetime
     max_vms: int = Field(gt=0)
+    # Seconds a stop gives the VMs of the event before destroying them
+    shutdown_grace: Optional[int] = Field(default=None, ge=0)
+    prefetch_image: bool = True
+    # Ready VMs kept per node for participants to claim when they join
+    warm_pool_size: int = Field(default=0, ge=0)
 
 
 class EventUpdate(BaseModel):
@@ -27,6 +32,7 @@ class EventUpdate(BaseModel):
     keyboard_layout: Optional[str] = None
     deadline: Optional[datetime] = None
     max_vms: Optional[int] = Field(default=None, gt=0)
+    shutdown_grace: Optional[int] = Field(default=None, ge=0)
 
 
 class EventParticipantRead(BaseModel):
@@ -48,6 +54,7 @@ class EventRead(BaseModel):
     keyboard_layout: Optional[str] = None
     deadline: datetime
     max_vms: int
+    shutdown_grace: Optional[int] = None
     created_at: datetime
     created_by: str
     participants_count: int = 0
@@ -1,3 +1,5 @@
+from typing import Optional
+from uuid import UUID
 from pydantic import BaseModel, field_validator
 
 
@@ -8,6 +10,7 @@ class ImageBase(BaseModel):
     distribution: str
     family: str
     revision: int
+    sha256: Optional[str] = None
 
     @field_validator("version", mode="before")
     @classmethod
@@ -17,3 +20,27 @@ class ImageBase(BaseModel):
 
 class ImageRead(ImageBase):
     pass
+
+
+class ImageCacheStatus(BaseModel):
+    image: str
+    # "cached", "queued", "downloading", "missing", "failed" or
+    # "unreachable"
+    state: str
+    revision: Optional[int] = None
+    sha256: Optional[str] = None
+    bytes_done: int = 0
+    bytes_total: int = 0
+    error: Optional[str] = None
+
+
+class ImagePrefetchRequest(BaseModel):
+    image: str
+    slave_ids: list[UUID] = []
+    include_master: bool = False
+
+
+class NodeImageStatus(BaseModel):
+    node_id: Optional[UUID] = None
+    node_name: str
+    status: ImageCacheStatus
@@ -0,0 +1,18 @@
+from datetime import datetime
+from typing import Optional
+from uuid import UUID
+from pydantic import BaseModel
+
+
+class ProvisionJobRead(BaseModel):
+    id: UUID
+    status: str
+    phase: Optional[str] = None
+    progress: float = 0.0
+    error: Optional[str] = None
+    vm_id: Optional[UUID] = None
+    slave_id: Optional[UUID] = None
+    created_by: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    finished_at: Optional[datetime] = None
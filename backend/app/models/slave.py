@@ -27,6 +27,14 @@ class SlaveRead(BaseModel):
     available_disk: float
 
 
+class SlaveVmState(BaseModel):
+    id: str
+    state: str
+    ipv4: Optional[str] = None
+    # Percent of the slave CPU used, for running VMs
+    cpu: Optional[float] = None
+
+
 class SlaveHeartbeat(BaseModel):
     total_cpu: int
     total_mem: int
@@ -34,6 +42,8 @@ class SlaveHeartbeat(BaseModel):
     available_cpu: float
     available_mem: float
     available_disk: float
+    # Domains of the slave, left out while its state cache is stale
+    vms: Optional[list[SlaveVmState]] = None
 
 
 class SlaveHostInfo(BaseModel):
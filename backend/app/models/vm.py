@@ -1,5 +1,5 @@
 from typing import Optional
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from uuid import UUID
 from datetime import datetime
 from app.models.image import ImageRead
@@ -29,6 +29,94 @@ class VmCreate(VmBase):
     auto_place: bool = False
 
 
+# Upper bound on the number of VMs created by one bulk request
+MAX_BULK_VMS = 200
+
+
+class VmBulkCreate(BaseModel):
+    """Either ``count`` copies of ``template`` or an explicit ``vms`` list.
+
+    Copies are named ``<template.name>-<n>``.
+    """
+    template: Optional[VmCreate] = None
+    count: Optional[int] = Field(default=None, gt=0, le=MAX_BULK_VMS)
+    vms: list[VmCreate] = Field(default=[], max_length=MAX_BULK_VMS)
+
+    @model_validator(mode="after")
+    def check_items(self):
+        if self.vms and (self.template or self.count):
+            raise ValueError("Provide either vms or template and count")
+        if not self.vms and not (self.template and self.count):
+            raise ValueError("Provide either vms or template and count")
+        return self
+
+    def expand(self) -> list[VmCreate]:
+        if self.vms:
+            return list(self.vms)
+        return [
+            self.template.model_copy(
+                update={"name": f"{self.template.name}-{index + 1}"})
+            for index in range(self.count)
+        ]
+
+
+class VmBulkResult(BaseModel):
+    index: int
+    name: str
+    # "created" or "failed"
+    status: str
+    vm: Optional[VmRead] = None
+    error: Optional[str] = None
+
+
+class VmStopResult(VmRead):
+    # Shutdown stage after which the VM was off: "acpi", "agent" or
+    # "destroy", None if it already was
+    shutdown_stage: Optional[str] = None
+
+
+class VmShutdownPolicy(BaseModel):
+    # Seconds a stop gives the guest before destroying it, None to follow
+    # the event of the VM or the default
+    grace: Optional[int] = Field(default=None, ge=0)
+
+
+class VmShutdownPolicyRead(VmShutdownPolicy):
+    # Grace applied to the next stop
+    effective_grace: float
+
+
+class VmBulkSelection(BaseModel):
+    """VMs acted on by a bulk action: those matching every given criterion.
+
+    ``slave_id`` may be ``"master"`` for the VMs of the master, ``state``
+    is compared with the live state, case insensitively.
+    """
+    ids: list[UUID] = Field(default=[], max_length=MAX_BULK_VMS)
+    event_id: Optional[UUID] = None
+    slave_id: Optional[str] = None
+    state: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_criteria(self):
+        if not (self.ids or self.event_id or self.slave_id or self.state):
+            raise ValueError("Provide ids or at least one selector")
+        return self
+
+
+class VmBulkActionResult(BaseModel):
+    vm_id: UUID
+    name: str
+    action: str
+    # "succeeded" or "failed"
+    status: str
+    # State of the VM once done, None once deleted
+    state: Optional[str] = None
+    # Shutdown stage that ended the VM, for stops and restarts
+    stage: Optional[str] = None
+    error: Optional[str] = None
+
+
 class VmCreateXML(VmBase):
     id: UUID
 
@@ -0,0 +1,18 @@
+from datetime import datetime
+from typing import Optional
+from uuid import UUID
+from pydantic import BaseModel
+
+
+class VmOperationRead(BaseModel):
+    id: UUID
+    vm_id: UUID
+    action: str
+    status: str
+    # State of the VM when the operation finished
+    state: Optional[str] = None
+    # Shutdown stage that ended the VM, for stops
+    stage: Optional[str] = None
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
@@ -0,0 +1,46 @@
+from typing import Optional
+from uuid import UUID
+from datetime import datetime
+from pydantic import BaseModel, Field, model_validator
+
+
+class VmPoolProfileBase(BaseModel):
+    os: str
+    mem: int = Field(gt=0)
+    vcpus: int = Field(gt=0)
+    disk_size: int = Field(ge=0)
+    keyboard_layout: Optional[str] = None
+
+
+class VmPoolProfileCreate(VmPoolProfileBase):
+    target: int = Field(ge=0)
+    max: int = Field(ge=0)
+    boot: bool = True
+
+    @model_validator(mode="after")
+    def check_target(self):
+        if self.target > self.max:
+            raise ValueError("target must not exceed max")
+        return self
+
+
+class VmPoolProfileUpdate(BaseModel):
+    target: Optional[int] = Field(default=None, ge=0)
+    max: Optional[int] = Field(default=None, ge=0)
+    boot: Optional[bool] = None
+
+
+class VmPoolNodeStatus(BaseModel):
+    node_id: Optional[UUID] = None
+    node_name: str
+    ready: int
+
+
+class VmPoolProfileRead(VmPoolProfileBase):
+    id: UUID
+    target: int
+    max: int
+    boot: bool
+    event_id: Optional[UUID] = None
+    created_at: datetime
+    nodes: list[VmPoolNodeStatus] = []
@@ -20,6 +20,8 @@ class EventORM(SQLModel, table=True):
     keyboard_layout: Optional[str] = Field(default=None)
     deadline: datetime
     max_vms: int
+    # Shutdown grace of the VMs of the event that set none themselves
+    shutdown_grace: Optional[int] = Field(default=None)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     created_by: str
 
@@ -33,6 +35,7 @@ class EventParticipantORM(SQLModel, table=True):
             UUID(as_uuid=True),
             ForeignKey("events.id", ondelete="CASCADE"),
             nullable=False,
+            index=True,
         )
     )
     participant_name: str
@@ -41,6 +44,7 @@ class EventParticipantORM(SQLModel, table=True):
             UUID(as_uuid=True),
             ForeignKey("vms.id", ondelete="CASCADE"),
             nullable=False,
+            index=True,
         )
     )
     created_at: datetime = Field(default_factory=datetime.utcnow)
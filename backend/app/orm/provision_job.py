@@ -0,0 +1,32 @@
+from datetime import datetime, timezone
+import uuid
+from typing import Optional
+from sqlalchemy import JSON, Column
+from sqlmodel import Field, SQLModel
+
+
+class ProvisionJobORM(SQLModel, table=True):
+    __tablename__ = "provision_jobs"
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    # "queued", "running", "succeeded" or "failed"
+    status: str = Field(default="queued", index=True)
+    # "download", "clone", "seed", "define" or "boot"
+    phase: Optional[str] = Field(default=None)
+    progress: float = Field(default=0.0)
+    error: Optional[str] = Field(default=None)
+    payload: dict = Field(
+        default_factory=dict,
+        sa_column=Column(JSON, nullable=False),
+    )
+    vm_id: Optional[uuid.UUID] = Field(default=None)
+    slave_id: Optional[uuid.UUID] = Field(default=None)
+    # Job the VM is provisioned by on the slave, followed again after a
+    # restart of the master
+    slave_job_id: Optional[uuid.UUID] = Field(default=None)
+    created_by: Optional[str] = Field(default=None)
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc))
+    finished_at: Optional[datetime] = Field(default=None)
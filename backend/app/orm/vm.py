@@ -1,17 +1,29 @@
+from datetime import datetime
 from typing import Optional
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 import uuid
 
 
 class VmORM(SQLModel, table=True, ):
     __tablename__ = "vms"
+    # Keyset pagination of GET /vms in its default order
+    __table_args__ = (Index("ix_vms_name_id", "name", "id"),)
 
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     name: str
-    os: str
+    os: str = Field(index=True)
     mem: int
     vcpus: int
     disk_size: int
     keyboard_layout: Optional[str] = Field(default=None)
     slave_id: Optional[uuid.UUID] = Field(
-        default=None, foreign_key="slaves.id")
+        default=None, foreign_key="slaves.id", index=True)
+    # Set while the VM idles in a warm pool, cleared once it is claimed
+    pool_profile_id: Optional[uuid.UUID] = Field(
+        default=None, foreign_key="vm_pool_profiles.id", index=True)
+    # Seconds a stop gives the guest before destroying it, None to follow
+    # its event or VM_STOP_TIMEOUT
+    shutdown_grace: Optional[int] = Field(default=None)
+    # Set while the VM is saved to disk for being idle
+    hibernated_at: Optional[datetime] = Field(default=None)
@@ -0,0 +1,26 @@
+from typing import Optional
+from datetime import datetime, timezone
+from sqlmodel import SQLModel, Field
+import uuid
+
+
+class VmPoolProfileORM(SQLModel, table=True):
+    __tablename__ = "vm_pool_profiles"
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    os: str
+    mem: int
+    vcpus: int
+    disk_size: int
+    keyboard_layout: Optional[str] = Field(default=None)
+    # Ready VMs kept per node, and the most the refill may ever create
+    target: int = Field(default=0)
+    max: int = Field(default=0)
+    # Keep members running so a claim skips the boot as well
+    boot: bool = Field(default=True)
+    # Event the pool was made for, released with it; None for pools
+    # managed through /pools
+    event_id: Optional[uuid.UUID] = Field(
+        default=None, foreign_key="events.id", index=True)
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc))
@@ -0,0 +1,36 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, Query, status
+from fastapi.responses import StreamingResponse
+
+from app.models.user_management import MissingPoliciesResponse
+from app.services.change_stream import change_stream
+from app.utils.auth import require_policy_query_token
+
+router = APIRouter()
+
+
+@router.get(
+    "/",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(require_policy_query_token("vms:get"))],
+    responses={200: {"content": {"text/event-stream": {}},
+                     "description": "Server-sent VM, slave and host changes"},
+               403: {"model": MissingPoliciesResponse}},
+)
+async def stream_changes(
+    last_event_id: Optional[str] = Header(default=None),
+    after: Optional[str] = Query(
+        default=None, description="Id of the last event received"),
+):
+    """Events: vm.created, vm.updated, vm.deleted, vm.state, vm.ip,
+    slave.online, slave.offline, host.metrics, and reset when the client
+    must reload the full state.
+
+    The token is a query parameter since ``EventSource`` cannot send an
+    Authorization header."""
+    return StreamingResponse(
+        change_stream.subscribe(last_event_id or after),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-store"},
+    )
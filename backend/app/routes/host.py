@@ -1,6 +1,8 @@
 import logging
 from uuid import UUID
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from app.core.config import system_monitor
+from app.core.inventory import inventory_version, not_modified
 from app.services.host_service import HostService
 from app.services.slave_service import SlaveService
 from app.services.slave_client import slave_get_host_info
@@ -38,7 +40,13 @@ def get_slave_host_info(slave_id: UUID):
             response_model=ClusterHostInfo,
             dependencies=[Depends(require_policy("host:get"))],
             responses={403: {"model": MissingPoliciesResponse}})
-def get_cluster_host_info():
+def get_cluster_host_info(request: Request, response: Response):
+    # Usage figures change with every sample of the monitor, slave figures
+    # are then at most one sampling interval old
+    cached = not_modified(request, response,
+                          inventory_version.etag(system_monitor.generation))
+    if cached:
+        return cached
     master_info = HostService.get_host_info()
     nodes = [NodeHostInfo(node_id=None, node_name="Master",
                           host_info=master_info)]
@@ -1,6 +1,8 @@
 from fastapi import APIRouter, Depends, status
 from app.services.image_service import ImageService
-from app.models.image import ImageRead
+from app.models.image import (
+    ImageRead, ImagePrefetchRequest, NodeImageStatus,
+)
 from app.models.user_management import MissingPoliciesResponse
 from app.utils.auth import require_policy
 
@@ -17,3 +19,19 @@ def get_distribox_image_list():
         return ImageService.get_distribox_image_list()
     except Exception:
         raise
+
+
+@router.post("/prefetch", status_code=status.HTTP_202_ACCEPTED,
+             response_model=list[NodeImageStatus],
+             dependencies=[Depends(require_policy("images:prefetch"))],
+             responses={403: {"model": MissingPoliciesResponse}})
+def prefetch_image(payload: ImagePrefetchRequest):
+    return ImageService.prefetch_image(payload)
+
+
+@router.get("/{image}/status", status_code=status.HTTP_200_OK,
+            response_model=list[NodeImageStatus],
+            dependencies=[Depends(require_policy("images:get"))],
+            responses={403: {"model": MissingPoliciesResponse}})
+def get_image_status(image: str):
+    return ImageService.get_image_status(image)
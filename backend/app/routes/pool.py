@@ -0,0 +1,66 @@
+"""Master-side routes for managing warm VM pools."""
+from fastapi import APIRouter, Depends, status
+from app.models.user_management import MissingPoliciesResponse
+from app.models.vm_pool import (
+    VmPoolProfileCreate,
+    VmPoolProfileRead,
+    VmPoolProfileUpdate,
+)
+from app.services.warm_pool_service import WarmPoolService
+from app.utils.auth import require_policy
+
+router = APIRouter()
+
+
+@router.get(
+    "/",
+    status_code=status.HTTP_200_OK,
+    response_model=list[VmPoolProfileRead],
+    dependencies=[Depends(require_policy("pools:get"))],
+    responses={403: {"model": MissingPoliciesResponse}},
+)
+def list_pools():
+    return WarmPoolService.list_profiles()
+
+
+@router.get(
+    "/{profile_id}",
+    status_code=status.HTTP_200_OK,
+    response_model=VmPoolProfileRead,
+    dependencies=[Depends(require_policy("pools:get"))],
+    responses={403: {"model": MissingPoliciesResponse}},
+)
+def get_pool(profile_id: str):
+    return WarmPoolService.get_profile(profile_id)
+
+
+@router.post(
+    "/",
+    status_code=status.HTTP_201_CREATED,
+    response_model=VmPoolProfileRead,
+    dependencies=[Depends(require_policy("pools:manage"))],
+    responses={403: {"model": MissingPoliciesResponse}},
+)
+def create_pool(payload: VmPoolProfileCreate):
+    return WarmPoolService.create_profile(payload)
+
+
+@router.patch(
+    "/{profile_id}",
+    status_code=status.HTTP_200_OK,
+    response_model=VmPoolProfileRead,
+    dependencies=[Depends(require_policy("pools:manage"))],
+    responses={403: {"model": MissingPoliciesResponse}},
+)
+def update_pool(profile_id: str, payload: VmPoolProfileUpdate):
+    return WarmPoolService.update_profile(profile_id, payload)
+
+
+@router.delete(
+    "/{profile_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    dependencies=[Depends(require_policy("pools:manage"))],
+    responses={403: {"model": MissingPoliciesResponse}},
+)
+def delete_pool(profile_id: str):
+    WarmPoolService.delete_profile(profile_id)
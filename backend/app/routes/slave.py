@@ -1,11 +1,12 @@
 """Master-side routes for managing slave nodes."""
-from fastapi import APIRouter, Depends, Header, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response, status
 from app.models.slave import SlaveCreate, SlaveRead, SlaveHeartbeat
 from app.models.user_management import MissingPoliciesResponse
 from app.services.slave_service import SlaveService
 from app.utils.auth import require_policy
 from app.orm.slave import SlaveORM
 from app.core.config import engine
+from app.core.inventory import inventory_version, not_modified
 from sqlmodel import Session, select
 
 router = APIRouter()
@@ -34,7 +35,10 @@ def _verify_slave_token(
     dependencies=[Depends(require_policy("slaves:get"))],
     responses={403: {"model": MissingPoliciesResponse}},
 )
-def list_slaves():
+def list_slaves(request: Request, response: Response):
+    cached = not_modified(request, response, inventory_version.etag())
+    if cached:
+        return cached
     return SlaveService.list_slaves()
 
 
@@ -2,12 +2,21 @@
 
 All endpoints require X-Slave-Token authentication.
 """
-from fastapi import APIRouter, Depends, Response, status
-from app.models.vm import VmCreate, VmRead
-from app.services.vm_service import VmService
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from app.models.image import ImageCacheStatus, ImagePrefetchRequest
+from app.models.provision_job import ProvisionJobRead
+from app.models.vm import VmCreate, VmRead, VmStopResult
+from app.services.image_cache import image_cache
+from app.services.image_service import ImageService
+from app.services.provision_service import ProvisionService
+from app.services.vm_hibernation import HibernationService
+from app.services.vm_operation_service import VmOperationService
+from app.services.vm_query import parse_fields
+from app.services.vm_service import Vm, VmService
 from app.services.host_service import HostService
 from app.services.vm_screenshot import capture_screenshot
-from app.utils.vnc import get_vnc_port
 from app.utils.slave_auth import require_slave_token
 
 router = APIRouter()
@@ -23,14 +32,70 @@ def create_vm(vm: VmCreate):
     return VmService.create_vm(vm)
 
 
+@router.get(
+    "/vms",
+    status_code=status.HTTP_200_OK,
+    response_model=list[VmRead],
+    dependencies=[Depends(require_slave_token)],
+)
+def get_vm_list(
+    ids: Optional[list[str]] = Query(default=None),
+    fields: Optional[str] = None,
+):
+    # The ids filter the query itself, so the master asking for a few VMs
+    # costs the same whatever the number of VMs here. Fields left out keep
+    # placeholder values, the master drops them.
+    return VmService.get_vm_list(fields=parse_fields(fields), vm_ids=ids)
+
+
+@router.post(
+    "/vms/jobs",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=ProvisionJobRead,
+    dependencies=[Depends(require_slave_token)],
+)
+def create_provision_job(vm: VmCreate):
+    return ProvisionService.submit(vm)
+
+
+@router.post(
+    "/vms/jobs/bulk",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=list[ProvisionJobRead],
+    dependencies=[Depends(require_slave_token)],
+)
+def create_provision_batch(vms: list[VmCreate]):
+    return ProvisionService.submit_batch(vms)
+
+
+@router.get(
+    "/vms/jobs",
+    status_code=status.HTTP_200_OK,
+    response_model=list[ProvisionJobRead],
+    dependencies=[Depends(require_slave_token)],
+)
+def get_provision_jobs(ids: list[str] = Query(default=[])):
+    return ProvisionService.get_jobs(ids)
+
+
+@router.get(
+    "/vms/jobs/{job_id}",
+    status_code=status.HTTP_200_OK,
+    response_model=ProvisionJobRead,
+    dependencies=[Depends(require_slave_token)],
+)
+def get_provision_job(job_id: str):
+    return ProvisionService.get_job(job_id)
+
+
 @router.get(
     "/vms/{vm_id}",
     status_code=status.HTTP_200_OK,
     response_model=VmRead,
     dependencies=[Depends(require_slave_token)],
 )
-def get_vm(vm_id: str):
-    return VmService.get_vm(vm_id)
+def get_vm(vm_id: str, fields: Optional[str] = None):
+    return Vm.get(vm_id, parse_fields(fields))
 
 
 @router.post(
@@ -46,11 +111,11 @@ def start_vm(vm_id: str):
 @router.post(
     "/vms/{vm_id}/stop",
     status_code=status.HTTP_200_OK,
-    response_model=VmRead,
+    response_model=VmStopResult,
     dependencies=[Depends(require_slave_token)],
 )
-def stop_vm(vm_id: str):
-    return VmService.stop_vm(vm_id)
+async def stop_vm(vm_id: str, grace: Optional[float] = Query(None, ge=0)):
+    return await VmOperationService.perform(vm_id, "stop", grace)
 
 
 @router.delete(
@@ -62,13 +127,35 @@ def delete_vm(vm_id: str):
     VmService.remove_vm(vm_id)
 
 
+@router.post(
+    "/vms/{vm_id}/hibernate",
+    status_code=status.HTTP_204_NO_CONTENT,
+    dependencies=[Depends(require_slave_token)],
+)
+def hibernate_vm(vm_id: str):
+    if not HibernationService.hibernate_local(vm_id):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"VM {vm_id} is not running",
+        )
+
+
+@router.post(
+    "/vms/{vm_id}/resume",
+    status_code=status.HTTP_204_NO_CONTENT,
+    dependencies=[Depends(require_slave_token)],
+)
+def resume_vm(vm_id: str):
+    HibernationService.resume_local(vm_id)
+
+
 @router.get(
     "/vms/{vm_id}/vnc-port",
     status_code=status.HTTP_200_OK,
     dependencies=[Depends(require_slave_token)],
 )
 def get_vm_vnc_port(vm_id: str):
-    port = get_vnc_port(vm_id)
+    port = VmService.get_vnc_port(vm_id)
     return {"port": port}
 
 
@@ -93,3 +180,26 @@ def get_vm_screenshot(vm_id: str):
 )
 def get_host_info():
     return HostService.get_host_info()
+
+
+@router.post(
+    "/images/prefetch",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=ImageCacheStatus,
+    dependencies=[Depends(require_slave_token)],
+)
+def prefetch_image(payload: ImagePrefetchRequest):
+    ImageService.validate_image_name(payload.image)
+    image_cache.prefetch(payload.image)
+    return image_cache.status(payload.image)
+
+
+@router.get(
+    "/images/{image}/status",
+    status_code=status.HTTP_200_OK,
+    response_model=ImageCacheStatus,
+    dependencies=[Depends(require_slave_token)],
+)
+def get_image_status(image: str):
+    ImageService.validate_image_name(image)
+    return image_cache.status(image)
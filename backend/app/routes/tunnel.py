@@ -1,7 +1,7 @@
-from app.utils.vnc import get_vnc_port
 from app.utils.crypto import decrypt_secret
 from app.utils.auth import decode_access_token, user_has_policy
 from app.services.guacamole import guacd_handshake
+from app.services.vm_hibernation import HibernationService, idle_tracker
 from app.services.vm_service import VmService
 from app.orm.vm_credential import VmCredentialORM
 from app.orm.user import UserORM
@@ -145,6 +145,24 @@ async def vm_tunnel(
         await websocket.close(code=4001, reason="Provide credential or vm_id+token")
         return
 
+    # An open session keeps the VM from being hibernated as idle
+    idle_tracker.session_opened(resolved_vm_id)
+    try:
+        await _connect(websocket, resolved_vm_id, width, height)
+    finally:
+        idle_tracker.session_closed(resolved_vm_id)
+
+
+async def _connect(websocket: WebSocket, resolved_vm_id: str,
+                   width: int, height: int):
+    try:
+        # Restore a hibernated VM before looking up its display
+        await asyncio.to_thread(HibernationService.resume_vm, resolved_vm_id)
+    except Exception as exc:
+        detail = getattr(exc, "detail", str(exc))
+        await websocket.close(code=4002, reason=detail)
+        return
+
     slave = await asyncio.to_thread(VmService._get_slave_for_vm, resolved_vm_id)
 
     if slave:
@@ -160,7 +178,8 @@ async def vm_tunnel(
         vnc_host = VNC_HOST
     else:
         try:
-            vnc_port = await asyncio.to_thread(get_vnc_port, resolved_vm_id)
+            vnc_port = await asyncio.to_thread(
+                VmService.get_vnc_port, resolved_vm_id)
         except Exception as exc:
             detail = getattr(exc, "detail", str(exc))
             await websocket.close(code=4002, reason=detail)
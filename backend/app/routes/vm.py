@@ -1,18 +1,118 @@
 import asyncio
+from typing import Optional
+from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from fastapi.responses import Response
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from sqlmodel import Session
+from app.models.provision_job import ProvisionJobRead
+from app.models.vm_operation import VmOperationRead
 from app.models.user_management import MissingPoliciesResponse
-from app.models.vm import VmCreate, VmRead, VmCredentialCreateRequest, VmCredentialRead, RecoverableVm, RecoverableVmCreate, VmRename
+from app.models.vm import VmCreate, VmRead, VmCredentialCreateRequest, VmCredentialRead, RecoverableVm, RecoverableVmCreate, VmRename, VmBulkCreate, VmBulkSelection, VmBulkActionResult, VmStopResult, VmShutdownPolicy, VmShutdownPolicyRead
 from app.services.vm_service import VmService
+from app.services.vm_query import VmFilters, parse_fields
+from app.services.provision_service import ProvisionService
+from app.services.vm_bulk_action_service import VmBulkActionService
+from app.services.vm_operation_service import VmOperationService
 from app.services.vm_screenshot import capture_screenshot
 from app.utils.auth import require_policy, decode_access_token, user_has_policy
 from app.orm.user import UserORM
 from app.core.config import engine
+from app.core.inventory import inventory_version, not_modified
+from app.services.domain_state_cache import domain_state_cache
 
 router = APIRouter()
 
+MAX_VM_PAGE_SIZE = 500
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+FIELDS_DESCRIPTION = ("Comma separated fields to return, all by default. "
+                      "state and ipv4 need live lookups")
+
+
+def _partial(content, response: Response) -> JSONResponse:
+    """Send projected VMs as is, they do not match the full VmRead."""
+    return JSONResponse(jsonable_encoder(content), headers=response.headers)
+
+
+def _vm_not_modified(request: Request, response: Response):
+    """``not_modified`` for VM reads. While libvirt events are not received
+    local state changes bump no version, so no ETag is sent then."""
+    if not domain_state_cache.connected:
+        return None
+    return not_modified(request, response, inventory_version.etag())
+
+
+async def _bulk_action(action: str,
+                       selection: VmBulkSelection) -> StreamingResponse:
+    """Stream one VmBulkActionResult per line as each VM is done."""
+    rows = await asyncio.to_thread(VmBulkActionService.select, selection)
+
+    async def results():
+        async for result in VmBulkActionService.run(action, rows):
+            yield result.model_dump_json() + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+BULK_ACTION_RESPONSES = {
+    200: {"content": {"application/x-ndjson": {}},
+          "model": VmBulkActionResult,
+          "description": "One result per line, in the order VMs finish"},
+    403: {"model": MissingPoliciesResponse},
+}
+
+
+@router.get(
+    "/jobs",
+    status_code=status.HTTP_200_OK,
+    response_model=list[ProvisionJobRead],
+    dependencies=[Depends(require_policy("vms:get"))],
+    responses={403: {"model": MissingPoliciesResponse}},
+)
+def list_provision_jobs(active: bool = False):
+    return ProvisionService.list_jobs(active_only=active)
+
+
+@router.get(
+    "/operations/{operation_id}",
+    status_code=status.HTTP_200_OK,
+    response_model=VmOperationRead,
+    dependencies=[Depends(require_policy("vms:get"))],
+    responses={403: {"model": MissingPoliciesResponse}},
+)
+def get_vm_operation(operation_id: str):
+    return VmOperationService.get(operation_id)
+
+
+@router.get(
+    "/jobs/{job_id}",
+    status_code=status.HTTP_200_OK,
+    response_model=ProvisionJobRead,
+    dependencies=[Depends(require_policy("vms:get"))],
+    responses={403: {"model": MissingPoliciesResponse}},
+)
+def get_provision_job(job_id: str):
+    return ProvisionService.get_job(job_id)
+
+
+@router.get(
+    "/jobs/{job_id}/events",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(require_policy("vms:get"))],
+    responses={200: {"content": {"text/event-stream": {}},
+                     "description": "Server-sent job progress events"},
+               403: {"model": MissingPoliciesResponse}},
+)
+async def stream_provision_job(job_id: str):
+    # Fail fast with a 404 rather than an empty stream
+    await asyncio.to_thread(ProvisionService.get_job, job_id)
+    return StreamingResponse(
+        ProvisionService.stream_job(job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-store"},
+    )
+
 
 @router.get("/{vm_id}/screenshot",
             status_code=status.HTTP_200_OK,
@@ -109,8 +209,38 @@ def get_recoverable_vms():
     dependencies=[Depends(require_policy("vms:get"))],
     responses={403: {"model": MissingPoliciesResponse}},
 )
-def get_vm_list():
-    vm_list = VmService.get_vm_list()
+def get_vm_list(
+    request: Request,
+    response: Response,
+    state: Optional[str] = None,
+    slave_id: Optional[str] = Query(
+        default=None, description='Slave id, or "master"'),
+    os: Optional[str] = None,
+    name: Optional[str] = Query(default=None, description="Name prefix"),
+    event_id: Optional[UUID] = None,
+    sort: str = Query(
+        default="name", description="name, os, mem or vcpus, - to reverse"),
+    limit: Optional[int] = Query(default=None, ge=1, le=MAX_VM_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(default=None,
+                                  description=FIELDS_DESCRIPTION),
+):
+    cached = _vm_not_modified(request, response)
+    if cached:
+        return cached
+    projection = parse_fields(fields)
+    filters = VmFilters(os=os, name_prefix=name, event_id=event_id)
+    if slave_id == "master":
+        filters.master_only = True
+    elif slave_id:
+        filters.slave_id = VmService._parse_vm_id(slave_id)
+    vm_list, next_cursor = VmService.get_vm_page(
+        filters, state=state, sort=sort, limit=limit, cursor=cursor,
+        fields=projection)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    if projection is not None:
+        return _partial(vm_list, response)
     return vm_list
 
 
@@ -121,11 +251,56 @@ def get_vm_list():
     dependencies=[Depends(require_policy("vms:getById"))],
     responses={403: {"model": MissingPoliciesResponse}},
 )
-def get_vm(vm_id: str):
-    vm = VmService.get_vm(vm_id)
+def get_vm(
+    vm_id: str,
+    request: Request,
+    response: Response,
+    fields: Optional[str] = Query(default=None,
+                                  description=FIELDS_DESCRIPTION),
+):
+    cached = _vm_not_modified(request, response)
+    if cached:
+        return cached
+    projection = parse_fields(fields)
+    vm = VmService.get_vm(vm_id, projection)
+    if projection is not None:
+        return _partial(vm, response)
     return vm
 
 
+@router.post("/bulk/start",
+             status_code=status.HTTP_200_OK,
+             dependencies=[Depends(require_policy("vms:start"))],
+             responses=BULK_ACTION_RESPONSES)
+async def bulk_start_vms(selection: VmBulkSelection):
+    return await _bulk_action("start", selection)
+
+
+@router.post("/bulk/stop",
+             status_code=status.HTTP_200_OK,
+             dependencies=[Depends(require_policy("vms:stop"))],
+             responses=BULK_ACTION_RESPONSES)
+async def bulk_stop_vms(selection: VmBulkSelection):
+    return await _bulk_action("stop", selection)
+
+
+@router.post("/bulk/restart",
+             status_code=status.HTTP_200_OK,
+             dependencies=[Depends(require_policy("vms:start")),
+                           Depends(require_policy("vms:stop"))],
+             responses=BULK_ACTION_RESPONSES)
+async def bulk_restart_vms(selection: VmBulkSelection):
+    return await _bulk_action("restart", selection)
+
+
+@router.post("/bulk/delete",
+             status_code=status.HTTP_200_OK,
+             dependencies=[Depends(require_policy("vms:delete"))],
+             responses=BULK_ACTION_RESPONSES)
+async def bulk_delete_vms(selection: VmBulkSelection):
+    return await _bulk_action("delete", selection)
+
+
 @router.post("/{vm_id}/restart",
              status_code=status.HTTP_200_OK,
              response_model=VmRead,
@@ -151,32 +326,78 @@ def rename_vm(vm_id: str, vm_rename: VmRename):
              status_code=status.HTTP_200_OK,
              response_model=VmRead,
              dependencies=[Depends(require_policy("vms:start"))],
-             responses={403: {"model": MissingPoliciesResponse}})
-def start_vm(vm_id: str):
-    vm = VmService.start_vm(vm_id)
+             responses={202: {"model": VmOperationRead,
+                              "description": "Operation started"},
+                        403: {"model": MissingPoliciesResponse}})
+async def start_vm(vm_id: str, wait: bool = True):
+    if not wait:
+        operation = VmOperationService.submit(vm_id, "start")
+        return JSONResponse(jsonable_encoder(operation),
+                            status_code=status.HTTP_202_ACCEPTED)
+    vm = await VmOperationService.perform(vm_id, "start")
     return vm
 
 
 @router.post("/{vm_id}/stop",
              status_code=status.HTTP_200_OK,
-             response_model=VmRead,
+             response_model=VmStopResult,
              dependencies=[Depends(require_policy("vms:stop"))],
-             responses={403: {"model": MissingPoliciesResponse}})
-def stop_vm(vm_id: str):
-    vm = VmService.stop_vm(vm_id)
+             responses={202: {"model": VmOperationRead,
+                              "description": "Operation started"},
+                        403: {"model": MissingPoliciesResponse}})
+async def stop_vm(vm_id: str, wait: bool = True):
+    if not wait:
+        operation = VmOperationService.submit(vm_id, "stop")
+        return JSONResponse(jsonable_encoder(operation),
+                            status_code=status.HTTP_202_ACCEPTED)
+    vm = await VmOperationService.perform(vm_id, "stop")
     return vm
 
 
+@router.get("/{vm_id}/shutdown-policy",
+            status_code=status.HTTP_200_OK,
+            response_model=VmShutdownPolicyRead,
+            dependencies=[Depends(require_policy("vms:getById"))],
+            responses={403: {"model": MissingPoliciesResponse}})
+def get_vm_shutdown_policy(vm_id: str):
+    return VmService.get_shutdown_policy(vm_id)
+
+
+@router.post("/{vm_id}/shutdown-policy",
+             status_code=status.HTTP_200_OK,
+             response_model=VmShutdownPolicyRead,
+             dependencies=[Depends(require_policy("vms:setShutdownPolicy"))],
+             responses={403: {"model": MissingPoliciesResponse}})
+def set_vm_shutdown_policy(vm_id: str, policy: VmShutdownPolicy):
+    return VmService.set_shutdown_policy(vm_id, policy)
+
+
 @router.post(
     "/",
-    status_code=status.HTTP_201_CREATED,
-    response_model=VmRead,
-    dependencies=[Depends(require_policy("vms:create"))],
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=ProvisionJobRead,
+    responses={403: {"model": MissingPoliciesResponse}},
+)
+def create_vm(
+    vm: VmCreate,
+    current_user: UserORM = Depends(require_policy("vms:create")),
+):
+    return ProvisionService.submit(vm, current_user.username)
+
+
+@router.post(
+    "/bulk",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=list[ProvisionJobRead],
     responses={403: {"model": MissingPoliciesResponse}},
 )
-def create_vm(vm: VmCreate):
-    created_vm = VmService.create_vm(vm)
-    return created_vm
+def bulk_create_vms(
+    payload: VmBulkCreate,
+    current_user: UserORM = Depends(require_policy("vms:create")),
+):
+    """Queue a provisioning job per VM, in the order of the request."""
+    return ProvisionService.submit_batch(
+        payload.expand(), current_user.username, place=True)
 
 
 @router.post(
@@ -0,0 +1,252 @@
+"""Stream of VM, slave and host changes pushed to dashboards.
+
+Changes are numbered in the order they are published and the last
+``CHANGE_STREAM_BUFFER`` of them are kept, so a client that reconnects with
+the id of the last event it saw gets what it missed, or a ``reset`` event
+telling it to reload everything when that is no longer possible.
+
+They come from:
+
+- commits creating, renaming or deleting VMs, and changing the status of
+  slaves, seen through session events;
+- libvirt events of this node, through the domain state cache;
+- slave heartbeats, which carry the state and address of their VMs and
+  their host usage;
+- the system monitor of this node, for its host usage.
+"""
+import asyncio
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import ORMExecuteState, Session
+
+from app.core.config import CHANGE_STREAM_BUFFER
+from app.orm.slave import SlaveORM
+from app.orm.vm import VmORM
+
+STREAM_KEEPALIVE = 15.0
+
+_PENDING_KEY = "pending_changes"
+
+
+@dataclass
+class ChangeEvent:
+    seq: int
+    type: str
+    data: dict
+    at: float = field(default_factory=time.time)
+
+    def to_sse(self, epoch: str) -> str:
+        payload = json.dumps({"seq": self.seq, "at": self.at, **self.data})
+        return (f"id: {epoch}.{self.seq}\nevent: {self.type}\n"
+                f"data: {payload}\n\n")
+
+
+class ChangeStream:
+    def __init__(self, size: int):
+        # Event ids from another run of the backend cannot be resumed
+        self.epoch = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._events: deque[ChangeEvent] = deque(maxlen=size)
+        self._seq = 0
+        # (loop, event) of every subscriber, set on each change
+        self._waiters: set[tuple] = set()
+        # node -> (vm id -> (state, ipv4)) last reported by heartbeats
+        self._node_vms: dict[str, dict[str, tuple[str, Optional[str]]]] = {}
+        # node -> host usage last published
+        self._node_metrics: dict[str, dict] = {}
+
+    def publish(self, type: str, **data) -> None:
+        """Record a change and wake up subscribers, from any thread."""
+        with self._lock:
+            self._seq += 1
+            self._events.append(ChangeEvent(self._seq, type, data))
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Loop closed under a disconnected subscriber
+                pass
+
+    def since(self, seq: int) -> Optional[list[ChangeEvent]]:
+        """Events after ``seq``, or None if some were already dropped."""
+        with self._lock:
+            if seq > self._seq:
+                return None
+            if seq < self._seq and self._events[0].seq > seq + 1:
+                return None
+            return [event for event in self._events if event.seq > seq]
+
+    @property
+    def last_seq(self) -> int:
+        return self._seq
+
+    def parse_event_id(self, event_id: Optional[str]) -> Optional[int]:
+        """Sequence number of an event id, None if it is not from this run."""
+        if not event_id:
+            return None
+        epoch, _, seq = event_id.partition(".")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def _reset(self, seq: int) -> str:
+        return ChangeEvent(seq, "reset", {}).to_sse(self.epoch)
+
+    async def subscribe(
+        self,
+        last_event_id: Optional[str],
+    ) -> AsyncIterator[str]:
+        """Yield server-sent events from ``last_event_id`` on, forever.
+
+        Without a resumable id the stream starts with a ``reset`` event so
+        the client knows to load the current state before applying changes.
+        """
+        seq = self.parse_event_id(last_event_id)
+        if seq is None or self.since(seq) is None:
+            seq = self.last_seq
+            yield self._reset(seq)
+        loop, wakeup = asyncio.get_running_loop(), asyncio.Event()
+        with self._lock:
+            self._waiters.add((loop, wakeup))
+        try:
+            while True:
+                wakeup.clear()
+                events = self.since(seq)
+                if events is None:
+                    # Fell too far behind, start over
+                    seq = self.last_seq
+                    yield self._reset(seq)
+                    continue
+                for event in events:
+                    yield event.to_sse(self.epoch)
+                    seq = event.seq
+                try:
+                    await asyncio.wait_for(wakeup.wait(), STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            with self._lock:
+                self._waiters.discard((loop, wakeup))
+
+    def publish_node_vms(
+        self,
+        node: str,
+        vms: dict[str, tuple[str, Optional[str]]],
+    ) -> bool:
+        """Publish what changed since the last ``(state, ipv4)`` of every VM
+        a node reported, and tell whether anything did. The first report
+        only sets the baseline."""
+        with self._lock:
+            previous = self._node_vms.get(node)
+            self._node_vms[node] = dict(vms)
+        if previous is None:
+            return True
+        for vm_id, (state, ipv4) in vms.items():
+            old_state, old_ipv4 = previous.get(vm_id, (None, None))
+            if state != old_state:
+                self.publish("vm.state", id=vm_id, state=state)
+            if ipv4 and ipv4 != old_ipv4:
+                self.publish("vm.ip", id=vm_id, ipv4=ipv4)
+        return previous != vms
+
+    def publish_host_metrics(self, node: Optional[str], metrics: dict) -> bool:
+        """Publish the usage figures of a node that changed since last time,
+        and tell whether any did.
+
+        ``node`` is a slave id, None for this node.
+        """
+        key = node or ""
+        with self._lock:
+            previous = self._node_metrics.get(key, {})
+            self._node_metrics[key] = dict(metrics)
+        delta = {name: value for name, value in metrics.items()
+                 if previous.get(name) != value}
+        if delta:
+            self.publish("host.metrics", node_id=node, **delta)
+        return bool(delta)
+
+    def forget_node(self, node: str) -> None:
+        with self._lock:
+            self._node_vms.pop(node, None)
+            self._node_metrics.pop(node, None)
+
+
+change_stream = ChangeStream(CHANGE_STREAM_BUFFER)
+
+
+# Session hooks: changes are collected during flushes and published once
+# the transaction commits.
+
+def _pending(session: Session) -> list[tuple[str, dict]]:
+    return session.info.setdefault(_PENDING_KEY, [])
+
+
+def _vm_data(vm: VmORM) -> dict:
+    return {
+        "id": str(vm.id),
+        "name": vm.name,
+        "slave_id": str(vm.slave_id) if vm.slave_id else None,
+    }
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_flushed(session: Session, _flush_context) -> None:
+    changes = []
+    for obj in session.new:
+        if isinstance(obj, VmORM) and obj.pool_profile_id is None:
+            changes.append(("vm.created", _vm_data(obj)))
+    for obj in session.deleted:
+        if isinstance(obj, VmORM) and obj.pool_profile_id is None:
+            changes.append(("vm.deleted", {"id": str(obj.id)}))
+    for obj in session.dirty:
+        if isinstance(obj, VmORM):
+            attrs = inspect(obj).attrs
+            if (attrs.pool_profile_id.history.deleted and
+                    obj.pool_profile_id is None):
+                # Claimed from a warm pool, it only shows up now
+                changes.append(("vm.created", _vm_data(obj)))
+            elif attrs.name.history.has_changes():
+                changes.append(
+                    ("vm.updated", {"id": str(obj.id), "name": obj.name}))
+        elif isinstance(obj, SlaveORM):
+            history = inspect(obj).attrs.status.history
+            if history.has_changes() and obj.status in ("online", "offline"):
+                changes.append((f"slave.{obj.status}",
+                                {"id": str(obj.id), "name": obj.name}))
+    if changes:
+        _pending(session).extend(changes)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk_deletes(state: ORMExecuteState) -> None:
+    if not state.is_delete:
+        return
+    table = getattr(state.statement, "table", None)
+    if getattr(table, "name", None) != VmORM.__tablename__:
+        return
+    # Read the ids the statement is about to delete
+    ids = select(VmORM.id)
+    if state.statement.whereclause is not None:
+        ids = ids.where(state.statement.whereclause)
+    deleted = state.session.execute(ids).scalars().all()
+    _pending(state.session).extend(
+        ("vm.deleted", {"id": str(vm_id)}) for vm_id in deleted)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed(session: Session) -> None:
+    for type, data in session.info.pop(_PENDING_KEY, []):
+        change_stream.publish(type, **data)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_rolled_back(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
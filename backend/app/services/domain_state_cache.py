@@ -0,0 +1,471 @@
+"""In-memory view of the domains of this node, kept current by libvirt events.
+
+A thread runs the libvirt default event loop for a dedicated connection on
+which lifecycle, reboot and guest agent lifecycle callbacks are registered.
+Callbacks only queue the domain name; a second thread refreshes the entry
+(state, VNC port, IPv4 address) so no libvirt call is made from inside the
+event loop. The whole map is rebuilt on every (re)connection and every
+``VM_STATE_CACHE_MAX_AGE / 2`` seconds in case an event was lost.
+
+Guest addresses are looked up by a third thread, never by readers: a
+running domain without an address is polled with exponential backoff,
+from ``VM_IP_REFRESH_MIN_DELAY`` up to ``VM_IP_REFRESH_MAX_DELAY``
+seconds, until its guest agent or DHCP lease reports one.
+
+Power operations wait for a domain to reach a state through futures
+resolved by the refresh thread, instead of sleeping between state checks.
+
+Every change of a cached entry bumps the inventory version and is
+published on the change stream. Domains flagged as hibernated are
+published, and reported by ``state_name``, as hibernated rather than
+stopped once shut off. Readers get
+None rather than an entry older than ``VM_STATE_CACHE_MAX_AGE``
+or while the connection is down, and then query libvirt themselves.
+"""
+import asyncio
+import logging
+import math
+import queue
+import threading
+import time
+from concurrent.futures import (
+    Future,
+    InvalidStateError,
+    TimeoutError as FutureTimeoutError,
+)
+from dataclasses import dataclass, replace
+from typing import Iterable, Optional
+
+import libvirt
+from lxml import etree
+
+from app.core.config import (
+    LIBVIRT_URI,
+    QEMUConfig,
+    VM_IP_REFRESH_MAX_DELAY,
+    VM_IP_REFRESH_MIN_DELAY,
+    VM_STATE_CACHE_MAX_AGE,
+)
+from app.core.constants import VM_HIBERNATED_STATE, VM_STATE_NAMES
+from app.core.inventory import inventory_version
+from app.services.change_stream import change_stream
+from app.utils.vm import get_vm_ip, invalidate_vm_ip, wait_for_state
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_DELAY = 5.0
+# Seconds between keepalive probes, and unanswered probes before the
+# connection is considered dead
+KEEPALIVE_INTERVAL = 5
+KEEPALIVE_COUNT = 3
+# Seconds between state checks of waiters while there are no events
+POLL_INTERVAL = 0.5
+
+# Queued instead of a domain name to rebuild the whole map
+_RESYNC = object()
+
+
+@dataclass
+class DomainState:
+    state: int
+    vnc_port: Optional[int] = None
+    ipv4: Optional[str] = None
+    updated_at: float = 0.0
+
+
+def _vnc_port(domain) -> Optional[int]:
+    root = etree.fromstring(domain.XMLDesc().encode())
+    vnc_el = root.find('.//graphics[@type="vnc"]')
+    if vnc_el is None:
+        return None
+    port = int(vnc_el.get("port", "-1"))
+    return port if port >= 0 else None
+
+
+def _domain_state(name: str) -> int:
+    state, _ = QEMUConfig.get_connection().lookupByName(name).state()
+    return state
+
+
+class DomainStateCache:
+    def __init__(self, uri: str, max_age: float):
+        self.uri = uri
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._domains: dict[str, DomainState] = {}
+        self._synced_at = 0.0
+        self._conn: Optional[libvirt.virConnect] = None
+        self._queue: queue.Queue = queue.Queue()
+        self._started = False
+        # name -> (next lookup, current delay) of running domains without
+        # an address yet
+        self._ip_watch: dict[str, tuple[float, float]] = {}
+        self._ip_wakeup = threading.Condition(self._lock)
+        # name -> (awaited states, future) of state waiters
+        self._state_waiters: dict[str, list[tuple[frozenset, Future]]] = {}
+        # Domains saved to disk for being idle
+        self._hibernated: set[str] = set()
+
+    def start(self) -> None:
+        """Start the event loop and refresh threads."""
+        if self._started:
+            return
+        self._started = True
+        # Must happen before the connection that receives events is opened
+        libvirt.virEventRegisterDefaultImpl()
+        threading.Thread(target=self._event_loop, daemon=True,
+                         name="libvirt-events").start()
+        threading.Thread(target=self._refresh_loop, daemon=True,
+                         name="domain-state-cache").start()
+        threading.Thread(target=self._ip_loop, daemon=True,
+                         name="guest-ip-refresher").start()
+
+    # Reads
+
+    def _is_fresh(self, updated_at: float) -> bool:
+        return (self._conn is not None and
+                time.monotonic() - updated_at <= self.max_age)
+
+    def get(self, name: str) -> Optional[DomainState]:
+        """Cached entry of a domain, or None if unknown or possibly stale."""
+        with self._lock:
+            entry = self._domains.get(name)
+            if entry is None or not self._is_fresh(entry.updated_at):
+                return None
+            return replace(entry)
+
+    def states(self) -> Optional[dict[str, int]]:
+        """State of every domain with a fresh entry, or None if the map may
+        be stale. Readers look up the domains left out themselves."""
+        with self._lock:
+            if not self._is_fresh(self._synced_at):
+                return None
+            return {name: entry.state
+                    for name, entry in self._domains.items()
+                    if self._is_fresh(entry.updated_at)}
+
+    def entries(self) -> Optional[dict[str, DomainState]]:
+        """Every fresh entry, or None if the map may be stale."""
+        with self._lock:
+            if not self._is_fresh(self._synced_at):
+                return None
+            return {name: replace(entry)
+                    for name, entry in self._domains.items()
+                    if self._is_fresh(entry.updated_at)}
+
+    def invalidate(self, name: str) -> None:
+        """Mark a domain stale until its refresh, after changing it
+        directly."""
+        with self._lock:
+            entry = self._domains.get(name)
+            if entry is not None:
+                self._domains[name] = replace(entry, updated_at=0.0)
+        self._queue.put(name)
+
+    @property
+    def connected(self) -> bool:
+        return self._conn is not None
+
+    # Hibernation
+
+    def mark_hibernated(self, name: str, hibernated: bool) -> None:
+        """Follow the ``hibernated_at`` flag of a domain of this node."""
+        with self._lock:
+            if hibernated:
+                self._hibernated.add(name)
+            else:
+                self._hibernated.discard(name)
+
+    def state_name(self, name: str, state: int) -> str:
+        """Name of ``state`` for ``name``, hibernated if it is shut off
+        while flagged."""
+        with self._lock:
+            hibernated = name in self._hibernated
+        if hibernated and state == libvirt.VIR_DOMAIN_SHUTOFF:
+            return VM_HIBERNATED_STATE
+        return VM_STATE_NAMES.get(state, 'None')
+
+    def _publish_state(self, name: str, state: int) -> None:
+        change_stream.publish("vm.state", id=name,
+                              state=self.state_name(name, state))
+
+    # State waiters
+
+    def watch_state(self, name: str, states: Iterable[int]) -> Future:
+        """Future resolved with the state code of ``name`` once an event
+        shows it in one of ``states``. Stop watching with ``unwatch``."""
+        future: Future = Future()
+        with self._lock:
+            self._state_waiters.setdefault(name, []).append(
+                (frozenset(states), future))
+        return future
+
+    def unwatch(self, name: str, future: Future) -> None:
+        future.cancel()
+        with self._lock:
+            waiters = self._state_waiters.get(name, [])
+            waiters[:] = [waiter for waiter in waiters
+                          if waiter[1] is not future]
+            if not waiters:
+                self._state_waiters.pop(name, None)
+
+    def _notify_state(self, name: str, state: int) -> None:
+        with self._lock:
+            waiters = self._state_waiters.pop(name, None)
+            if not waiters:
+                return
+            pending = [(states, future) for states, future in waiters
+                       if not future.done() and state not in states]
+            if pending:
+                self._state_waiters[name] = pending
+        for states, future in waiters:
+            if state in states and not future.done():
+                try:
+                    future.set_result(state)
+                except InvalidStateError:
+                    # Cancelled meanwhile
+                    pass
+
+    def wait_for_state(self, domain, state: int, timeout: float) -> int:
+        """Block until ``domain`` is in ``state`` or ``timeout`` seconds
+        passed, and return the last state seen."""
+        if not self.connected:
+            return wait_for_state(domain, state, POLL_INTERVAL,
+                                  max(1, math.ceil(timeout / POLL_INTERVAL)))
+        future = self.watch_state(domain.name(), (state,))
+        try:
+            current, _ = domain.state()
+            if current == state:
+                return current
+            return future.result(timeout)
+        except FutureTimeoutError:
+            current, _ = domain.state()
+            return current
+        finally:
+            self.unwatch(domain.name(), future)
+
+    async def wait_for_state_async(self, name: str, state: int,
+                                   timeout: float) -> int:
+        """``wait_for_state`` for async code, holding no thread."""
+        future = self.watch_state(name, (state,))
+        deadline = time.monotonic() + timeout
+        try:
+            current = await asyncio.to_thread(_domain_state, name)
+            while current != state and time.monotonic() < deadline:
+                # Without events, check again every POLL_INTERVAL
+                wait = (deadline - time.monotonic() if self.connected
+                        else POLL_INTERVAL)
+                try:
+                    return await asyncio.wait_for(
+                        asyncio.shield(asyncio.wrap_future(future)),
+                        max(0.0, min(wait, deadline - time.monotonic())))
+                except asyncio.TimeoutError:
+                    current = await asyncio.to_thread(_domain_state, name)
+            return current
+        finally:
+            self.unwatch(name, future)
+
+    # Event loop thread
+
+    def _event_loop(self) -> None:
+        while True:
+            try:
+                libvirt.virEventRunDefaultImpl()
+            except libvirt.libvirtError:
+                logger.exception("libvirt event loop iteration failed")
+                time.sleep(1)
+
+    def _on_lifecycle(self, conn, domain, event, detail, opaque) -> None:
+        self._queue.put(domain.name())
+
+    def _on_reboot(self, conn, domain, opaque) -> None:
+        self._queue.put(domain.name())
+
+    def _on_agent_lifecycle(self, conn, domain, state, reason,
+                            opaque) -> None:
+        self._queue.put(domain.name())
+
+    def _on_close(self, conn, reason, opaque) -> None:
+        logger.warning("libvirt event connection closed (reason %s)", reason)
+        self._conn = None
+        self._queue.put(_RESYNC)
+
+    # Refresh thread
+
+    def _connect(self) -> None:
+        conn = libvirt.open(self.uri)
+        conn.setKeepAlive(KEEPALIVE_INTERVAL, KEEPALIVE_COUNT)
+        conn.registerCloseCallback(self._on_close, None)
+        conn.domainEventRegisterAny(
+            None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+            self._on_lifecycle, None)
+        conn.domainEventRegisterAny(
+            None, libvirt.VIR_DOMAIN_EVENT_ID_REBOOT, self._on_reboot, None)
+        conn.domainEventRegisterAny(
+            None, libvirt.VIR_DOMAIN_EVENT_ID_AGENT_LIFECYCLE,
+            self._on_agent_lifecycle, None)
+        self._conn = conn
+        logger.info("Listening to libvirt domain events on %s", self.uri)
+
+    def _refresh_loop(self) -> None:
+        while True:
+            if self._conn is None:
+                try:
+                    self._connect()
+                except libvirt.libvirtError as e:
+                    logger.warning("Failed to connect to %s for events: %s",
+                                   self.uri, e)
+                    time.sleep(RECONNECT_DELAY)
+                    continue
+                self._resync()
+            try:
+                item = self._queue.get(timeout=self.max_age / 2)
+            except queue.Empty:
+                item = _RESYNC
+            try:
+                if item is _RESYNC:
+                    self._resync()
+                else:
+                    self._refresh(item)
+            except libvirt.libvirtError as e:
+                logger.warning("Failed to refresh domain state cache: %s", e)
+
+    def _refresh(self, name: str) -> None:
+        conn = self._conn
+        if conn is None:
+            return
+        # Any change of a domain may change its address
+        invalidate_vm_ip(name)
+        try:
+            domain = conn.lookupByName(name)
+            state, _ = domain.state()
+            running = state == libvirt.VIR_DOMAIN_RUNNING
+            vnc_port = _vnc_port(domain) if running else None
+        except libvirt.libvirtError as e:
+            if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                raise
+            with self._lock:
+                removed = self._domains.pop(name, None)
+                self._ip_watch.pop(name, None)
+            if removed is not None:
+                inventory_version.bump()
+            return
+        with self._lock:
+            previous = self._domains.get(name)
+            # The address of a guest that kept running is still valid
+            ipv4 = (previous.ipv4 if running and previous is not None and
+                    previous.state == state else None)
+            self._domains[name] = DomainState(
+                state=state,
+                vnc_port=vnc_port,
+                ipv4=ipv4,
+                updated_at=time.monotonic(),
+            )
+            if running and ipv4 is None:
+                self._watch_ip(name)
+            else:
+                self._ip_watch.pop(name, None)
+        if (previous is None or
+                (previous.state, previous.vnc_port, previous.ipv4) !=
+                (state, vnc_port, ipv4)):
+            inventory_version.bump()
+        if previous is None or previous.state != state:
+            self._publish_state(name, state)
+        self._notify_state(name, state)
+
+    def _resync(self) -> None:
+        conn = self._conn
+        if conn is None:
+            return
+        stats = conn.getAllDomainStats(libvirt.VIR_DOMAIN_STATS_STATE)
+        now = time.monotonic()
+        with self._lock:
+            previous = self._domains
+            # The first map is the baseline, not a change
+            first_sync = self._synced_at == 0.0
+        domains: dict[str, DomainState] = {}
+        for domain, values in stats:
+            name = domain.name()
+            state = values["state.state"]
+            entry = previous.get(name)
+            if entry is not None and entry.state == state:
+                domains[name] = replace(entry, updated_at=now)
+                continue
+            # New domain or missed change: read what depends on the state
+            running = state == libvirt.VIR_DOMAIN_RUNNING
+            domains[name] = DomainState(
+                state=state,
+                vnc_port=_vnc_port(domain) if running else None,
+                updated_at=now,
+            )
+        with self._lock:
+            self._domains = domains
+            self._synced_at = now
+            for name in self._ip_watch.keys() - domains.keys():
+                del self._ip_watch[name]
+            for name, entry in domains.items():
+                if entry.state != libvirt.VIR_DOMAIN_RUNNING:
+                    self._ip_watch.pop(name, None)
+                elif entry.ipv4 is None and name not in self._ip_watch:
+                    self._watch_ip(name)
+        changed = [name for name, entry in domains.items()
+                   if name not in previous or
+                   previous[name].state != entry.state]
+        if changed or previous.keys() - domains.keys():
+            inventory_version.bump()
+        if not first_sync:
+            for name in changed:
+                self._publish_state(name, domains[name].state)
+        for name in changed:
+            self._notify_state(name, domains[name].state)
+
+    # Guest address thread
+
+    def _watch_ip(self, name: str) -> None:
+        """Look up the address of ``name`` soon, with the lock held."""
+        self._ip_watch[name] = (time.monotonic() + VM_IP_REFRESH_MIN_DELAY,
+                                VM_IP_REFRESH_MIN_DELAY)
+        self._ip_wakeup.notify()
+
+    def _ip_loop(self) -> None:
+        while True:
+            with self._ip_wakeup:
+                now = time.monotonic()
+                due = [name for name, (at, _) in self._ip_watch.items()
+                       if at <= now]
+                if not due:
+                    next_at = min(
+                        (at for at, _ in self._ip_watch.values()),
+                        default=None)
+                    self._ip_wakeup.wait(
+                        None if next_at is None else next_at - now)
+                    continue
+            for name in due:
+                try:
+                    self._lookup_ip(name)
+                except Exception:
+                    logger.exception("Failed to look up address of %s", name)
+
+    def _lookup_ip(self, name: str) -> None:
+        # Skip the miss cached by a previous attempt
+        invalidate_vm_ip(name)
+        ipv4 = get_vm_ip(name)
+        with self._lock:
+            watch = self._ip_watch.get(name)
+            if watch is None:
+                # Stopped or removed meanwhile
+                return
+            if ipv4 is None:
+                delay = min(watch[1] * 2, VM_IP_REFRESH_MAX_DELAY)
+                self._ip_watch[name] = (time.monotonic() + delay, delay)
+                return
+            del self._ip_watch[name]
+            entry = self._domains.get(name)
+            if entry is None or entry.ipv4 == ipv4:
+                return
+            self._domains[name] = replace(entry, ipv4=ipv4)
+        inventory_version.bump()
+        change_stream.publish("vm.ip", id=name, ipv4=ipv4)
+
+
+domain_state_cache = DomainStateCache(LIBVIRT_URI, VM_STATE_CACHE_MAX_AGE)
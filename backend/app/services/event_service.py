@@ -12,12 +12,15 @@ from app.models.event import (
     EventJoinRequest, EventJoinResponse, EventParticipantRead,
 )
 from app.models.vm import VmCreate, VmCredentialCreateRequest
+from app.models.vm_pool import VmPoolProfileBase, VmPoolProfileCreate
 from app.orm.event import EventORM, EventParticipantORM
 from app.orm.vm import VmORM
 from app.orm.vm_credential import VmCredentialORM
 from app.services.host_service import HostService
 from app.services.vm_service import VmService
 from app.services.slave_service import SlaveService
+from app.services.image_service import ImageService
+from app.services.warm_pool_service import WarmPoolService
 from app.services.slave_client import slave_get_host_info
 
 logger = logging.getLogger(__name__)
@@ -60,6 +63,7 @@ def _event_to_read(event: EventORM, participants: list[EventParticipantORM] | No
         keyboard_layout=event.keyboard_layout,
         deadline=event.deadline,
         max_vms=event.max_vms,
+        shutdown_grace=event.shutdown_grace,
         created_at=event.created_at,
         created_by=event.created_by,
         participants_count=count,
@@ -230,11 +234,29 @@ class EventService:
                 keyboard_layout=payload.keyboard_layout,
                 deadline=payload.deadline,
                 max_vms=payload.max_vms,
+                shutdown_grace=payload.shutdown_grace,
                 created_by=created_by,
             )
             session.add(event)
             session.commit()
             session.refresh(event)
+            if payload.warm_pool_size:
+                WarmPoolService.create_event_profile(event.id, VmPoolProfileCreate(
+                    os=payload.vm_os,
+                    mem=payload.vm_mem,
+                    vcpus=payload.vm_vcpus,
+                    disk_size=payload.vm_disk_size,
+                    keyboard_layout=payload.keyboard_layout,
+                    target=payload.warm_pool_size,
+                    max=payload.warm_pool_size,
+                ))
+            if payload.prefetch_image:
+                ImageService.prefetch_for_event(
+                    payload.vm_os,
+                    payload.vm_mem,
+                    payload.vm_vcpus,
+                    payload.vm_disk_size,
+                )
             return _event_to_read(event)
 
     @staticmethod
@@ -270,6 +292,18 @@ class EventService:
             session.commit()
             session.refresh(event)
 
+            if update_data.keys() & {"vm_os", "vm_mem", "vm_vcpus",
+                                     "vm_disk_size", "keyboard_layout"}:
+                # Ready VMs of the old shape are of no use to the event
+                WarmPoolService.reshape_event_profile(
+                    event.id, VmPoolProfileBase(
+                        os=event.vm_os,
+                        mem=event.vm_mem,
+                        vcpus=event.vm_vcpus,
+                        disk_size=event.vm_disk_size,
+                        keyboard_layout=event.keyboard_layout,
+                    ))
+
             participants = session.exec(
                 select(EventParticipantORM)
                 .where(EventParticipantORM.event_id == event.id)
@@ -279,8 +313,14 @@ class EventService:
 
     @staticmethod
     def delete_event(event_id: str) -> None:
+        parsed_id = _parse_uuid(event_id)
+        with Session(engine) as session:
+            if not session.get(EventORM, parsed_id):
+                raise HTTPException(status.HTTP_404_NOT_FOUND,
+                                    f"Event {event_id} not found")
+        WarmPoolService.release_event(parsed_id)
+
         with Session(engine) as session:
-            parsed_id = _parse_uuid(event_id)
             event = session.get(EventORM, parsed_id)
             if not event:
                 raise HTTPException(status.HTTP_404_NOT_FOUND,
@@ -386,20 +426,33 @@ class EventService:
 
         slave_id = EventService._pick_node_for_vm(
             event.vm_mem, event.vm_vcpus, event.vm_disk_size)
-        vm_create = VmCreate(
-            name=vm_name,
-            os=event.vm_os,
-            mem=event.vm_mem,
-            vcpus=event.vm_vcpus,
-            disk_size=event.vm_disk_size,
-            keyboard_layout=event.keyboard_layout,
-            activate_at_start=True,
+        pooled_vm = WarmPoolService.claim(
+            vm_name,
+            event.vm_os,
+            event.vm_mem,
+            event.vm_vcpus,
+            event.vm_disk_size,
+            event.keyboard_layout,
             slave_id=slave_id,
+            event_id=event.id,
         )
-        vm = VmService.create_vm(vm_create)
+        if pooled_vm:
+            vm_id = pooled_vm.id
+        else:
+            vm_create = VmCreate(
+                name=vm_name,
+                os=event.vm_os,
+                mem=event.vm_mem,
+                vcpus=event.vm_vcpus,
+                disk_size=event.vm_disk_size,
+                keyboard_layout=event.keyboard_layout,
+                activate_at_start=True,
+                slave_id=slave_id,
+            )
+            vm = VmService.create_vm(vm_create)
 
-        # create_vm returns a Vm object (local) or a dict (slave)
-        vm_id = vm["id"] if isinstance(vm, dict) else vm.id
+            # create_vm returns a Vm object (local) or a dict (slave)
+            vm_id = vm["id"] if isinstance(vm, dict) else vm.id
 
         credential_password = str(uuid.uuid4())[:12]
         credential = VmService.create_vm_credential(
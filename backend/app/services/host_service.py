@@ -4,6 +4,9 @@ from app.models.host import HostInfoBase
 from app.services.vm_service import VmService
 from app.core.config import system_monitor
 
+# Only the disk size of VMs counts, no need for their live state
+DISK_FIELDS = frozenset({"id", "disk_size"})
+
 
 class HostService:
 
@@ -20,7 +23,7 @@ class HostService:
             "distribox_used": sum([
                 vm.disk_size if hasattr(
                     vm, "disk_size") else vm.get("disk_size", 0)
-                for vm in VmService.get_vm_list()
+                for vm in VmService.get_vm_list(fields=DISK_FIELDS)
             ])
         }
         mem = {
@@ -32,3 +35,14 @@ class HostService:
         cpu = system_monitor.cpu
         host_info = HostInfoBase(disk=disk, mem=mem, cpu=cpu)
         return host_info
+
+    @staticmethod
+    def get_usage() -> dict:
+        """Usage figures of this node, cheaper than ``get_host_info``."""
+        mem_usage = psutil.virtual_memory()
+        return {
+            "cpu_percent": round(
+                system_monitor.cpu["percent_used_total"], 1),
+            "mem_available": round(mem_usage.available / 2**30, 2),
+            "disk_available": round(shutil.disk_usage("/").free / 2**30, 2),
+        }
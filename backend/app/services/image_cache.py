@@ -0,0 +1,438 @@
+"""Local cache of registry base images.
+
+Images are stored content-addressed under ``IMAGE_CACHE_DIR`` as
+``<sha256>.qcow2`` and tracked in a persistent JSON index keyed by image
+name, revision and content hash. Concurrent requests for the same image
+share a single download, registry revisions are checked in the background
+rather than on every VM create, and the cache is kept under
+``IMAGE_CACHE_MAX_GB`` by evicting the least recently used images that no
+VM disk depends on. Use times are kept in memory and written to the
+index with the next eviction or revision check.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Callable, Optional
+
+import yaml
+
+from app.core.config import (
+    s3,
+    distribox_bucket_registry,
+    IMAGE_CACHE_MAX_GB,
+    IMAGE_REVISION_CHECK_INTERVAL,
+)
+from app.core.constants import IMAGES_DIR, IMAGE_CACHE_DIR
+from app.models.image import ImageCacheStatus
+from app.services.image_service import ImageService
+from app.services.image_download import download_image
+
+logger = logging.getLogger(__name__)
+
+INDEX_PATH = IMAGES_DIR / "index.json"
+HASH_CHUNK_SIZE = 8 * 2**20
+
+
+@dataclass
+class CachedImage:
+    name: str
+    revision: int
+    sha256: str
+    size: int
+    last_used: float
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}:{self.revision}:{self.sha256}"
+
+    @property
+    def path(self) -> Path:
+        return IMAGE_CACHE_DIR / f"{self.sha256}.qcow2"
+
+    @property
+    def tag(self) -> str:
+        """Stable identifier for this image revision, used for base layers."""
+        return f"{Path(self.name).stem}.r{self.revision}"
+
+
+def metadata_key(image_name: str) -> str:
+    return image_name.replace("qcow2", "metadata.yaml")
+
+
+def hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ImageCache:
+    def __init__(self, max_bytes: int, check_interval: float):
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self._lock = threading.RLock()
+        self._entries: dict[str, CachedImage] = {}
+        # Whether a use time changed since the index was written
+        self._dirty = False
+        self._remote_revisions: dict[str, int] = {}
+        self._inflight: dict[str, Future] = {}
+        # Prefetches started but not in flight yet
+        self._queued: set[str] = set()
+        self._leases: dict[str, int] = {}
+        self._progress: dict[str, tuple[int, int]] = {}
+        self._errors: dict[str, str] = {}
+        self._listeners: dict[str, list[Callable[[int, int], None]]] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._load_index()
+
+    def start(self) -> None:
+        """Start the background revision checker."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._revision_check_loop, daemon=True)
+        self._thread.start()
+
+    def _load_index(self) -> None:
+        if not INDEX_PATH.exists():
+            return
+        try:
+            data = json.loads(INDEX_PATH.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            logger.exception("Failed to read image cache index, ignoring it")
+            return
+        for raw in data.get("images", []):
+            entry = CachedImage(**raw)
+            if entry.path.exists():
+                self._entries[entry.key] = entry
+
+    def _save_index(self) -> None:
+        INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = INDEX_PATH.with_suffix(".json.tmp")
+        tmp_path.write_text(
+            json.dumps({"images": [asdict(e)
+                       for e in self._entries.values()]}, indent=2),
+            encoding="utf-8",
+        )
+        os.replace(tmp_path, INDEX_PATH)
+        self._dirty = False
+
+    def flush(self) -> None:
+        """Write use times changed since the index was last written."""
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+    def _latest(self, name: str) -> Optional[CachedImage]:
+        candidates = [e for e in self._entries.values() if e.name == name]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda e: (e.revision, e.last_used))
+
+    def list_images(self) -> list[CachedImage]:
+        with self._lock:
+            return list(self._entries.values())
+
+    def get_progress(self, name: str) -> Optional[tuple[int, int]]:
+        """Return ``(bytes_done, bytes_total)`` of an ongoing download."""
+        with self._lock:
+            return self._progress.get(name)
+
+    def get_cached(self, name: str) -> Optional[CachedImage]:
+        with self._lock:
+            return self._latest(name)
+
+    def ensure(
+        self,
+        name: str,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> CachedImage:
+        """Return a cached copy of ``name``, downloading it if needed.
+
+        A cached image is used as-is unless the background checker has seen a
+        newer revision in the registry. ``progress`` is called with
+        ``(bytes_done, bytes_total)`` while a download of ``name`` runs,
+        whether this call started it or joined one already in flight.
+        """
+        if progress is None:
+            return self._ensure(name)
+        with self._lock:
+            self._listeners.setdefault(name, []).append(progress)
+        try:
+            return self._ensure(name)
+        finally:
+            with self._lock:
+                self._listeners[name].remove(progress)
+                if not self._listeners[name]:
+                    del self._listeners[name]
+
+    def _ensure(self, name: str) -> CachedImage:
+        with self._lock:
+            entry = self._latest(name)
+            remote_revision = self._remote_revisions.get(name)
+            if entry is not None and (remote_revision is None or
+                                      remote_revision <= entry.revision):
+                entry.last_used = time.time()
+                self._dirty = True
+                return entry
+            future = self._inflight.get(name)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[name] = future
+
+        if not owner:
+            return future.result()
+
+        try:
+            fetched = self._fetch(name)
+        except Exception as exc:
+            if entry is None:
+                future.set_exception(exc)
+                raise
+            # Keep serving the cached revision while the registry is
+            # unreachable rather than failing VM creation.
+            logger.warning("Failed to refresh image %s, using revision %s",
+                           name, entry.revision, exc_info=True)
+        else:
+            entry = fetched
+        finally:
+            with self._lock:
+                self._inflight.pop(name, None)
+        future.set_result(entry)
+        self.evict()
+        return entry
+
+    def prefetch(self, name: str) -> None:
+        """Make sure ``name`` is cached, downloading it in the background."""
+        with self._lock:
+            if name in self._inflight or name in self._queued:
+                return
+            self._errors.pop(name, None)
+            # Reported by status() until the download is in flight
+            self._queued.add(name)
+        threading.Thread(
+            target=self._prefetch, args=(name,), daemon=True).start()
+
+    def _prefetch(self, name: str) -> None:
+        try:
+            self.ensure(name)
+        except Exception as exc:
+            logger.exception("Failed to prefetch image %s", name)
+            with self._lock:
+                self._errors[name] = str(exc)
+        finally:
+            with self._lock:
+                self._queued.discard(name)
+
+    def status(self, name: str) -> ImageCacheStatus:
+        with self._lock:
+            entry = self._latest(name)
+            progress = self._progress.get(name)
+            if name in self._inflight:
+                state = "downloading"
+            elif name in self._queued:
+                state = "queued"
+            elif name in self._errors:
+                state = "failed"
+            elif entry is not None:
+                state = "cached"
+            else:
+                state = "missing"
+            bytes_done, bytes_total = progress or (0, 0)
+            if state == "cached":
+                bytes_done = bytes_total = entry.size
+            return ImageCacheStatus(
+                image=name,
+                state=state,
+                revision=entry.revision if entry else None,
+                sha256=entry.sha256 if entry else None,
+                bytes_done=bytes_done,
+                bytes_total=bytes_total,
+                error=self._errors.get(name),
+            )
+
+    @contextmanager
+    def use(
+        self,
+        name: str,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ):
+        """Ensure ``name`` is cached and protect it from eviction while used."""
+        entry = self.ensure(name, progress)
+        with self._lock:
+            self._leases[entry.key] = self._leases.get(entry.key, 0) + 1
+        try:
+            yield entry
+        finally:
+            with self._lock:
+                self._leases[entry.key] -= 1
+                if self._leases[entry.key] <= 0:
+                    del self._leases[entry.key]
+
+    def _fetch_metadata(self, name: str) -> dict:
+        response = s3.get_object(
+            Bucket=distribox_bucket_registry, Key=metadata_key(name))
+        return yaml.safe_load(response["Body"].read().decode("utf-8"))
+
+    def _fetch(self, name: str) -> CachedImage:
+        metadata = self._fetch_metadata(name)
+        revision = int(metadata["revision"])
+
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.name == name and entry.revision == revision:
+                    self._remote_revisions[name] = revision
+                    entry.last_used = time.time()
+                    self._dirty = True
+                    return entry
+
+        IMAGE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = IMAGE_CACHE_DIR / f".{name}.r{revision}.download"
+        legacy_path = IMAGES_DIR / name
+        if self._legacy_revision(name) == revision:
+            # Adopt an image downloaded before the cache existed
+            logger.info("Adopting legacy image %s revision %s", name, revision)
+            os.replace(legacy_path, tmp_path)
+            (IMAGES_DIR / metadata_key(name)).unlink(missing_ok=True)
+            sha256 = hash_file(tmp_path)
+        else:
+            logger.info("Downloading image %s revision %s", name, revision)
+            if not metadata.get("sha256"):
+                logger.warning(
+                    "Metadata of image %s has no sha256, it will not be "
+                    "verified; upload it again with atlas to record one",
+                    name)
+
+            def on_progress(done: int, total: int) -> None:
+                with self._lock:
+                    self._progress[name] = (done, total)
+                    listeners = list(self._listeners.get(name, ()))
+                for listener in listeners:
+                    listener(done, total)
+
+            try:
+                sha256 = download_image(
+                    distribox_bucket_registry,
+                    name,
+                    tmp_path,
+                    expected_sha256=metadata.get("sha256"),
+                    progress=on_progress,
+                )
+            finally:
+                with self._lock:
+                    self._progress.pop(name, None)
+
+        entry = CachedImage(
+            name=name,
+            revision=revision,
+            sha256=sha256,
+            size=tmp_path.stat().st_size,
+            last_used=time.time(),
+        )
+        os.replace(tmp_path, entry.path)
+        with self._lock:
+            self._entries[entry.key] = entry
+            self._remote_revisions[name] = revision
+            self._save_index()
+        return entry
+
+    @staticmethod
+    def _legacy_revision(name: str) -> Optional[int]:
+        legacy_metadata = IMAGES_DIR / metadata_key(name)
+        if not (IMAGES_DIR / name).exists() or not legacy_metadata.exists():
+            return None
+        try:
+            data = yaml.safe_load(legacy_metadata.read_text(encoding="utf-8"))
+            return int(data["revision"])
+        except Exception:
+            return None
+
+    def _is_evictable(self, entry: CachedImage) -> bool:
+        if self._leases.get(entry.key):
+            return False
+        if entry.name in self._inflight:
+            return False
+        try:
+            # Linked-clone base layers are hardlinks to the cached file
+            return entry.path.stat().st_nlink <= 1
+        except FileNotFoundError:
+            return True
+
+    def evict(self) -> list[CachedImage]:
+        """Drop least recently used images until the cache fits its budget.
+
+        Superseded revisions go first, then the remaining images in LRU
+        order. Images that back a VM disk or are in use are never evicted.
+        """
+        evicted: list[CachedImage] = []
+        with self._lock:
+            total = sum(e.size for e in self._entries.values())
+            if total <= self.max_bytes:
+                self.flush()
+                return evicted
+            latest = {e.name: self._latest(e.name)
+                      for e in self._entries.values()}
+            candidates = sorted(
+                self._entries.values(),
+                key=lambda e: (latest[e.name] is e, e.last_used),
+            )
+            for entry in candidates:
+                if total <= self.max_bytes:
+                    break
+                if not self._is_evictable(entry):
+                    continue
+                entry.path.unlink(missing_ok=True)
+                del self._entries[entry.key]
+                total -= entry.size
+                evicted.append(entry)
+                logger.info("Evicted image %s revision %s from cache",
+                            entry.name, entry.revision)
+            if evicted or self._dirty:
+                self._save_index()
+        return evicted
+
+    def check_revisions(self) -> None:
+        """Refresh known registry revisions and pull newer ones."""
+        with self._lock:
+            names = {e.name for e in self._entries.values()}
+        for name in names:
+            image = ImageService.get_distribox_image(metadata_key(name))
+            if image is None:
+                continue
+            with self._lock:
+                self._remote_revisions[name] = image.revision
+                current = self._latest(name)
+            if current is not None and image.revision > current.revision:
+                logger.info("Image %s has a new revision %s, refreshing",
+                            name, image.revision)
+                try:
+                    self.ensure(name)
+                except Exception:
+                    logger.exception("Failed to refresh image %s", name)
+
+    def _revision_check_loop(self) -> None:
+        while True:
+            try:
+                self.check_revisions()
+            except Exception:
+                logger.exception("Image revision check failed")
+            try:
+                self.flush()
+            except OSError:
+                logger.exception("Failed to write image cache index")
+            time.sleep(self.check_interval)
+
+
+image_cache = ImageCache(
+    max_bytes=int(IMAGE_CACHE_MAX_GB * 2**30),
+    check_interval=IMAGE_REVISION_CHECK_INTERVAL,
+)
@@ -0,0 +1,223 @@
+"""Parallel, resumable download of registry images.
+
+The object is fetched with concurrent byte-range GETs into ``<dest>.part``.
+Completed chunks are recorded in ``<dest>.part.json`` so an interrupted
+transfer resumes where it stopped instead of restarting from zero. The
+SHA-256 of the file is computed in order while chunks arrive, checked
+against the expected digest when one is known, and the finished file is
+atomically renamed to ``dest``. Any S3-compatible endpoint works, see
+``S3_ENDPOINT_URL``.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Optional
+
+from app.core.config import (
+    s3,
+    IMAGE_DOWNLOAD_CHUNK_MB,
+    IMAGE_DOWNLOAD_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+CHUNK_ATTEMPTS = 3
+READ_SIZE = 2**20
+
+ProgressCallback = Callable[[int, int], None]
+
+
+class ChecksumMismatch(Exception):
+    pass
+
+
+class RangedDownload:
+    def __init__(
+        self,
+        bucket: str,
+        key: str,
+        dest: Path,
+        expected_sha256: Optional[str] = None,
+        progress: Optional[ProgressCallback] = None,
+        chunk_size: int = IMAGE_DOWNLOAD_CHUNK_MB * 2**20,
+        workers: int = IMAGE_DOWNLOAD_WORKERS,
+    ):
+        self.bucket = bucket
+        self.key = key
+        self.dest = dest
+        self.expected_sha256 = expected_sha256
+        self.progress = progress
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.part_path = dest.with_name(dest.name + ".part")
+        self.state_path = dest.with_name(dest.name + ".part.json")
+        self._cond = threading.Condition()
+        self._done: set[int] = set()
+        self._failed: Optional[BaseException] = None
+        self._bytes_done = 0
+
+    def _load_state(self, size: int, etag: str) -> set[int]:
+        if not self.part_path.exists() or not self.state_path.exists():
+            return set()
+        try:
+            state = json.loads(self.state_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return set()
+        if (state.get("size") != size or state.get("etag") != etag or
+                state.get("chunk_size") != self.chunk_size):
+            return set()
+        if self.part_path.stat().st_size != size:
+            return set()
+        return set(state.get("done", []))
+
+    def _save_state(self, size: int, etag: str) -> None:
+        tmp_path = self.state_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({
+            "size": size,
+            "etag": etag,
+            "chunk_size": self.chunk_size,
+            "done": sorted(self._done),
+        }), encoding="utf-8")
+        os.replace(tmp_path, self.state_path)
+
+    def _chunk_range(self, index: int, size: int) -> tuple[int, int]:
+        start = index * self.chunk_size
+        return start, min(start + self.chunk_size, size) - 1
+
+    def _report(self, size: int) -> None:
+        if self.progress is not None:
+            try:
+                self.progress(self._bytes_done, size)
+            except Exception:
+                logger.exception("Download progress callback failed")
+
+    def _fetch_chunk(self, fd: int, index: int, size: int, etag: str) -> None:
+        start, end = self._chunk_range(index, size)
+        for attempt in range(1, CHUNK_ATTEMPTS + 1):
+            if self._failed is not None:
+                return
+            try:
+                response = s3.get_object(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    Range=f"bytes={start}-{end}",
+                    IfMatch=etag,
+                )
+                offset = start
+                body = response["Body"]
+                while data := body.read(READ_SIZE):
+                    os.pwrite(fd, data, offset)
+                    offset += len(data)
+                if offset != end + 1:
+                    raise IOError(
+                        f"Short read for bytes {start}-{end} of {self.key}")
+                # Only record the chunk once it is durable, so a resume
+                # never trusts data lost in a crash
+                os.fdatasync(fd)
+                break
+            except Exception:
+                if attempt == CHUNK_ATTEMPTS:
+                    raise
+                logger.warning("Retrying chunk %d of %s (attempt %d)",
+                               index, self.key, attempt, exc_info=True)
+        with self._cond:
+            self._done.add(index)
+            self._bytes_done += end - start + 1
+            self._save_state(size, etag)
+            self._cond.notify_all()
+        self._report(size)
+
+    def _run_chunk(self, fd: int, index: int, size: int, etag: str) -> None:
+        try:
+            self._fetch_chunk(fd, index, size, etag)
+        except BaseException as exc:
+            with self._cond:
+                if self._failed is None:
+                    self._failed = exc
+                self._cond.notify_all()
+
+    def _hash_in_order(self, fd: int, chunk_count: int, size: int) -> str:
+        """Hash chunks in file order as soon as each one has landed."""
+        digest = hashlib.sha256()
+        for index in range(chunk_count):
+            with self._cond:
+                while index not in self._done and self._failed is None:
+                    self._cond.wait()
+                if self._failed is not None:
+                    raise self._failed
+            start, end = self._chunk_range(index, size)
+            offset = start
+            while offset <= end:
+                data = os.pread(fd, min(READ_SIZE, end + 1 - offset), offset)
+                if not data:
+                    raise IOError(f"Unexpected end of {self.part_path}")
+                digest.update(data)
+                offset += len(data)
+        return digest.hexdigest()
+
+    def run(self) -> str:
+        """Download the object to ``dest`` and return its SHA-256."""
+        head = s3.head_object(Bucket=self.bucket, Key=self.key)
+        size = head["ContentLength"]
+        etag = head["ETag"]
+        chunk_count = -(-size // self.chunk_size)
+
+        self.dest.parent.mkdir(parents=True, exist_ok=True)
+        self._done = self._load_state(size, etag)
+        if self._done:
+            logger.info("Resuming %s with %d/%d chunks already downloaded",
+                        self.key, len(self._done), chunk_count)
+        else:
+            with open(self.part_path, "wb") as f:
+                f.truncate(size)
+        self._bytes_done = sum(
+            end - start + 1
+            for start, end in (self._chunk_range(i, size) for i in self._done)
+        )
+        self._report(size)
+
+        fd = os.open(self.part_path, os.O_RDWR)
+        try:
+            pending = [i for i in range(chunk_count) if i not in self._done]
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for index in pending:
+                    pool.submit(self._run_chunk, fd, index, size, etag)
+                try:
+                    sha256 = self._hash_in_order(fd, chunk_count, size)
+                except BaseException:
+                    with self._cond:
+                        if self._failed is None:
+                            self._failed = RuntimeError("Download aborted")
+                    raise
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        if self.expected_sha256 and sha256 != self.expected_sha256.lower():
+            self.part_path.unlink(missing_ok=True)
+            self.state_path.unlink(missing_ok=True)
+            raise ChecksumMismatch(
+                f"Checksum mismatch for {self.key}: expected "
+                f"{self.expected_sha256}, got {sha256}")
+
+        os.replace(self.part_path, self.dest)
+        self.state_path.unlink(missing_ok=True)
+        return sha256
+
+
+def download_image(
+    bucket: str,
+    key: str,
+    dest: Path,
+    expected_sha256: Optional[str] = None,
+    progress: Optional[ProgressCallback] = None,
+) -> str:
+    return RangedDownload(
+        bucket, key, dest,
+        expected_sha256=expected_sha256,
+        progress=progress,
+    ).run()
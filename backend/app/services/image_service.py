@@ -1,8 +1,19 @@
 import logging
 import subprocess
 import json
+import threading
 import yaml
-from app.models.image import ImageRead
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from fastapi import HTTPException, status
+from app.models.image import (
+    ImageRead, ImageCacheStatus, ImagePrefetchRequest, NodeImageStatus,
+)
+from app.orm.slave import SlaveORM
+from app.services.slave_service import SlaveService
+from app.services.slave_client import (
+    slave_prefetch_image, slave_get_image_status,
+)
 from pathlib import Path
 from app.core.config import s3, distribox_bucket_registry
 
@@ -45,3 +56,109 @@ class ImageService():
                     except Exception:
                         logger.warning("Failed to parse image %s", key)
         return images
+
+    @staticmethod
+    def validate_image_name(image: str) -> None:
+        if not image.endswith(".qcow2") or "/" in image:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid image '{image}': expected .qcow2 image",
+            )
+
+    @staticmethod
+    def _on_nodes(
+        slaves: list[SlaveORM],
+        include_master: bool,
+        image: str,
+        local: Callable[[str], ImageCacheStatus],
+        remote: Callable[[SlaveORM, str], dict],
+    ) -> list[NodeImageStatus]:
+        """Run an image cache action on the master and slaves concurrently."""
+        def run_on_slave(slave: SlaveORM) -> NodeImageStatus:
+            try:
+                cache_status = ImageCacheStatus(**remote(slave, image))
+            except Exception as exc:
+                logger.warning("Image %s on slave %s: %s",
+                               image, slave.name, exc)
+                cache_status = ImageCacheStatus(
+                    image=image,
+                    state="unreachable",
+                    error=str(getattr(exc, "detail", exc)),
+                )
+            return NodeImageStatus(
+                node_id=slave.id,
+                node_name=slave.name,
+                status=cache_status,
+            )
+
+        nodes = []
+        if include_master:
+            nodes.append(NodeImageStatus(
+                node_id=None,
+                node_name="Master",
+                status=local(image),
+            ))
+        if slaves:
+            with ThreadPoolExecutor(max_workers=len(slaves)) as pool:
+                nodes.extend(pool.map(run_on_slave, slaves))
+        return nodes
+
+    @staticmethod
+    def prefetch_image(payload: ImagePrefetchRequest) -> list[NodeImageStatus]:
+        """Pre-stage an image in the cache of the selected nodes."""
+        # Imported here: the image cache itself depends on ImageService
+        from app.services.image_cache import image_cache
+
+        ImageService.validate_image_name(payload.image)
+        slaves = [SlaveService.get_slave(str(slave_id))
+                  for slave_id in payload.slave_ids]
+
+        def prefetch_local(image: str) -> ImageCacheStatus:
+            image_cache.prefetch(image)
+            return image_cache.status(image)
+
+        return ImageService._on_nodes(
+            slaves, payload.include_master, payload.image,
+            prefetch_local, slave_prefetch_image,
+        )
+
+    @staticmethod
+    def get_image_status(image: str) -> list[NodeImageStatus]:
+        """Report which revision of an image each node has cached."""
+        from app.services.image_cache import image_cache
+
+        ImageService.validate_image_name(image)
+        return ImageService._on_nodes(
+            SlaveService.get_online_slaves(), True, image,
+            image_cache.status, slave_get_image_status,
+        )
+
+    @staticmethod
+    def prefetch_for_event(
+        image: str,
+        required_mem: int,
+        required_vcpus: int,
+        required_disk: int,
+    ) -> None:
+        """Pre-stage an event image on every node that could host its VMs.
+
+        Runs in the background so event creation does not wait on slaves.
+        """
+
+        def run() -> None:
+            try:
+                candidates = [
+                    slave.id for slave in SlaveService.get_online_slaves()
+                    if slave.available_mem >= required_mem and
+                    slave.total_cpu >= required_vcpus and
+                    slave.available_disk >= required_disk
+                ]
+                ImageService.prefetch_image(ImagePrefetchRequest(
+                    image=image,
+                    slave_ids=candidates,
+                    include_master=True,
+                ))
+            except Exception:
+                logger.exception("Failed to prefetch event image %s", image)
+
+        threading.Thread(target=run, daemon=True).start()
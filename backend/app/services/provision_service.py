@@ -0,0 +1,378 @@
+"""Asynchronous VM provisioning.
+
+``POST /vms`` records a job and returns at once; a bounded pool of workers
+runs the download, clone, seed, define and boot phases and persists the
+job state so clients can poll it or subscribe to its progress. Jobs placed
+on a slave are submitted as jobs there and followed by the slave job
+poller, so they only hold a worker while they are submitted. The id of the
+slave job is kept so a restarted master follows it again.
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import AsyncIterator, Callable, Optional
+
+from fastapi import HTTPException, status
+from sqlmodel import Session, select
+
+from app.core.config import engine, PROVISION_WORKERS
+from app.models.provision_job import ProvisionJobRead
+from app.models.vm import VmBulkResult, VmCreate
+from app.orm.provision_job import ProvisionJobORM
+from app.orm.slave import SlaveORM
+from app.services.slave_client import slave_submit_provision_job
+from app.services.slave_job_poller import slave_job_poller
+from app.services.vm_service import Vm, VmService
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ("queued", "running")
+# Progress is persisted at most this often within a phase
+PROGRESS_INTERVAL = 0.5
+STREAM_KEEPALIVE = 15.0
+LIST_LIMIT = 50
+
+_executor = ThreadPoolExecutor(
+    max_workers=PROVISION_WORKERS, thread_name_prefix="provision")
+# Bumped on every job change, so progress streams wake up without polling
+_updates = threading.Condition()
+_versions: dict[uuid.UUID, int] = {}
+
+
+def _parse_job_id(job_id: str) -> uuid.UUID:
+    try:
+        return uuid.UUID(job_id)
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid ID format",
+        ) from exc
+
+
+def _notify(job_id: uuid.UUID, finished: bool = False) -> None:
+    with _updates:
+        if finished:
+            # Waiters see the version change and read the final state
+            _versions.pop(job_id, None)
+        else:
+            _versions[job_id] = _versions.get(job_id, 0) + 1
+        _updates.notify_all()
+
+
+class ProvisionService:
+
+    @staticmethod
+    def submit(
+        vm_create: VmCreate,
+        created_by: Optional[str] = None,
+    ) -> ProvisionJobRead:
+        Vm._resolve_image_name(vm_create.os)
+        with Session(engine) as session:
+            job = ProvisionJobORM(
+                payload=vm_create.model_dump(mode="json"),
+                slave_id=vm_create.slave_id,
+                created_by=created_by,
+            )
+            session.add(job)
+            session.commit()
+            session.refresh(job)
+            job_read = ProvisionJobRead.model_validate(job.model_dump())
+        _executor.submit(ProvisionService._run, job_read.id)
+        return job_read
+
+    @staticmethod
+    def submit_batch(
+        vms: list[VmCreate],
+        created_by: Optional[str] = None,
+        place: bool = False,
+    ) -> list[ProvisionJobRead]:
+        """Record a job per VM and create them together in the
+        background, sharing preparation as ``VmBulkService`` does.
+
+        With ``place`` the VMs are spread over the nodes like
+        ``VmBulkService.create`` does, otherwise they are created here.
+        """
+        for vm_create in vms:
+            Vm._resolve_image_name(vm_create.os)
+        with Session(engine) as session:
+            jobs = [
+                ProvisionJobORM(payload=vm_create.model_dump(mode="json"),
+                                slave_id=vm_create.slave_id,
+                                created_by=created_by)
+                for vm_create in vms
+            ]
+            session.add_all(jobs)
+            session.commit()
+            job_reads = [ProvisionJobRead.model_validate(job.model_dump())
+                         for job in jobs]
+        threading.Thread(
+            target=ProvisionService._run_batch,
+            args=([job.id for job in job_reads], vms, place),
+            daemon=True,
+            name="provision-batch",
+        ).start()
+        return job_reads
+
+    @staticmethod
+    def _run_batch(
+        job_ids: list[uuid.UUID],
+        vms: list[VmCreate],
+        place: bool,
+    ) -> None:
+        from app.services.vm_bulk_service import VmBulkService
+
+        for job_id in job_ids:
+            ProvisionService._update(job_id, status="running")
+        pending = set(job_ids)
+
+        def finished(result: VmBulkResult) -> None:
+            job_id = job_ids[result.index]
+            pending.discard(job_id)
+            if result.status != "created":
+                ProvisionService._update(
+                    job_id,
+                    status="failed",
+                    error=result.error,
+                    finished_at=datetime.now(timezone.utc),
+                )
+                return
+            ProvisionService._succeed(job_id, result.vm)
+
+        create = VmBulkService.create if place else VmBulkService.create_local
+        try:
+            create(vms, finished)
+        except Exception as exc:
+            logger.exception("Provisioning batch failed")
+            for job_id in pending:
+                ProvisionService._fail(job_id, exc)
+
+    @staticmethod
+    def get_job(job_id: str) -> ProvisionJobRead:
+        with Session(engine) as session:
+            job = session.get(ProvisionJobORM, _parse_job_id(job_id))
+            if not job:
+                raise HTTPException(status.HTTP_404_NOT_FOUND,
+                                    f"Job {job_id} not found")
+            return ProvisionJobRead.model_validate(job.model_dump())
+
+    @staticmethod
+    def get_jobs(job_ids: list[str]) -> list[ProvisionJobRead]:
+        """Jobs of ``job_ids``, leaving out those that do not exist."""
+        parsed_ids = [_parse_job_id(job_id) for job_id in job_ids]
+        with Session(engine) as session:
+            jobs = session.exec(
+                select(ProvisionJobORM)
+                .where(ProvisionJobORM.id.in_(parsed_ids))
+            ).all()
+            return [ProvisionJobRead.model_validate(job.model_dump())
+                    for job in jobs]
+
+    @staticmethod
+    def list_jobs(active_only: bool = False) -> list[ProvisionJobRead]:
+        with Session(engine) as session:
+            statement = select(ProvisionJobORM)
+            if active_only:
+                statement = statement.where(
+                    ProvisionJobORM.status.in_(ACTIVE_STATUSES))
+            jobs = session.exec(
+                statement
+                .order_by(ProvisionJobORM.created_at.desc())
+                .limit(LIST_LIMIT)
+            ).all()
+            return [ProvisionJobRead.model_validate(job.model_dump())
+                    for job in jobs]
+
+    @staticmethod
+    def resume_interrupted_jobs() -> None:
+        """Follow again the jobs handed to a slave by the previous process,
+        which the slave kept running, and fail the others, whose worker died
+        with it."""
+        followed: list[tuple[uuid.UUID, VmCreate, SlaveORM, uuid.UUID]] = []
+        failed = 0
+        with Session(engine) as session:
+            jobs = session.exec(
+                select(ProvisionJobORM)
+                .where(ProvisionJobORM.status.in_(ACTIVE_STATUSES))
+            ).all()
+            now = datetime.now(timezone.utc)
+            for job in jobs:
+                slave = (session.get(SlaveORM, job.slave_id)
+                         if job.slave_job_id is not None else None)
+                if slave is not None:
+                    session.expunge(slave)
+                    followed.append((job.id, VmCreate(**job.payload), slave,
+                                     job.slave_job_id))
+                    continue
+                job.status = "failed"
+                job.error = "Interrupted by a restart"
+                job.updated_at = now
+                job.finished_at = now
+                session.add(job)
+                failed += 1
+            session.commit()
+        if failed:
+            logger.warning("Marked %d interrupted provisioning jobs as failed",
+                           failed)
+        for job_id, vm_create, slave, slave_job_id in followed:
+            ProvisionService._follow_slave_job(
+                job_id, vm_create, slave,
+                {"id": str(slave_job_id), "status": "running"})
+        if followed:
+            logger.info("Following %d provisioning jobs of slaves again",
+                        len(followed))
+
+    @staticmethod
+    def _update(job_id: uuid.UUID, **fields) -> None:
+        with Session(engine) as session:
+            job = session.get(ProvisionJobORM, job_id)
+            if not job:
+                return
+            for key, value in fields.items():
+                setattr(job, key, value)
+            job.updated_at = datetime.now(timezone.utc)
+            session.add(job)
+            session.commit()
+            finished = job.status not in ACTIVE_STATUSES
+        _notify(job_id, finished)
+
+    @staticmethod
+    def _run(job_id: uuid.UUID) -> None:
+        with Session(engine) as session:
+            job = session.get(ProvisionJobORM, job_id)
+            if not job:
+                return
+            vm_create = VmCreate(**job.payload)
+
+        ProvisionService._update(job_id, status="running")
+        try:
+            slave_id = VmService._pick_slave(vm_create)
+            if slave_id is not None:
+                # The slave job is followed by the poller, so this worker
+                # is free for the next job as soon as it is submitted
+                vm_create.slave_id = slave_id
+                slave = VmService._online_slave(slave_id)
+                slave_job = slave_submit_provision_job(
+                    slave, VmService._slave_payload(vm_create))
+                ProvisionService._update(
+                    job_id, slave_id=slave.id,
+                    slave_job_id=uuid.UUID(str(slave_job["id"])))
+                ProvisionService._follow_slave_job(
+                    job_id, vm_create, slave, slave_job)
+                return
+            vm = Vm(vm_create, ProvisionService._progress(job_id))
+        except Exception as exc:
+            ProvisionService._fail(job_id, exc)
+            return
+        ProvisionService._succeed(job_id, vm)
+
+    @staticmethod
+    def _progress(job_id: uuid.UUID) -> Callable[[str, float], None]:
+        """Progress callback of a job, recording at most one update per
+        ``PROGRESS_INTERVAL`` within a phase."""
+        last = {"phase": None, "at": 0.0}
+
+        def progress(phase: str, fraction: float) -> None:
+            now = time.monotonic()
+            if phase == last["phase"] and now - last["at"] < PROGRESS_INTERVAL:
+                return
+            last.update(phase=phase, at=now)
+            ProvisionService._update(
+                job_id, phase=phase, progress=round(fraction, 3))
+
+        return progress
+
+    @staticmethod
+    def _follow_slave_job(
+        job_id: uuid.UUID,
+        vm_create: VmCreate,
+        slave: SlaveORM,
+        slave_job: dict,
+    ) -> None:
+        future = slave_job_poller.follow(
+            slave, slave_job, ProvisionService._progress(job_id))
+        future.add_done_callback(
+            lambda done: ProvisionService._slave_job_done(
+                job_id, vm_create, slave, done))
+
+    @staticmethod
+    def _slave_job_done(
+        job_id: uuid.UUID,
+        vm_create: VmCreate,
+        slave: SlaveORM,
+        future: Future,
+    ) -> None:
+        try:
+            vm = VmService._finish_slave_job(
+                vm_create, slave, future.result())
+        except Exception as exc:
+            ProvisionService._fail(job_id, exc)
+            return
+        ProvisionService._succeed(job_id, vm)
+
+    @staticmethod
+    def _fail(job_id: uuid.UUID, exc: Exception) -> None:
+        if isinstance(exc, HTTPException):
+            error = str(exc.detail)
+        else:
+            logger.error("Provisioning job %s failed", job_id,
+                         exc_info=exc)
+            error = str(exc)
+        ProvisionService._update(
+            job_id,
+            status="failed",
+            error=error,
+            finished_at=datetime.now(timezone.utc),
+        )
+
+    @staticmethod
+    def _succeed(job_id: uuid.UUID, vm) -> None:
+        if isinstance(vm, dict):
+            vm_id, slave_id = vm["id"], vm.get("slave_id")
+        else:
+            vm_id, slave_id = vm.id, getattr(vm, "slave_id", None)
+        ProvisionService._update(
+            job_id,
+            status="succeeded",
+            progress=1.0,
+            vm_id=uuid.UUID(str(vm_id)),
+            slave_id=uuid.UUID(str(slave_id)) if slave_id else None,
+            finished_at=datetime.now(timezone.utc),
+        )
+
+    @staticmethod
+    def _wait_for_update(
+        job_id: uuid.UUID,
+        seen_version: int,
+        timeout: float,
+    ) -> int:
+        with _updates:
+            _updates.wait_for(
+                lambda: _versions.get(job_id, 0) != seen_version,
+                timeout=timeout,
+            )
+            return _versions.get(job_id, 0)
+
+    @staticmethod
+    async def stream_job(job_id: str) -> AsyncIterator[str]:
+        """Yield server-sent events for a job until it finishes."""
+        parsed_id = _parse_job_id(job_id)
+        sent: Optional[ProvisionJobRead] = None
+        while True:
+            with _updates:
+                version = _versions.get(parsed_id, 0)
+            job = await asyncio.to_thread(ProvisionService.get_job, job_id)
+            if job != sent:
+                yield f"event: progress\ndata: {job.model_dump_json()}\n\n"
+                sent = job
+            else:
+                yield ": keepalive\n\n"
+            if job.status not in ACTIVE_STATUSES:
+                return
+            await asyncio.to_thread(
+                ProvisionService._wait_for_update,
+                parsed_id, version, STREAM_KEEPALIVE,
+            )
@@ -1,14 +1,17 @@
 """HTTP client for Master -> Slave communication."""
 import logging
-from typing import Optional
+from typing import Iterable, Optional
+from urllib.parse import urlencode
 import httpx
 from fastapi import HTTPException
+from app.core.inventory import inventory_version
 from app.orm.slave import SlaveORM
 
 logger = logging.getLogger(__name__)
 
 TIMEOUT = httpx.Timeout(120.0, connect=10.0)
 VM_CREATE_TIMEOUT = httpx.Timeout(600.0, connect=10.0)
+IMAGE_STATUS_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
 
 
 def _slave_base_url(slave: SlaveORM) -> str:
@@ -23,7 +26,7 @@ def slave_request(
     slave: SlaveORM,
     method: str,
     path: str,
-    json: Optional[dict] = None,
+    json: Optional[dict | list] = None,
     timeout: Optional[httpx.Timeout] = None,
 ) -> dict:
     """Make an HTTP request to a slave node."""
@@ -50,19 +53,105 @@ def slave_create_vm(slave: SlaveORM, vm_payload: dict) -> dict:
     return slave_request(slave, "POST", "/vms", json=vm_payload, timeout=VM_CREATE_TIMEOUT)
 
 
-def slave_get_vm(slave: SlaveORM, vm_id: str) -> dict:
+def slave_submit_provision_batch(
+    slave: SlaveORM,
+    vm_payloads: list[dict],
+) -> list[dict]:
+    """Queue a batch of VMs on a slave node, one provisioning job each."""
+    return slave_request(slave, "POST", "/vms/jobs/bulk", json=vm_payloads)
+
+
+def slave_submit_provision_job(slave: SlaveORM, vm_payload: dict) -> dict:
+    """Queue a VM provisioning job on a slave node."""
+    return slave_request(slave, "POST", "/vms/jobs", json=vm_payload)
+
+
+def slave_get_provision_job(slave: SlaveORM, job_id: str) -> dict:
+    """Get the state of a provisioning job on a slave node."""
+    return slave_request(slave, "GET", f"/vms/jobs/{job_id}")
+
+
+def slave_get_provision_jobs(slave: SlaveORM, job_ids: list[str]) -> list[dict]:
+    """Get the state of several provisioning jobs on a slave node."""
+    return slave_request(
+        slave, "GET", f"/vms/jobs?{urlencode({'ids': job_ids}, doseq=True)}")
+
+
+def _fields_query(fields: Optional[Iterable[str]]) -> dict:
+    return {} if fields is None else {"fields": ",".join(sorted(fields))}
+
+
+def slave_list_vms(
+    slave: SlaveORM,
+    timeout: float,
+    vm_ids: Optional[list[str]] = None,
+    fields: Optional[Iterable[str]] = None,
+) -> list[dict]:
+    """Get the VMs hosted on a slave node, all of them if no ids are given.
+
+    ``fields`` lets the slave skip the lookups the other fields need.
+    """
+    query = _fields_query(fields)
+    if vm_ids is not None:
+        query["ids"] = vm_ids
+    path = "/vms"
+    if query:
+        path += f"?{urlencode(query, doseq=True)}"
+    return slave_request(slave, "GET", path, timeout=httpx.Timeout(timeout))
+
+
+def slave_get_vm(
+    slave: SlaveORM,
+    vm_id: str,
+    fields: Optional[Iterable[str]] = None,
+) -> dict:
     """Get VM info from a slave node."""
-    return slave_request(slave, "GET", f"/vms/{vm_id}")
+    path = f"/vms/{vm_id}"
+    query = _fields_query(fields)
+    if query:
+        path += f"?{urlencode(query)}"
+    return slave_request(slave, "GET", path)
+
+
+def _slave_power_request(
+    slave: SlaveORM,
+    path: str,
+    timeout: Optional[httpx.Timeout] = None,
+) -> dict:
+    """Change the state of a slave VM.
+
+    The state is read live from the slave, so the inventory version is
+    bumped here rather than by a commit, even if the request failed: the
+    slave may have acted before it did.
+    """
+    try:
+        return slave_request(slave, "POST", path, timeout=timeout)
+    finally:
+        inventory_version.bump()
 
 
 def slave_start_vm(slave: SlaveORM, vm_id: str) -> dict:
     """Start a VM on a slave node."""
-    return slave_request(slave, "POST", f"/vms/{vm_id}/start")
+    return _slave_power_request(slave, f"/vms/{vm_id}/start")
+
 
+def slave_stop_vm(slave: SlaveORM, vm_id: str, grace: float) -> dict:
+    """Stop a VM on a slave node, which destroys it after ``grace``
+    seconds."""
+    return _slave_power_request(slave, f"/vms/{vm_id}/stop?grace={grace}",
+                                timeout=httpx.Timeout(TIMEOUT.read + grace,
+                                                      connect=10.0))
 
-def slave_stop_vm(slave: SlaveORM, vm_id: str) -> dict:
-    """Stop a VM on a slave node."""
-    return slave_request(slave, "POST", f"/vms/{vm_id}/stop")
+
+def slave_hibernate_vm(slave: SlaveORM, vm_id: str) -> dict:
+    """Save an idle VM of a slave node to disk."""
+    return _slave_power_request(slave, f"/vms/{vm_id}/hibernate",
+                                timeout=VM_CREATE_TIMEOUT)
+
+
+def slave_resume_vm(slave: SlaveORM, vm_id: str) -> dict:
+    """Restore a hibernated VM of a slave node."""
+    return _slave_power_request(slave, f"/vms/{vm_id}/resume")
 
 
 def slave_delete_vm(slave: SlaveORM, vm_id: str) -> dict:
@@ -89,3 +178,15 @@ def slave_get_screenshot(slave: SlaveORM, vm_id: str) -> bytes:
 def slave_get_host_info(slave: SlaveORM) -> dict:
     """Get host info from a slave node."""
     return slave_request(slave, "GET", "/host/info")
+
+
+def slave_prefetch_image(slave: SlaveORM, image: str) -> dict:
+    """Start caching an image on a slave node."""
+    return slave_request(slave, "POST", "/images/prefetch",
+                         json={"image": image}, timeout=IMAGE_STATUS_TIMEOUT)
+
+
+def slave_get_image_status(slave: SlaveORM, image: str) -> dict:
+    """Get the cache status of an image on a slave node."""
+    return slave_request(slave, "GET", f"/images/{image}/status",
+                         timeout=IMAGE_STATUS_TIMEOUT)
@@ -0,0 +1,145 @@
+"""Following provisioning jobs handed off to slaves.
+
+The master creates a VM on a slave by submitting a provisioning job there.
+Rather than a worker sleeping on every such job, one thread follows all of
+them: every ``SLAVE_JOB_POLL_INTERVAL`` seconds it asks each slave for the
+state of its jobs in a single request, reports their progress and resolves
+their futures once they finish.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from fastapi import HTTPException, status
+
+from app.orm.slave import SlaveORM
+from app.services.slave_client import slave_get_provision_jobs
+
+logger = logging.getLogger(__name__)
+
+SLAVE_JOB_POLL_INTERVAL = 1.0
+# Consecutive failed polls tolerated before a slave job is given up on
+SLAVE_JOB_POLL_ATTEMPTS = 5
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+@dataclass
+class _FollowedJob:
+    slave: SlaveORM
+    future: Future
+    # Called with (phase, fraction) as the job reports progress
+    progress: Optional[Callable[[str, float], None]]
+    failures: int = 0
+
+
+def _resolve(future: Future, job: dict) -> None:
+    if job["status"] == "succeeded":
+        future.set_result(job)
+        return
+    future.set_exception(HTTPException(
+        status_code=status.HTTP_502_BAD_GATEWAY,
+        detail=f"Slave error: {job.get('error') or 'provisioning failed'}",
+    ))
+
+
+class SlaveJobPoller:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Condition()
+        # job id -> job followed
+        self._jobs: dict[str, _FollowedJob] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def follow(
+        self,
+        slave: SlaveORM,
+        job: dict,
+        progress: Optional[Callable[[str, float], None]] = None,
+    ) -> Future:
+        """Follow ``job``, as returned by ``slave``, until it finishes.
+
+        The future resolves with the final state of the job, or fails with
+        a 502 if the job failed or the slave stopped answering.
+        """
+        future = Future()
+        if job["status"] not in ACTIVE_STATUSES:
+            _resolve(future, job)
+            return future
+        with self._lock:
+            self._jobs[str(job["id"])] = _FollowedJob(slave, future, progress)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._loop, daemon=True, name="slave-jobs")
+                self._thread.start()
+            self._lock.notify()
+        return future
+
+    def _loop(self) -> None:
+        while True:
+            with self._lock:
+                self._lock.wait_for(lambda: self._jobs)
+                by_slave: dict[str, dict[str, _FollowedJob]] = {}
+                for job_id, followed in self._jobs.items():
+                    by_slave.setdefault(str(followed.slave.id), {})[
+                        job_id] = followed
+            time.sleep(self.interval)
+            # A slave slow to answer does not hold up the others
+            with ThreadPoolExecutor(max_workers=len(by_slave)) as pool:
+                for _ in pool.map(self._poll, by_slave.values()):
+                    pass
+
+    def _poll(self, followed: dict[str, _FollowedJob]) -> None:
+        slave = next(iter(followed.values())).slave
+        try:
+            jobs = {
+                str(job["id"]): job
+                for job in slave_get_provision_jobs(slave, list(followed))
+            }
+        except Exception as exc:
+            logger.warning("Failed to poll %d jobs on slave %s",
+                           len(followed), slave.name, exc_info=True)
+            for job_id, item in followed.items():
+                item.failures += 1
+                if item.failures >= SLAVE_JOB_POLL_ATTEMPTS:
+                    self._finish(job_id, exc=exc)
+            return
+
+        for job_id, item in followed.items():
+            job = jobs.get(job_id)
+            if job is None:
+                self._finish(job_id, exc=HTTPException(
+                    status_code=status.HTTP_502_BAD_GATEWAY,
+                    detail=f"Slave error: job {job_id} not found",
+                ))
+                continue
+            item.failures = 0
+            if job["status"] not in ACTIVE_STATUSES:
+                self._finish(job_id, job)
+            elif job.get("phase") and item.progress is not None:
+                try:
+                    item.progress(job["phase"], job.get("progress", 0.0))
+                except Exception:
+                    logger.exception("Failed to report progress of job %s",
+                                     job_id)
+
+    def _finish(
+        self,
+        job_id: str,
+        job: Optional[dict] = None,
+        exc: Optional[Exception] = None,
+    ) -> None:
+        with self._lock:
+            item = self._jobs.pop(job_id, None)
+        if item is None:
+            return
+        if exc is not None:
+            item.future.set_exception(exc)
+        else:
+            _resolve(item.future, job)
+
+
+slave_job_poller = SlaveJobPoller(SLAVE_JOB_POLL_INTERVAL)
@@ -9,8 +9,10 @@ from fastapi import HTTPException, status
 from sqlmodel import Session, select
 
 from app.core.config import engine
+from app.core.inventory import inventory_version
 from app.orm.slave import SlaveORM
 from app.models.slave import SlaveCreate, SlaveHeartbeat
+from app.services.change_stream import change_stream
 from app.services.slave_client import slave_get_host_info
 
 logger = logging.getLogger(__name__)
@@ -78,6 +80,9 @@ class SlaveService:
                 )
             session.delete(slave)
             session.commit()
+        change_stream.forget_node(slave_id)
+        from app.services.vm_hibernation import idle_tracker
+        idle_tracker.forget_node(slave_id)
 
     @staticmethod
     def handle_heartbeat(slave_id: str, heartbeat: SlaveHeartbeat) -> SlaveORM:
@@ -106,7 +111,22 @@ class SlaveService:
             session.add(slave)
             session.commit()
             session.refresh(slave)
-            return slave
+        changed = change_stream.publish_host_metrics(str(slave.id), {
+            "cpu_percent": round(100.0 - heartbeat.available_cpu, 1),
+            "mem_available": heartbeat.available_mem,
+            "disk_available": heartbeat.available_disk,
+        })
+        if heartbeat.vms is not None:
+            changed = change_stream.publish_node_vms(str(slave.id), {
+                vm.id: (vm.state, vm.ipv4) for vm in heartbeat.vms
+            }) or changed
+            from app.services.vm_hibernation import idle_tracker
+            idle_tracker.observe(str(slave.id), {
+                vm.id: vm.cpu for vm in heartbeat.vms
+            })
+        if changed:
+            inventory_version.bump()
+        return slave
 
     @staticmethod
     def mark_slave_offline(slave_id: str) -> None:
@@ -0,0 +1,101 @@
+"""Bulk start, stop, restart and deletion of VMs.
+
+The selected VMs are grouped by the node hosting them. Every node works
+on its share at once, at most ``BULK_ACTION_NODE_CONCURRENCY`` VMs at a
+time, and results are yielded as each VM is done. Starts and stops of
+local VMs wait on libvirt events, so they hold no worker thread while
+guests shut down.
+"""
+import asyncio
+import logging
+import uuid
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException
+
+from app.core.config import BULK_ACTION_NODE_CONCURRENCY
+from app.models.vm import VmBulkActionResult, VmBulkSelection
+from app.services.vm_operation_service import VmOperationService, vm_field
+from app.services.vm_query import VmFilters, VmQuery, VmRow
+from app.services.vm_service import VmService
+
+logger = logging.getLogger(__name__)
+
+# Keeps running operations referenced until they finish, even once the
+# client that asked for them is gone
+_tasks: set[asyncio.Task] = set()
+
+
+class VmBulkActionService:
+
+    @staticmethod
+    def select(selection: VmBulkSelection) -> list[VmRow]:
+        """Rows of the VMs matching ``selection``, in name order."""
+        filters = VmFilters(event_id=selection.event_id,
+                            vm_ids=selection.ids or None)
+        if selection.slave_id == "master":
+            filters.master_only = True
+        elif selection.slave_id:
+            filters.slave_id = VmService._parse_vm_id(selection.slave_id)
+        rows = VmQuery.page_rows(filters, with_credentials=False)
+        if not selection.state:
+            return rows
+        wanted = selection.state.lower()
+        return [
+            row for row, vm in VmService._resolve_rows(
+                rows, frozenset({"id", "state"}))
+            if vm_field(vm, "state").lower() == wanted
+        ]
+
+    @staticmethod
+    async def _perform(row: VmRow, action: str) -> VmBulkActionResult:
+        vm_id = str(row.vm.id)
+        state: Optional[str] = None
+        stage: Optional[str] = None
+        try:
+            if action == "delete":
+                await asyncio.to_thread(VmService.remove_vm, vm_id)
+            else:
+                if action in ("stop", "restart"):
+                    vm = await VmOperationService.perform(vm_id, "stop")
+                    stage = vm_field(vm, "shutdown_stage")
+                if action in ("start", "restart"):
+                    vm = await VmOperationService.perform(vm_id, "start")
+                state = vm_field(vm, "state")
+        except Exception as exc:
+            if isinstance(exc, HTTPException):
+                error = str(exc.detail)
+            else:
+                logger.exception("Bulk %s of VM %s failed", action, vm_id)
+                error = str(exc)
+            return VmBulkActionResult(vm_id=row.vm.id, name=row.vm.name,
+                                      action=action, status="failed",
+                                      error=error)
+        return VmBulkActionResult(vm_id=row.vm.id, name=row.vm.name,
+                                  action=action, status="succeeded",
+                                  state=state, stage=stage)
+
+    @staticmethod
+    async def run(
+        action: str,
+        rows: list[VmRow],
+    ) -> AsyncIterator[VmBulkActionResult]:
+        """Apply ``action`` to every VM of ``rows`` and yield the results
+        in the order VMs finish. Operations already scheduled carry on if
+        the caller stops iterating."""
+        limits: dict[Optional[uuid.UUID], asyncio.Semaphore] = {}
+        for row in rows:
+            if row.vm.slave_id not in limits:
+                limits[row.vm.slave_id] = asyncio.Semaphore(
+                    BULK_ACTION_NODE_CONCURRENCY)
+
+        async def perform(row: VmRow) -> VmBulkActionResult:
+            async with limits[row.vm.slave_id]:
+                return await VmBulkActionService._perform(row, action)
+
+        tasks = [asyncio.create_task(perform(row)) for row in rows]
+        for task in tasks:
+            _tasks.add(task)
+            task.add_done_callback(_tasks.discard)
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
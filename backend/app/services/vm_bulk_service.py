@@ -0,0 +1,269 @@
+"""Bulk VM creation.
+
+Placement is planned once for the whole batch from a single snapshot of
+node resources, then each node creates its share with bounded concurrency.
+Slaves receive their share in one request that queues a provisioning job
+per VM, and the slave job poller follows the jobs until they finish.
+Image checks, seed ISOs and domain XML are prepared once per distinct
+image, layout and VM shape.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from fastapi import HTTPException
+
+from app.core.config import (
+    BULK_CREATE_NODE_CONCURRENCY,
+    SLAVE_INVENTORY_TIMEOUT,
+)
+from app.core.xml_builder import DomainTemplate
+from app.models.vm import VmBulkResult, VmCreate, VmRead
+from app.orm.slave import SlaveORM
+from app.services.host_service import HostService
+from app.services.image_cache import image_cache
+from app.services.slave_client import (
+    slave_get_host_info,
+    slave_get_vm,
+    slave_list_vms,
+    slave_submit_provision_batch,
+)
+from app.services.slave_job_poller import slave_job_poller
+from app.services.slave_service import SlaveService
+from app.services.vm_service import Vm, VmService
+from app.utils.seed import cached_seed_iso
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Node:
+    slave: Optional[SlaveORM]
+    mem: float = 0.0
+    vcpus: int = 0
+    disk: float = 0.0
+    items: list[tuple[int, VmCreate]] = field(default_factory=list)
+
+    def fits(self, vm: VmCreate) -> bool:
+        return (self.mem >= vm.mem and self.vcpus >= vm.vcpus and
+                self.disk >= vm.disk_size)
+
+    def assign(self, index: int, vm: VmCreate) -> None:
+        self.mem -= vm.mem
+        self.disk -= vm.disk_size
+        self.items.append((index, vm))
+
+
+def _error_detail(exc: Exception) -> str:
+    if isinstance(exc, HTTPException):
+        return str(exc.detail)
+    return str(exc)
+
+
+def _failed(index: int, vm: VmCreate, exc: Exception) -> VmBulkResult:
+    return VmBulkResult(index=index, name=vm.name, status="failed",
+                        error=_error_detail(exc))
+
+
+class VmBulkService:
+
+    @staticmethod
+    def _load_nodes() -> tuple[_Node, dict[str, _Node]]:
+        """Snapshot the free resources of the master and online slaves."""
+        master = _Node(slave=None)
+        try:
+            info = HostService.get_host_info()
+            master.mem = info.mem.available
+            master.vcpus = info.cpu.cpu_count
+            master.disk = info.disk.available
+        except Exception:
+            logger.warning("Failed to read master host info", exc_info=True)
+
+        def load_slave(slave: SlaveORM) -> _Node:
+            node = _Node(slave=slave)
+            try:
+                info = slave_get_host_info(slave)
+                node.mem = info.get("mem", {}).get("available", 0)
+                node.vcpus = info.get("cpu", {}).get("cpu_count", 0)
+                node.disk = info.get("disk", {}).get("available", 0)
+            except Exception:
+                logger.warning("Failed to read host info of slave %s",
+                               slave.name, exc_info=True)
+            return node
+
+        slaves = SlaveService.get_online_slaves()
+        slave_nodes: dict[str, _Node] = {}
+        if slaves:
+            with ThreadPoolExecutor(max_workers=len(slaves)) as pool:
+                for node in pool.map(load_slave, slaves):
+                    slave_nodes[str(node.slave.id)] = node
+        return master, slave_nodes
+
+    @staticmethod
+    def _plan(
+        vms: list[VmCreate],
+    ) -> tuple[list[_Node], list[VmBulkResult]]:
+        """Assign every VM to a node, following ``VmService.create_vm``.
+
+        Explicit ``slave_id`` wins, ``auto_place`` prefers the master and
+        then the slave with the most memory left, anything else stays on
+        the master. Capacity is tracked as VMs are assigned.
+        """
+        master, slave_nodes = VmBulkService._load_nodes()
+        errors: list[VmBulkResult] = []
+        for index, vm in enumerate(vms):
+            if vm.slave_id:
+                node = slave_nodes.get(str(vm.slave_id))
+                if node is None:
+                    errors.append(VmBulkResult(
+                        index=index, name=vm.name, status="failed",
+                        error=f"Slave {vm.slave_id} is not online",
+                    ))
+                    continue
+            elif vm.auto_place and not master.fits(vm):
+                candidates = [n for n in slave_nodes.values() if n.fits(vm)]
+                node = (max(candidates, key=lambda n: n.mem)
+                        if candidates else master)
+            else:
+                node = master
+            node.assign(index, vm)
+        nodes = [master, *slave_nodes.values()]
+        return [node for node in nodes if node.items], errors
+
+    @staticmethod
+    def create_local(
+        vms: list[VmCreate],
+        on_result: Optional[Callable[[VmBulkResult], None]] = None,
+    ) -> list[VmBulkResult]:
+        """Create VMs on this node, sharing preparation across the batch.
+
+        ``on_result`` is called with the result of each VM as soon as it is
+        known.
+        """
+        results: list[Optional[VmBulkResult]] = [None] * len(vms)
+        pending: list[int] = []
+
+        def done(result: VmBulkResult) -> None:
+            results[result.index] = result
+            if on_result is not None:
+                on_result(result)
+
+        templates: dict[tuple, DomainTemplate] = {}
+        for index, vm in enumerate(vms):
+            try:
+                Vm._resolve_image_name(vm.os)
+                image_cache.ensure(vm.os)
+                cached_seed_iso(vm.keyboard_layout)
+                shape = (vm.os, vm.mem, vm.vcpus, vm.disk_size,
+                         vm.keyboard_layout)
+                if shape not in templates:
+                    templates[shape] = DomainTemplate(vm)
+                pending.append(index)
+            except Exception as exc:
+                done(_failed(index, vm, exc))
+
+        def create(index: int) -> VmBulkResult:
+            vm = vms[index]
+            shape = (vm.os, vm.mem, vm.vcpus, vm.disk_size,
+                     vm.keyboard_layout)
+            try:
+                created = Vm(vm.model_copy(update={"slave_id": None}),
+                             xml_template=templates[shape])
+            except Exception as exc:
+                logger.warning("Bulk creation of VM %s failed: %s",
+                               vm.name, _error_detail(exc))
+                return _failed(index, vm, exc)
+            return VmBulkResult(
+                index=index, name=vm.name, status="created",
+                vm=VmRead.model_validate(created, from_attributes=True),
+            )
+
+        if pending:
+            workers = min(BULK_CREATE_NODE_CONCURRENCY, len(pending))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for future in as_completed(
+                        [pool.submit(create, index) for index in pending]):
+                    done(future.result())
+        return results
+
+    @staticmethod
+    def _create_on_slave(node: _Node) -> list[VmBulkResult]:
+        payloads = [VmService._slave_payload(vm) for _, vm in node.items]
+        try:
+            jobs = slave_submit_provision_batch(node.slave, payloads)
+        except Exception as exc:
+            return [_failed(index, vm, exc) for index, vm in node.items]
+        futures = [slave_job_poller.follow(node.slave, job) for job in jobs]
+
+        results = []
+        created: list[tuple[int, VmCreate, str]] = []
+        for (index, vm), future in zip(node.items, futures):
+            try:
+                created.append((index, vm, str(future.result()["vm_id"])))
+            except Exception as exc:
+                results.append(_failed(index, vm, exc))
+        if not created:
+            return results
+
+        try:
+            remote_vms = {
+                str(remote["id"]): remote
+                for remote in slave_list_vms(
+                    node.slave, SLAVE_INVENTORY_TIMEOUT,
+                    vm_ids=[vm_id for _, _, vm_id in created])
+            }
+        except Exception:
+            logger.warning("Failed to list new VMs of slave %s",
+                           node.slave.name, exc_info=True)
+            remote_vms = {}
+        for index, vm, vm_id in created:
+            try:
+                remote = remote_vms.get(vm_id) or slave_get_vm(
+                    node.slave, vm_id)
+                data = VmService._register_slave_vm(vm, node.slave, remote)
+            except Exception as exc:
+                results.append(_failed(index, vm, exc))
+                continue
+            results.append(VmBulkResult(
+                index=index, name=vm.name, status="created",
+                vm=VmRead(**data),
+            ))
+        return results
+
+    @staticmethod
+    def _create_on_node(node: _Node) -> list[VmBulkResult]:
+        if node.slave is not None:
+            return VmBulkService._create_on_slave(node)
+        local_results = VmBulkService.create_local(
+            [vm for _, vm in node.items])
+        # Map positions within the node back to positions in the request
+        return [
+            result.model_copy(update={"index": index})
+            for (index, _), result in zip(node.items, local_results)
+        ]
+
+    @staticmethod
+    def create(
+        vms: list[VmCreate],
+        on_result: Optional[Callable[[VmBulkResult], None]] = None,
+    ) -> list[VmBulkResult]:
+        """Place VMs on the nodes and create each node's share.
+
+        ``on_result`` is called with the results of a node as soon as the
+        node is done.
+        """
+        nodes, results = VmBulkService._plan(vms)
+        if on_result is not None:
+            for result in results:
+                on_result(result)
+        if nodes:
+            with ThreadPoolExecutor(max_workers=len(nodes)) as pool:
+                futures = [pool.submit(VmBulkService._create_on_node, node)
+                           for node in nodes]
+                for future in as_completed(futures):
+                    for result in future.result():
+                        results.append(result)
+                        if on_result is not None:
+                            on_result(result)
+        return sorted(results, key=lambda result: result.index)
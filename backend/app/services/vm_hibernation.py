@@ -0,0 +1,318 @@
+"""Saving the memory of running VMs to disk and restoring it.
+
+A managed save writes the memory of a domain to disk and stops it. The next
+start of the domain restores it from the save file in seconds, with the
+guest where it left off, instead of booting it.
+
+When a slave shuts down with ``SLAVE_SHUTDOWN_MODE=save`` its running VMs
+are saved ``SLAVE_SHUTDOWN_SAVE_WORKERS`` at a time, a bound set by disk
+bandwidth rather than CPU. Saves still running after
+``SLAVE_SHUTDOWN_BUDGET`` seconds, and the VMs they never got to, are
+destroyed so the node stops on time. Saved VMs are started again when the
+slave comes back, cold booted if their save file cannot be restored.
+
+VMs are also hibernated, saved and flagged with ``hibernated_at``, once
+they have had no tunnel session and used under ``VM_IDLE_CPU_PERCENT`` of
+their host CPU for ``VM_IDLE_HIBERNATE_AFTER`` seconds, which frees their
+memory for other VMs. The master tracks idleness of its own VMs from the
+system monitor and of slave VMs from heartbeats. Opening a tunnel to a
+hibernated VM restores it before the connection goes on. Hibernated VMs
+are left saved when their node restarts.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Optional
+
+import libvirt
+from fastapi import HTTPException, status
+from sqlmodel import Session, select
+
+from app.core.config import QEMUConfig, VM_IDLE_CPU_PERCENT, engine
+from app.core.constants import VM_HIBERNATED_STATE
+from app.orm.vm import VmORM
+from app.services.change_stream import change_stream
+from app.services.domain_state_cache import domain_state_cache
+from app.services.vm_service import VmService
+from app.utils.vm import invalidate_vm_ip
+
+logger = logging.getLogger(__name__)
+
+# Serialize hibernation and restoration of each VM of this node
+_locks_lock = threading.Lock()
+_vm_locks: dict[str, threading.Lock] = {}
+
+
+def _vm_lock(vm_id: str) -> threading.Lock:
+    with _locks_lock:
+        return _vm_locks.setdefault(vm_id, threading.Lock())
+
+
+class IdleTracker:
+    """Since when each running VM has been idle, and its tunnel sessions."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # node (slave id, None for this node) -> VM id -> monotonic time
+        # it went idle at, None while busy
+        self._nodes: dict[Optional[str], dict[str, Optional[float]]] = {}
+        self._sessions: Counter = Counter()
+
+    def observe(self, node: Optional[str],
+                cpu_by_vm: dict[str, Optional[float]]) -> None:
+        """Record the CPU usage of the running VMs of a node, replacing
+        its previous report."""
+        now = time.monotonic()
+        with self._lock:
+            previous = self._nodes.get(node, {})
+            self._nodes[node] = {
+                vm_id: (previous.get(vm_id) or now)
+                if cpu is not None and cpu < VM_IDLE_CPU_PERCENT else None
+                for vm_id, cpu in cpu_by_vm.items()
+            }
+
+    def forget(self, vm_id: str) -> None:
+        with self._lock:
+            for vms in self._nodes.values():
+                vms.pop(vm_id, None)
+
+    def forget_node(self, node: str) -> None:
+        with self._lock:
+            self._nodes.pop(node, None)
+
+    def session_opened(self, vm_id: str) -> None:
+        with self._lock:
+            self._sessions[vm_id] += 1
+
+    def session_closed(self, vm_id: str) -> None:
+        """End a session; the VM only counts as idle from now on."""
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[vm_id] -= 1
+            if self._sessions[vm_id] <= 0:
+                del self._sessions[vm_id]
+            for vms in self._nodes.values():
+                if vms.get(vm_id) is not None:
+                    vms[vm_id] = now
+
+    def has_session(self, vm_id: str) -> bool:
+        with self._lock:
+            return self._sessions[vm_id] > 0
+
+    def idle_vms(self, after: float) -> list[str]:
+        """VMs idle for at least ``after`` seconds without a session."""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                vm_id
+                for vms in self._nodes.values()
+                for vm_id, since in vms.items()
+                if since is not None and now - since >= after and
+                not self._sessions[vm_id]
+            ]
+
+
+idle_tracker = IdleTracker()
+
+
+def _destroy(domain) -> None:
+    try:
+        domain.destroy()
+        logger.info("Destroyed VM %s", domain.name())
+    except libvirt.libvirtError:
+        # Stopped meanwhile, by its save for instance
+        if domain.isActive():
+            logger.warning("Failed to destroy VM %s", domain.name(),
+                           exc_info=True)
+
+
+def _restore(domain) -> None:
+    try:
+        domain.create()
+        logger.info("Restored VM %s", domain.name())
+    except libvirt.libvirtError:
+        logger.warning("Failed to restore VM %s, booting it instead",
+                       domain.name(), exc_info=True)
+        domain.managedSaveRemove(0)
+        domain.create()
+
+
+class HibernationService:
+
+    @staticmethod
+    def destroy_running() -> None:
+        """Hard stop every running VM of this node."""
+        conn = QEMUConfig.get_connection()
+        for domain in conn.listAllDomains(
+                libvirt.VIR_CONNECT_LIST_DOMAINS_ACTIVE):
+            _destroy(domain)
+
+    @staticmethod
+    def save_running(budget: float, workers: int) -> None:
+        """Save every running VM of this node within ``budget`` seconds,
+        ``workers`` at a time, and destroy those that could not be."""
+        conn = QEMUConfig.get_connection()
+        domains = conn.listAllDomains(libvirt.VIR_CONNECT_LIST_DOMAINS_ACTIVE)
+        if not domains:
+            return
+        pool = ThreadPoolExecutor(max_workers=min(workers, len(domains)),
+                                  thread_name_prefix="vm-save")
+        futures = {pool.submit(domain.managedSave, 0): domain
+                   for domain in domains}
+        done, not_done = wait(futures, timeout=budget)
+        # Saves not started yet are given up, the others are cut short by
+        # destroying their domain
+        pool.shutdown(wait=False, cancel_futures=True)
+
+        stragglers = [futures[future] for future in not_done]
+        for future in done:
+            if future.exception() is not None:
+                logger.warning("Failed to save VM %s: %s",
+                               futures[future].name(), future.exception())
+                stragglers.append(futures[future])
+        if not_done:
+            logger.warning("%d VMs not saved within %ss, destroying them",
+                           len(not_done), budget)
+        for domain in stragglers:
+            _destroy(domain)
+        logger.info("Saved %d of %d running VMs",
+                    len(domains) - len(stragglers), len(domains))
+
+    @staticmethod
+    def restore_saved(workers: int) -> None:
+        """Start every VM of this node that has a save file, ``workers`` at
+        a time."""
+        with Session(engine) as session:
+            hibernated = {
+                str(vm_id) for vm_id in session.exec(
+                    select(VmORM.id).where(VmORM.hibernated_at.is_not(None)))
+            }
+        conn = QEMUConfig.get_connection()
+        domains = [
+            domain for domain in conn.listAllDomains(
+                libvirt.VIR_CONNECT_LIST_DOMAINS_INACTIVE |
+                libvirt.VIR_CONNECT_LIST_DOMAINS_MANAGEDSAVE)
+            if domain.name() not in hibernated
+        ]
+        if not domains:
+            return
+        with ThreadPoolExecutor(max_workers=min(workers, len(domains)),
+                                thread_name_prefix="vm-restore") as pool:
+            futures = {pool.submit(_restore, domain): domain
+                       for domain in domains}
+        for future, domain in futures.items():
+            if future.exception() is not None:
+                logger.error("Failed to start VM %s: %s",
+                             domain.name(), future.exception())
+
+    @staticmethod
+    def hibernate_local(vm_id: str) -> bool:
+        """Save a running VM of this node to disk, flagged as hibernated,
+        unless a tunnel session is open on it. Returns whether it was
+        hibernated."""
+        with _vm_lock(vm_id):
+            # A session may have opened since the VM was found idle
+            if idle_tracker.has_session(vm_id):
+                return False
+            return HibernationService._hibernate_local(vm_id)
+
+    @staticmethod
+    def _hibernate_local(vm_id: str) -> bool:
+        """``hibernate_local`` with the lock of the VM held."""
+        domain = QEMUConfig.get_connection().lookupByName(vm_id)
+        if not domain.isActive():
+            return False
+        # Flagged first, so a tunnel opening meanwhile waits for the
+        # save and then restores the VM
+        VmService.set_hibernated(vm_id, True)
+        try:
+            domain.managedSave(0)
+        except libvirt.libvirtError:
+            VmService.set_hibernated(vm_id, False)
+            raise
+        invalidate_vm_ip(vm_id)
+        domain_state_cache.invalidate(vm_id)
+        logger.info("Hibernated idle VM %s", vm_id)
+        return True
+
+    @staticmethod
+    def resume_local(vm_id: str) -> None:
+        """Restore a hibernated VM of this node, back once it runs."""
+        with _vm_lock(vm_id):
+            HibernationService._resume_local(vm_id)
+
+    @staticmethod
+    def _resume_local(vm_id: str) -> None:
+        """``resume_local`` with the lock of the VM held."""
+        domain = QEMUConfig.get_connection().lookupByName(vm_id)
+        if not domain.isActive():
+            try:
+                domain.create()
+            except libvirt.libvirtError as e:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail=f"Failed to resume VM {vm_id}: {str(e)}",
+                ) from e
+        VmService.set_hibernated(vm_id, False)
+        invalidate_vm_ip(vm_id)
+        domain_state_cache.invalidate(vm_id)
+        logger.info("Resumed hibernated VM %s", vm_id)
+
+    @staticmethod
+    def hibernate_vm(vm_id: str) -> bool:
+        """Hibernate a VM of this node or of a slave, unless it belongs to
+        a warm pool or a tunnel session is open on it. Returns whether it
+        was hibernated.
+
+        The check for a session and the hibernation happen under the lock
+        of the VM, which ``resume_vm`` takes too: a tunnel opening meanwhile
+        either finds the VM flagged and restores it, or is seen here."""
+        with Session(engine) as session:
+            vm = session.get(VmORM, VmService._parse_vm_id(vm_id))
+            if vm is None or vm.pool_profile_id is not None:
+                return False
+        with _vm_lock(vm_id):
+            if idle_tracker.has_session(vm_id):
+                return False
+            slave = VmService._get_slave_for_vm(vm_id)
+            if slave is None:
+                return HibernationService._hibernate_local(vm_id)
+            from app.services.slave_client import slave_hibernate_vm
+            VmService.set_hibernated(vm_id, True)
+            try:
+                slave_hibernate_vm(slave, vm_id)
+            except HTTPException as exc:
+                VmService.set_hibernated(vm_id, False)
+                if exc.status_code == status.HTTP_409_CONFLICT:
+                    # Not running on the slave, nothing was saved
+                    return False
+                raise
+            except Exception:
+                VmService.set_hibernated(vm_id, False)
+                raise
+        # The slave only reports the domain as shut off until its next
+        # heartbeat
+        change_stream.publish("vm.state", id=vm_id, state=VM_HIBERNATED_STATE)
+        logger.info("Hibernated idle VM %s on slave %s", vm_id, slave.name)
+        return True
+
+    @staticmethod
+    def resume_vm(vm_id: str) -> None:
+        """Restore a VM if it is hibernated, on this node or a slave."""
+        with _vm_lock(vm_id):
+            if not VmService.is_hibernated(vm_id):
+                return
+            slave = VmService._get_slave_for_vm(vm_id)
+            if slave is None:
+                HibernationService._resume_local(vm_id)
+                return
+            if slave.status != "online":
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail=f"Slave {slave.name} is offline",
+                )
+            from app.services.slave_client import slave_resume_vm
+            slave_resume_vm(slave, vm_id)
+            VmService.set_hibernated(vm_id, False)
@@ -0,0 +1,152 @@
+"""Power operations run in the background.
+
+``POST /vms/{id}/start?wait=false`` (and ``stop``) returns an operation at
+once. The wait for the target state then runs as an asyncio task woken by
+libvirt events, and stops go through the shutdown scheduler, so pending
+operations hold no worker thread. Operations only live in memory, the last
+``OPERATIONS_KEPT`` of them.
+"""
+import asyncio
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+
+import libvirt
+from fastapi import HTTPException, status
+
+from app.core.config import VM_START_TIMEOUT
+from app.models.vm_operation import VmOperationRead
+from app.services.domain_state_cache import domain_state_cache
+from app.services.vm_service import Vm, VmService
+from app.services.vm_shutdown import shutdown_scheduler
+
+logger = logging.getLogger(__name__)
+
+OPERATIONS_KEPT = 1000
+
+_lock = threading.Lock()
+_operations: "OrderedDict[uuid.UUID, VmOperationRead]" = OrderedDict()
+# Keeps running tasks referenced until they finish
+_tasks: set[asyncio.Task] = set()
+
+
+def vm_field(vm, name: str):
+    """Field of a local VM object or of a slave VM dict."""
+    if isinstance(vm, dict):
+        return vm.get(name)
+    return getattr(vm, name, None)
+
+
+def _parse_operation_id(operation_id: str) -> uuid.UUID:
+    try:
+        return uuid.UUID(operation_id)
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid ID format",
+        ) from exc
+
+
+class VmOperationService:
+
+    @staticmethod
+    def get(operation_id: str) -> VmOperationRead:
+        parsed_id = _parse_operation_id(operation_id)
+        with _lock:
+            operation = _operations.get(parsed_id)
+        if operation is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Operation {operation_id} not found",
+            )
+        return operation
+
+    @staticmethod
+    def _store(operation: VmOperationRead) -> None:
+        with _lock:
+            _operations[operation.id] = operation
+            _operations.move_to_end(operation.id)
+            while len(_operations) > OPERATIONS_KEPT:
+                _operations.popitem(last=False)
+
+    @staticmethod
+    def _finish(
+        operation: VmOperationRead,
+        state: Optional[str] = None,
+        stage: Optional[str] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        VmOperationService._store(operation.model_copy(update={
+            "status": "failed" if error else "succeeded",
+            "state": state,
+            "stage": stage,
+            "error": error,
+            "finished_at": datetime.now(timezone.utc),
+        }))
+
+    @staticmethod
+    async def perform(vm_id: str, action: str,
+                      grace: Optional[float] = None):
+        """Start or stop a VM and return it, a dict for slave VMs.
+
+        Stops destroy the VM after ``grace`` seconds, its shutdown grace by
+        default. Local VMs are waited for with libvirt events; slave VMs
+        are left to the slave, which does the same.
+        """
+        slave = await asyncio.to_thread(VmService._get_slave_for_vm, vm_id)
+        if slave:
+            if action == "start":
+                return await asyncio.to_thread(VmService.start_vm, vm_id)
+            return await asyncio.to_thread(VmService.stop_vm, vm_id, grace)
+        vm = await asyncio.to_thread(Vm.get, vm_id)
+        if action == "start":
+            await asyncio.to_thread(vm.power_on)
+            state_code = await domain_state_cache.wait_for_state_async(
+                vm_id, libvirt.VIR_DOMAIN_RUNNING, VM_START_TIMEOUT)
+            return vm.started(state_code)
+        if grace is None:
+            grace = await asyncio.to_thread(
+                VmService.get_shutdown_grace, vm_id)
+        try:
+            result = await asyncio.wrap_future(
+                shutdown_scheduler.submit(vm_id, grace))
+        except libvirt.libvirtError as e:
+            raise vm.stop_failed(e) from e
+        return vm.stopped(result)
+
+    @staticmethod
+    async def _run(operation: VmOperationRead) -> None:
+        try:
+            vm = await VmOperationService.perform(
+                str(operation.vm_id), operation.action)
+        except HTTPException as exc:
+            VmOperationService._finish(operation, error=str(exc.detail))
+        except Exception as exc:
+            logger.exception("VM operation %s failed", operation.id)
+            VmOperationService._finish(operation, error=str(exc))
+        else:
+            VmOperationService._finish(
+                operation,
+                state=vm_field(vm, "state"),
+                stage=vm_field(vm, "shutdown_stage"),
+            )
+
+    @staticmethod
+    def submit(vm_id: str, action: str) -> VmOperationRead:
+        """Record an operation and run it in the background, from the event
+        loop."""
+        operation = VmOperationRead(
+            id=uuid.uuid4(),
+            vm_id=VmService._parse_vm_id(vm_id),
+            action=action,
+            status="running",
+            created_at=datetime.now(timezone.utc),
+        )
+        VmOperationService._store(operation)
+        task = asyncio.create_task(VmOperationService._run(operation))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+        return operation
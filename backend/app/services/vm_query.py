@@ -0,0 +1,244 @@
+"""Read model for VMs.
+
+Every VM read needs the VM row, the slave hosting it and its number of
+credentials. They are fetched together in one statement, an outer join on
+``slaves`` and a grouped count of ``vm_credentials``, instead of a query
+per VM and per relation.
+"""
+import base64
+import json
+import uuid
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import func, literal, tuple_
+from sqlmodel import Session, select
+
+from app.core.config import engine
+from app.models.vm import VmRead
+from app.orm.event import EventParticipantORM
+from app.orm.slave import SlaveORM
+from app.orm.vm import VmORM
+from app.orm.vm_credential import VmCredentialORM
+
+
+@dataclass
+class VmRow:
+    vm: VmORM
+    slave: Optional[SlaveORM]
+    credentials_count: int
+
+    @property
+    def slave_name(self) -> Optional[str]:
+        return self.slave.name if self.slave else None
+
+    def unknown_state(self) -> dict:
+        """Response for a VM whose slave cannot be asked about it."""
+        return {
+            "id": str(self.vm.id),
+            "name": self.vm.name,
+            "os": self.vm.os,
+            "mem": self.vm.mem,
+            "vcpus": self.vm.vcpus,
+            "disk_size": self.vm.disk_size,
+            "keyboard_layout": self.vm.keyboard_layout,
+            "state": "Unknown",
+            "ipv4": None,
+            "credentials_count": self.credentials_count,
+            "slave_id": str(self.vm.slave_id),
+            "slave_name": self.slave_name or "Unknown",
+        }
+
+
+def parse_fields(fields: Optional[str]) -> Optional[frozenset[str]]:
+    """Fields of ``VmRead`` listed in ``fields=id,name,state``, None for
+    all of them. The id is always included."""
+    if not fields:
+        return None
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested - VmRead.model_fields.keys()
+    if unknown:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            f"Unknown fields {', '.join(sorted(unknown))}, expected some of "
+            f"{', '.join(VmRead.model_fields)}",
+        )
+    return frozenset(requested | {"id"})
+
+
+def wants(fields: Optional[frozenset[str]], *names: str) -> bool:
+    """Whether any of ``names`` is requested, all fields are by default."""
+    return fields is None or any(name in fields for name in names)
+
+
+def project(vm, fields: Optional[frozenset[str]]):
+    """Keep the requested fields of a VM object or slave dict."""
+    if fields is None:
+        return vm
+    if isinstance(vm, dict):
+        return {name: vm.get(name) for name in fields}
+    return {name: getattr(vm, name, None) for name in fields}
+
+
+# Columns GET /vms can be sorted by, the VM id breaks ties
+SORT_COLUMNS = {
+    "name": VmORM.name,
+    "os": VmORM.os,
+    "mem": VmORM.mem,
+    "vcpus": VmORM.vcpus,
+}
+
+
+@dataclass
+class VmFilters:
+    slave_id: Optional[uuid.UUID] = None
+    # Only VMs hosted on the master
+    master_only: bool = False
+    os: Optional[str] = None
+    name_prefix: Optional[str] = None
+    event_id: Optional[uuid.UUID] = None
+    vm_ids: Optional[list[uuid.UUID]] = None
+
+
+def parse_sort(sort: str) -> tuple[str, bool]:
+    """Split ``name`` or ``-name`` into the field and whether it descends."""
+    field = sort.removeprefix("-")
+    if field not in SORT_COLUMNS:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            f"Cannot sort by {field!r}, expected one of "
+            f"{', '.join(SORT_COLUMNS)}",
+        )
+    return field, sort.startswith("-")
+
+
+def encode_cursor(row: "VmRow", sort_field: str) -> str:
+    key = [getattr(row.vm, sort_field), str(row.vm.id)]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[Any, uuid.UUID]:
+    try:
+        value, vm_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return value, uuid.UUID(vm_id)
+    except (ValueError, TypeError) as exc:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST,
+                            "Invalid cursor") from exc
+
+
+def _escape_like(value: str) -> str:
+    return (value.replace("\\", "\\\\")
+            .replace("%", "\\%").replace("_", "\\_"))
+
+
+class VmQuery:
+
+    @staticmethod
+    def _statement(
+        vm_id: Optional[uuid.UUID] = None,
+        with_credentials: bool = True,
+    ):
+        """VM, slave and credentials count; the count is left at 0 without
+        ``with_credentials``."""
+        if with_credentials:
+            credentials = (
+                select(VmCredentialORM.vm_id,
+                       func.count().label("credentials_count"))
+                .group_by(VmCredentialORM.vm_id)
+            )
+            if vm_id is not None:
+                credentials = credentials.where(
+                    VmCredentialORM.vm_id == vm_id)
+            credentials = credentials.subquery()
+            statement = (
+                select(
+                    VmORM,
+                    SlaveORM,
+                    func.coalesce(credentials.c.credentials_count, 0),
+                )
+                .outerjoin(credentials, credentials.c.vm_id == VmORM.id)
+            )
+        else:
+            statement = select(VmORM, SlaveORM, literal(0))
+        statement = statement.outerjoin(
+            SlaveORM, VmORM.slave_id == SlaveORM.id)
+        if vm_id is not None:
+            statement = statement.where(VmORM.id == vm_id)
+        return statement
+
+    @staticmethod
+    def list_rows(
+        vm_ids: Optional[list[uuid.UUID]] = None,
+        with_credentials: bool = True,
+    ) -> list[VmRow]:
+        """Every VM, or those of ``vm_ids``, except warm pool members, which
+        stay hidden until claimed."""
+        statement = VmQuery._statement(
+            with_credentials=with_credentials,
+        ).where(VmORM.pool_profile_id.is_(None))
+        if vm_ids is not None:
+            statement = statement.where(VmORM.id.in_(vm_ids))
+        with Session(engine) as session:
+            rows = session.exec(statement).all()
+        return [VmRow(*row) for row in rows]
+
+    @staticmethod
+    def page_rows(
+        filters: VmFilters,
+        sort: str = "name",
+        limit: Optional[int] = None,
+        after: Optional[str] = None,
+        with_credentials: bool = True,
+    ) -> list[VmRow]:
+        """VMs matching ``filters`` in ``sort`` order, after a cursor.
+
+        Pages are keyset-paginated on (sort column, id), so a page costs the
+        same wherever it starts and VMs created meanwhile are not skipped.
+        """
+        field, descending = parse_sort(sort)
+        column = SORT_COLUMNS[field]
+        statement = VmQuery._statement(
+            with_credentials=with_credentials,
+        ).where(VmORM.pool_profile_id.is_(None))
+        if filters.master_only:
+            statement = statement.where(VmORM.slave_id.is_(None))
+        elif filters.slave_id is not None:
+            statement = statement.where(VmORM.slave_id == filters.slave_id)
+        if filters.os:
+            statement = statement.where(VmORM.os == filters.os)
+        if filters.name_prefix:
+            statement = statement.where(VmORM.name.like(
+                _escape_like(filters.name_prefix) + "%", escape="\\"))
+        if filters.event_id is not None:
+            statement = statement.where(VmORM.id.in_(
+                select(EventParticipantORM.vm_id).where(
+                    EventParticipantORM.event_id == filters.event_id)
+            ))
+        if filters.vm_ids is not None:
+            statement = statement.where(VmORM.id.in_(filters.vm_ids))
+        if after is not None:
+            value, vm_id = decode_cursor(after)
+            key = tuple_(column, VmORM.id)
+            statement = statement.where(
+                key < tuple_(value, vm_id) if descending
+                else key > tuple_(value, vm_id))
+        if descending:
+            statement = statement.order_by(column.desc(), VmORM.id.desc())
+        else:
+            statement = statement.order_by(column, VmORM.id)
+        if limit is not None:
+            statement = statement.limit(limit)
+        with Session(engine) as session:
+            rows = session.exec(statement).all()
+        return [VmRow(*row) for row in rows]
+
+    @staticmethod
+    def get_row(
+        vm_id: uuid.UUID,
+        with_credentials: bool = True,
+    ) -> Optional[VmRow]:
+        with Session(engine) as session:
+            row = session.exec(
+                VmQuery._statement(vm_id, with_credentials)).first()
+        return VmRow(*row) if row else None
@@ -1,34 +1,58 @@
 import uuid
 import subprocess
+from datetime import datetime, timezone
 import logging
-from shutil import copy, rmtree
+from shutil import rmtree
 import libvirt
-from app.utils.vm import wait_for_state
-from typing import Optional
-from app.core.constants import VMS_DIR, IMAGES_DIR, VM_STATE_NAMES
-from app.models.vm import VmCreate, VmRead, VmCredentialCreateRequest, RecoverableVm, RecoverableVmCreate, VmCreateXML, VmRename
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, Optional
+from app.core.constants import VMS_DIR, VM_HIBERNATED_STATE, VM_STATE_NAMES
+from app.models.vm import VmCreate, VmRead, VmCredentialCreateRequest, RecoverableVm, RecoverableVmCreate, VmCreateXML, VmRename, VmShutdownPolicy, VmShutdownPolicyRead
 from app.models.image import ImageRead
-from app.core.xml_builder import build_xml
-from app.core.config import QEMUConfig, engine
+from app.core.xml_builder import build_xml, DomainTemplate
+from app.core.config import (
+    QEMUConfig,
+    engine,
+    DISK_PROVISIONING,
+    SLAVE_INVENTORY_TIMEOUT,
+    VM_START_TIMEOUT,
+    VM_STOP_TIMEOUT,
+)
 from sqlalchemy import func
-from sqlmodel import Session, select, delete
+from sqlmodel import Session, select, delete, update
 from app.orm.vm import VmORM
 from app.orm.vm_credential import VmCredentialORM
-from app.orm.event import EventParticipantORM
+from app.orm.event import EventORM, EventParticipantORM
 from app.orm.slave import SlaveORM
 from fastapi import status, HTTPException
-from app.utils.vm import get_vm_ip
+from app.utils.vm import get_vm_ips, invalidate_vm_ip
+from app.utils.vnc import get_vnc_port
 from app.utils.crypto import decrypt_secret, encrypt_secret
 from app.utils.seed import ensure_seed_iso
-from app.core.config import s3, distribox_bucket_registry
-from os import path
+from app.utils.qcow2 import clone_image, branch_disk, prune_unused_bases
+from app.utils.disk_copy import copy_disk
 from app.services.image_service import ImageService
-import yaml
+from app.services.image_cache import image_cache
+from app.services.vm_query import (
+    VmFilters,
+    VmQuery,
+    VmRow,
+    encode_cursor,
+    parse_sort,
+    project,
+    wants,
+)
+from app.services.domain_state_cache import domain_state_cache
+from app.services.vm_shutdown import ShutdownResult, shutdown_scheduler
 from pathlib import Path
 from sqlalchemy.orm import make_transient
 
 logger = logging.getLogger(__name__)
 
+# Called with (phase, fraction) as a VM is provisioned. Phases are
+# "download", "clone", "seed", "define" and "boot".
+ProvisionProgress = Callable[[str, float], None]
+
 
 def ensure_default_network():
     try:
@@ -45,6 +69,15 @@ def ensure_default_network():
         )
 
 
+def _prune_bases() -> None:
+    """Drop unused base layers; a failure leaves them for the next prune
+    rather than failing the deletion that triggered it."""
+    try:
+        prune_unused_bases()
+    except Exception:
+        logger.exception("Failed to prune unused base layers")
+
+
 class Vm:
     @staticmethod
     def _resolve_image_name(os_value: str) -> str:
@@ -55,29 +88,13 @@ class Vm:
             )
         return os_value
 
-    @staticmethod
-    def has_revision_changed(metadata_filename: str) -> bool:
-        if (path.exists(IMAGES_DIR / metadata_filename) is False):
-            return True
-
-        metadata_file = s3.get_object(
-            Bucket=distribox_bucket_registry,
-            Key=metadata_filename)
-        file_content = metadata_file["Body"].read().decode("utf-8")
-
-        metadata = yaml.safe_load(file_content)
-        local_metadata = yaml.safe_load(
-            (IMAGES_DIR /
-             metadata_filename).read_text(
-                encoding="utf-8"))
-
-        revision = metadata["revision"]
-        local_revision = local_metadata["revision"]
-        if (revision != local_revision):
-            return True
-        return False
-
-    def __init__(self, vm_create: VmCreate):
+    def __init__(
+        self,
+        vm_create: VmCreate,
+        progress: Optional[ProvisionProgress] = None,
+        xml_template: Optional[DomainTemplate] = None,
+        pool_profile_id: Optional[uuid.UUID] = None,
+    ):
         self.id = uuid.uuid4()
         self.name = vm_create.name
         self.os = self._resolve_image_name(vm_create.os)
@@ -90,43 +107,46 @@ class Vm:
         self.ipv4: Optional[str] = None
         self.credentials_count: int = 0
 
+        def report(phase: str, fraction: float = 0.0) -> None:
+            if progress is not None:
+                progress(phase, fraction)
+
+        def report_download(done: int, total: int) -> None:
+            report("download", done / total if total else 0.0)
+
+        def report_clone(done: int, total: int) -> None:
+            report("clone", done / total if total else 0.0)
+
         vm_dir = VMS_DIR / str(self.id)
-        distribox_image_dir = IMAGES_DIR / self.os
-
-        metadata_filename = self.os.replace("qcow2", "metadata.yaml")
-        if (self.has_revision_changed(metadata_filename) is True):
-            s3.download_file(
-                distribox_bucket_registry,
-                metadata_filename,
-                IMAGES_DIR / metadata_filename)
         try:
-            if (path.exists(distribox_image_dir)
-                    is False or self.has_revision_changed is True):
-                s3.download_file(
-                    distribox_bucket_registry,
-                    self.os,
-                    distribox_image_dir)
-
-            vm_dir.mkdir(parents=True, exist_ok=True)
-            ensure_seed_iso(
+            report("download")
+            with image_cache.use(self.os, report_download) as image:
+                report("clone")
+                vm_dir.mkdir(parents=True, exist_ok=True)
+                vm_path = vm_dir / self.os
+                if DISK_PROVISIONING == "linked":
+                    clone_image(
+                        image.path,
+                        image.tag,
+                        vm_path,
+                        grow_gb=self.disk_size,
+                    )
+                else:
+                    copy_disk(image.path, vm_path, progress=report_clone)
+                    subprocess.run(
+                        ["qemu-img", "resize", vm_path,
+                         f"+{self.disk_size}G"],
+                        check=True,
+                    )
+            report("seed")
+            seed_iso = ensure_seed_iso(
                 keyboard_layout=self.keyboard_layout,
                 vm_dir=vm_dir,
             )
-            copy(distribox_image_dir, vm_dir)
-            vm_path = vm_dir / self.os
-            subprocess.run(
-                ["qemu-img", "resize", vm_path, f"+{self.disk_size}G"],
-                check=True,
-            )
-            vm_xml = build_xml(VmCreateXML(
-                id=self.id,
-                os=self.os,
-                name=self.name,
-                mem=self.mem,
-                vcpus=self.vcpus,
-                disk_size=self.disk_size,
-                keyboard_layout=self.keyboard_layout,
-            ))
+            report("define")
+            if xml_template is None:
+                xml_template = DomainTemplate(vm_create)
+            vm_xml = xml_template.render(self.id, seed_iso)
             conn = QEMUConfig.get_connection()
             conn.defineXML(vm_xml)
             with Session(engine) as session:
@@ -139,49 +159,87 @@ class Vm:
                     disk_size=self.disk_size,
                     keyboard_layout=self.keyboard_layout,
                     slave_id=getattr(vm_create, 'slave_id', None),
+                    pool_profile_id=pool_profile_id,
                 )
                 session.add(vm_record)
                 session.commit()
             if vm_create.activate_at_start is True:
+                report("boot")
                 self.start()
         except Exception:
             raise
 
     @classmethod
-    def get(cls, vm_id: str):
+    def from_record(
+        cls,
+        vm_record: VmORM,
+        state_code: int,
+        slave_name: Optional[str],
+        credentials_count: int,
+        ipv4: Optional[str] = None,
+    ) -> "Vm":
+        vm_instance = cls.__new__(cls)
+        vm_instance.id = vm_record.id
+        vm_instance.name = vm_record.name
+        vm_instance.os = vm_record.os
+        vm_instance.mem = vm_record.mem
+        vm_instance.vcpus = vm_record.vcpus
+        vm_instance.disk_size = vm_record.disk_size
+        vm_instance.keyboard_layout = vm_record.keyboard_layout
+        vm_instance.state = VM_STATE_NAMES.get(state_code, 'None')
+        if (vm_record.hibernated_at is not None and
+                state_code == libvirt.VIR_DOMAIN_SHUTOFF):
+            vm_instance.state = VM_HIBERNATED_STATE
+        vm_instance.ipv4 = ipv4
+        vm_instance.slave_id = vm_record.slave_id
+        vm_instance.slave_name = slave_name
+        vm_instance.credentials_count = credentials_count
+        return vm_instance
+
+    @classmethod
+    def get(
+        cls,
+        vm_id: str,
+        fields: Optional[frozenset[str]] = None,
+        row: Optional[VmRow] = None,
+    ):
+        """The VM with its live state, or only what ``fields`` needs: no
+        libvirt call without state nor ipv4, no guest agent call without
+        ipv4, no credentials count without credentials_count.
+
+        ``row`` is the VM's database row when the caller already has it.
+        """
         try:
-            conn = QEMUConfig.get_connection()
-            vm = conn.lookupByName(vm_id)
-            vm_state, _ = vm.state()
-            with Session(engine) as session:
-                vm_record = session.get(VmORM, uuid.UUID(vm_id))
-                if not vm_record:
-                    raise HTTPException(
-                        status.HTTP_404_NOT_FOUND,
-                        f"Vm {vm_id} not found in database"
-                    )
-                vm_instance = cls.__new__(cls)
-                vm_instance.id = vm_record.id
-                vm_instance.name = vm_record.name
-                vm_instance.os = vm_record.os
-                vm_instance.mem = vm_record.mem
-                vm_instance.vcpus = vm_record.vcpus
-                vm_instance.disk_size = vm_record.disk_size
-                vm_instance.keyboard_layout = vm_record.keyboard_layout
-                vm_instance.state = VM_STATE_NAMES.get(vm_state, 'None')
-                vm_instance.ipv4 = get_vm_ip(str(vm_instance.id))
-                vm_instance.slave_id = vm_record.slave_id
-                vm_instance.slave_name = None
-                if vm_record.slave_id:
-                    slave = session.get(SlaveORM, vm_record.slave_id)
-                    if slave:
-                        vm_instance.slave_name = slave.name
-                credentials_count_statement = select(func.count()).where(
-                    VmCredentialORM.vm_id == vm_record.id
+            vm_state, ipv4, cached = None, None, None
+            if wants(fields, "state", "ipv4"):
+                cached = domain_state_cache.get(vm_id)
+                if cached:
+                    vm_state, ipv4 = cached.state, cached.ipv4
+                else:
+                    conn = QEMUConfig.get_connection()
+                    vm = conn.lookupByName(vm_id)
+                    vm_state, _ = vm.state()
+            if row is None:
+                row = VmQuery.get_row(
+                    uuid.UUID(vm_id),
+                    with_credentials=wants(fields, "credentials_count"),
+                )
+            if not row:
+                raise HTTPException(
+                    status.HTTP_404_NOT_FOUND,
+                    f"Vm {vm_id} not found in database"
                 )
-                vm_instance.credentials_count = session.exec(
-                    credentials_count_statement
-                ).one()
+            if (not cached and vm_state == libvirt.VIR_DOMAIN_RUNNING and
+                    wants(fields, "ipv4")):
+                # Leases only: the guest agent is left to the refresher
+                ipv4 = get_vm_ips([vm_id])[vm_id]
+            vm_instance = cls.from_record(
+                row.vm,
+                vm_state,
+                row.slave_name,
+                row.credentials_count,
+                ipv4,
+            )
         except libvirt.libvirtError as e:
             if e.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
                 raise HTTPException(status.HTTP_404_NOT_FOUND,
@@ -190,6 +248,34 @@ class Vm:
             raise
         return vm_instance
 
+    @staticmethod
+    def get_states(names: Iterable[str] = ()) -> dict[str, int]:
+        """Map every domain name to its state code.
+
+        Served from the domain state cache, or else in one libvirt call.
+        Those of ``names`` without a fresh cache entry, such as a domain
+        just changed, are looked up one by one.
+        """
+        states = domain_state_cache.states()
+        if states is None:
+            conn = QEMUConfig.get_connection()
+            return {
+                domain.name(): stats["state.state"]
+                for domain, stats in conn.getAllDomainStats(
+                    libvirt.VIR_DOMAIN_STATS_STATE)
+            }
+        for name in names:
+            if name in states:
+                continue
+            try:
+                domain = QEMUConfig.get_connection().lookupByName(name)
+                states[name], _ = domain.state()
+            except libvirt.libvirtError as e:
+                if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                    logger.warning("Failed to get state of domain %s: %s",
+                                   name, e)
+        return states
+
     @classmethod
     def get_all(cls):
         try:
@@ -203,7 +289,8 @@ class Vm:
         except Exception:
             raise
 
-    def start(self):
+    def power_on(self):
+        """Ask libvirt to start the domain, without waiting for it to run."""
         vm_dir = VMS_DIR / str(self.id)
         per_vm_seed = vm_dir / "seed.iso"
         if not per_vm_seed.exists():
@@ -216,7 +303,11 @@ class Vm:
             conn = QEMUConfig.get_connection()
             vm = conn.lookupByName(str(self.id))
             if vm.isActive() == 0:
+                # Restores the memory of a hibernated VM, if any
                 vm.create()
+                invalidate_vm_ip(str(self.id))
+                domain_state_cache.invalidate(str(self.id))
+                VmService.set_hibernated(str(self.id), False)
         except libvirt.libvirtError as e:
             if e.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
                 raise HTTPException(status.HTTP_404_NOT_FOUND,
@@ -227,7 +318,10 @@ class Vm:
             ) from e
         except Exception:
             raise
-        state_code = wait_for_state(vm, libvirt.VIR_DOMAIN_RUNNING, 0.5, 10)
+        return vm
+
+    def started(self, state_code: int):
+        """Record the state reached after ``power_on``."""
         self.state = VM_STATE_NAMES.get(state_code, 'None')
         if state_code != libvirt.VIR_DOMAIN_RUNNING:
             raise HTTPException(
@@ -236,26 +330,49 @@ class Vm:
                     self.id}. Current state: {
                     self.state}",
             )
-        self.ipv4 = get_vm_ip(str(self.id))
+        # The guest is still booting, the state cache looks its address up
+        # in the background
+        self.ipv4 = None
         return self
 
-    def stop(self):
+    def start(self):
+        vm = self.power_on()
+        state_code = domain_state_cache.wait_for_state(
+            vm, libvirt.VIR_DOMAIN_RUNNING, VM_START_TIMEOUT)
+        return self.started(state_code)
+
+    def stop_failed(self, e: libvirt.libvirtError) -> HTTPException:
+        if e.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
+            return HTTPException(status.HTTP_404_NOT_FOUND,
+                                 f'Vm {self.id} not found')
+        return HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Failed to stop VM {self.id}: {str(e)}",
+        )
+
+    def stopped(self, result: ShutdownResult):
+        """Record the outcome of a shutdown."""
+        self.state = VM_STATE_NAMES.get(result.state, 'None')
+        self.shutdown_stage = result.stage
+        invalidate_vm_ip(str(self.id))
+        domain_state_cache.invalidate(str(self.id))
+        return self
+
+    def stop(self, grace: Optional[float] = None):
+        """Shut the guest down, destroying it after ``grace`` seconds, its
+        own shutdown grace by default."""
+        if grace is None:
+            grace = VmService.get_shutdown_grace(str(self.id))
         try:
-            conn = QEMUConfig.get_connection()
-            vm = conn.lookupByName(str(self.id))
-            if vm.isActive() == 1:
-                vm.shutdown()
+            result = shutdown_scheduler.shut_down(str(self.id), grace)
         except libvirt.libvirtError as e:
-            if e.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
-                raise HTTPException(status.HTTP_404_NOT_FOUND,
-                                    f'Vm {self.id} not found')
-        except Exception:
-            raise
-        state_code = wait_for_state(vm, libvirt.VIR_DOMAIN_SHUTOFF, 5, 10)
-        self.state = VM_STATE_NAMES.get(state_code, 'None')
-        return self
+            raise self.stop_failed(e) from e
+        return self.stopped(result)
 
     def get_state(self):
+        cached = domain_state_cache.get(str(self.id))
+        if cached:
+            return {"state": VM_STATE_NAMES.get(cached.state, 'None')}
         try:
             conn = QEMUConfig.get_connection()
             vm = conn.lookupByName(str(self.id))
@@ -269,13 +386,16 @@ class Vm:
             self.stop()
             conn = QEMUConfig.get_connection()
             vm = conn.lookupByName(str(self.id))
-            vm.undefine()
+            vm.undefineFlags(libvirt.VIR_DOMAIN_UNDEFINE_MANAGED_SAVE)
         except Exception:
             pass
+        invalidate_vm_ip(str(self.id))
+        domain_state_cache.invalidate(str(self.id))
 
         vm_dir = VMS_DIR / str(self.id)
         if vm_dir.exists():
             rmtree(vm_dir)
+        _prune_bases()
 
         with Session(engine) as session:
             session.exec(
@@ -330,10 +450,11 @@ class VmService:
     def _get_slave_for_vm(vm_id: str) -> Optional[SlaveORM]:
         """Check if a VM is hosted on a slave node."""
         with Session(engine) as session:
-            vm_record = session.get(VmORM, uuid.UUID(vm_id))
-            if vm_record and vm_record.slave_id:
-                return session.get(SlaveORM, vm_record.slave_id)
-        return None
+            return session.exec(
+                select(SlaveORM)
+                .join(VmORM, VmORM.slave_id == SlaveORM.id)
+                .where(VmORM.id == uuid.UUID(vm_id))
+            ).first()
 
     @staticmethod
     def _get_duplicate_name(session: Session, vm_name: str) -> str:
@@ -349,100 +470,228 @@ class VmService:
             return base_name
         return f"{base_name}({count})"
 
-    def get_vm_list():
-        with Session(engine) as session:
-            vm_records = session.scalars(select(VmORM)).all()
-        vm_list = []
-        for vm_record in vm_records:
+    @staticmethod
+    def _resolve_rows(
+        rows: list[VmRow],
+        fields: Optional[frozenset[str]] = None,
+    ) -> list[tuple[VmRow, object]]:
+        """Pair each row with its live view, skipping unknown local VMs.
+
+        Live state is only fetched for ``rows``, and only if ``fields``
+        needs it: one state lookup for the local VMs and one request per
+        slave hosting some of them, addresses only for ``ipv4``.
+        """
+        if not wants(fields, "state", "ipv4"):
+            return [
+                (row, row.unknown_state() if row.vm.slave_id else
+                 Vm.from_record(row.vm, None, None, row.credentials_count))
+                for row in rows
+            ]
+
+        states: dict[str, int] = {}
+        local_names = [str(row.vm.id) for row in rows if not row.vm.slave_id]
+        if local_names:
+            try:
+                states = Vm.get_states(local_names)
+            except libvirt.libvirtError:
+                logger.warning("Failed to list domains from libvirt",
+                               exc_info=True)
+
+        # Only a running guest can have an address. Those found by the
+        # state cache are used first, the others are read from the leases.
+        ips: dict[str, Optional[str]] = {}
+        if wants(fields, "ipv4"):
+            missing = []
+            for row in rows:
+                name = str(row.vm.id)
+                if (row.vm.slave_id or
+                        states.get(name) != libvirt.VIR_DOMAIN_RUNNING):
+                    continue
+                cached = domain_state_cache.get(name)
+                if cached and cached.ipv4:
+                    ips[name] = cached.ipv4
+                else:
+                    missing.append(name)
+            ips.update(get_vm_ips(missing))
+
+        slave_rows: dict[uuid.UUID, list[VmRow]] = {}
+        for row in rows:
+            if row.slave and row.slave.status == "online":
+                slave_rows.setdefault(row.slave.id, []).append(row)
+        slave_vms = VmService._list_slave_vms([
+            (slave_row[0].slave, [str(r.vm.id) for r in slave_row])
+            for slave_row in slave_rows.values()
+        ], fields)
+
+        resolved = []
+        for row in rows:
+            vm_record = row.vm
             if vm_record.slave_id:
-                # For slave-hosted VMs, build a lightweight response
-                # without hitting local libvirt
-                slave = None
-                with Session(engine) as session:
-                    slave = session.get(SlaveORM, vm_record.slave_id)
-                if slave and slave.status == "online":
-                    try:
-                        from app.services.slave_client import slave_get_vm
-                        data = slave_get_vm(slave, str(vm_record.id))
-                        data["slave_id"] = str(vm_record.slave_id)
-                        data["slave_name"] = slave.name
-                        vm_list.append(data)
-                        continue
-                    except Exception:
-                        pass
-                # Slave offline or unreachable — show VM with unknown state
-                vm_list.append({
-                    "id": str(vm_record.id),
-                    "name": vm_record.name,
-                    "os": vm_record.os,
-                    "mem": vm_record.mem,
-                    "vcpus": vm_record.vcpus,
-                    "disk_size": vm_record.disk_size,
-                    "keyboard_layout": vm_record.keyboard_layout,
-                    "state": "Unknown",
-                    "ipv4": None,
-                    "credentials_count": 0,
-                    "slave_id": str(vm_record.slave_id),
-                    "slave_name": slave.name if slave else "Unknown",
-                })
-            else:
-                try:
-                    vm_list.append(Vm.get(str(vm_record.id)))
-                except Exception:
-                    logger.warning(
-                        "Failed to get VM %s from libvirt", vm_record.id)
-        return vm_list
-
-    def get_vm(vm_id: str):
-        slave = VmService._get_slave_for_vm(vm_id)
-        if slave:
-            if slave.status != "online":
-                with Session(engine) as session:
-                    vm_record = session.get(VmORM, uuid.UUID(vm_id))
-                    if not vm_record:
-                        raise HTTPException(
-                            status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f"Vm {vm_id} not found",
-                        )
-                    return {
-                        "id": str(vm_record.id),
-                        "name": vm_record.name,
-                        "os": vm_record.os,
-                        "mem": vm_record.mem,
-                        "vcpus": vm_record.vcpus,
-                        "disk_size": vm_record.disk_size,
-                        "keyboard_layout": vm_record.keyboard_layout,
-                        "state": "Unknown",
-                        "ipv4": None,
-                        "credentials_count": 0,
-                        "slave_id": str(slave.id),
-                        "slave_name": slave.name,
-                    }
+                data = slave_vms.get(str(vm_record.id))
+                if data is None:
+                    # Slave offline, slow or unreachable
+                    resolved.append((row, row.unknown_state()))
+                    continue
+                data["slave_id"] = str(vm_record.slave_id)
+                data["slave_name"] = row.slave_name
+                data["credentials_count"] = row.credentials_count
+                resolved.append((row, data))
+                continue
+            state_code = states.get(str(vm_record.id))
+            if state_code is None:
+                logger.warning(
+                    "Failed to get VM %s from libvirt", vm_record.id)
+                continue
+            resolved.append((row, Vm.from_record(
+                vm_record, state_code, None, row.credentials_count,
+                ips.get(str(vm_record.id)))))
+        return resolved
+
+    def get_vm_list(
+        fields: Optional[frozenset[str]] = None,
+        vm_ids: Optional[list[str]] = None,
+    ):
+        rows = VmQuery.list_rows(
+            vm_ids=None if vm_ids is None else [
+                VmService._parse_vm_id(vm_id) for vm_id in vm_ids],
+            with_credentials=wants(fields, "credentials_count"),
+        )
+        return [vm for _, vm in VmService._resolve_rows(rows, fields)]
+
+    @staticmethod
+    def get_vm_page(
+        filters: VmFilters,
+        state: Optional[str] = None,
+        sort: str = "name",
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        fields: Optional[frozenset[str]] = None,
+    ) -> tuple[list, Optional[str]]:
+        """One page of VMs and the cursor of the next page, if any.
+
+        Filters other than ``state`` run in the database. The state is
+        live, so rows are read in batches of ``limit`` and resolved until
+        the page is full. The cursor points after the last row used, the
+        rest of the batch is read again for the next page.
+        """
+        field, _ = parse_sort(sort)
+        resolved_fields = fields
+        if state and fields is not None:
+            resolved_fields = fields | {"state"}
+        vms = []
+        while True:
+            rows = VmQuery.page_rows(
+                filters, sort, limit, cursor,
+                with_credentials=wants(fields, "credentials_count"))
+            for row, vm in VmService._resolve_rows(rows, resolved_fields):
+                vm_state = vm["state"] if isinstance(vm, dict) else vm.state
+                if state and vm_state.lower() != state.lower():
+                    continue
+                vms.append(project(vm, fields))
+                if limit is not None and len(vms) >= limit:
+                    return vms, encode_cursor(row, field)
+            if limit is None or len(rows) < limit:
+                return vms, None
+            cursor = encode_cursor(rows[-1], field)
+
+    @staticmethod
+    def _list_slave_vms(
+        slaves: list[tuple[SlaveORM, Optional[list[str]]]],
+        fields: Optional[frozenset[str]] = None,
+    ) -> dict[str, dict]:
+        """VMs of each slave, fetched from all slaves concurrently.
+
+        Each slave is asked for the given VM ids (all its VMs for None) and
+        gets ``SLAVE_INVENTORY_TIMEOUT`` seconds to answer; the VMs of a
+        slave that fails or misses the deadline are left out so the caller
+        reports them with an unknown state.
+        """
+        from app.services.slave_client import slave_list_vms
+
+        if not slaves:
+            return {}
+        pool = ThreadPoolExecutor(max_workers=len(slaves))
+        futures = {
+            pool.submit(slave_list_vms, slave, SLAVE_INVENTORY_TIMEOUT,
+                        vm_ids, fields): slave
+            for slave, vm_ids in slaves
+        }
+        done, not_done = wait(futures, timeout=SLAVE_INVENTORY_TIMEOUT)
+        # Late answers are dropped rather than waited for
+        pool.shutdown(wait=False, cancel_futures=True)
+
+        vms: dict[str, dict] = {}
+        for future in done:
+            try:
+                for data in future.result():
+                    vms[str(data["id"])] = data
+            except Exception as e:
+                logger.warning("Failed to list VMs of slave %s: %s",
+                               futures[future].name, e)
+        for future in not_done:
+            logger.warning("Slave %s did not list its VMs within %ss",
+                           futures[future].name, SLAVE_INVENTORY_TIMEOUT)
+        return vms
+
+    def get_vm(vm_id: str, fields: Optional[frozenset[str]] = None):
+        row = VmQuery.get_row(
+            VmService._parse_vm_id(vm_id),
+            with_credentials=wants(fields, "credentials_count"),
+        )
+        if row and row.slave:
+            if (row.slave.status != "online" or
+                    not wants(fields, "state", "ipv4")):
+                return project(row.unknown_state(), fields)
             from app.services.slave_client import slave_get_vm
-            data = slave_get_vm(slave, vm_id)
-            data["slave_id"] = str(slave.id)
-            data["slave_name"] = slave.name
-            return data
-        vm = Vm.get(vm_id)
-        return vm
+            data = slave_get_vm(row.slave, vm_id, fields)
+            data["slave_id"] = str(row.slave.id)
+            data["slave_name"] = row.slave.name
+            data["credentials_count"] = row.credentials_count
+            return project(data, fields)
+        if row is None:
+            raise HTTPException(
+                status.HTTP_404_NOT_FOUND,
+                f"Vm {vm_id} not found in database"
+            )
+        vm = Vm.get(vm_id, fields, row)
+        return project(vm, fields)
+
+    def get_vnc_port(vm_id: str) -> int:
+        cached = domain_state_cache.get(vm_id)
+        if cached and cached.vnc_port is not None:
+            return cached.vnc_port
+        return get_vnc_port(vm_id)
 
     def get_state(vm_id: str):
         vm = Vm.get(vm_id)
         state = vm.get_state()
         return state
 
-    def create_vm(vm_create: VmCreate):
+    def create_vm(
+        vm_create: VmCreate,
+        progress: Optional[ProvisionProgress] = None,
+        pool_profile_id: Optional[uuid.UUID] = None,
+    ):
+        """Create a VM, as a member of a warm pool with ``pool_profile_id``
+        so that it never shows up as a regular VM before it is claimed."""
+        slave_id = VmService._pick_slave(vm_create)
+        if slave_id:
+            vm_create.slave_id = slave_id
+            return VmService._create_vm_on_slave(
+                vm_create, progress, pool_profile_id)
+        vm = Vm(vm_create, progress, pool_profile_id=pool_profile_id)
+        return vm
+
+    @staticmethod
+    def _pick_slave(vm_create: VmCreate) -> Optional[uuid.UUID]:
+        """Slave ``vm_create`` goes to, None for this node."""
         if vm_create.slave_id:
-            return VmService._create_vm_on_slave(vm_create)
+            return vm_create.slave_id
         if vm_create.auto_place:
-            slave_id = VmService._auto_pick_node(
+            return VmService._auto_pick_node(
                 vm_create.mem, vm_create.vcpus, vm_create.disk_size
             )
-            if slave_id:
-                vm_create.slave_id = slave_id
-                return VmService._create_vm_on_slave(vm_create)
-        vm = Vm(vm_create)
-        return vm
+        return None
 
     @staticmethod
     def _auto_pick_node(
@@ -483,19 +732,44 @@ class VmService:
         return best_slave.id if best_slave else None
 
     @staticmethod
-    def _create_vm_on_slave(vm_create: VmCreate):
-        """Create a VM on a slave node."""
+    def _create_vm_on_slave(
+        vm_create: VmCreate,
+        progress: Optional[ProvisionProgress] = None,
+        pool_profile_id: Optional[uuid.UUID] = None,
+    ):
+        """Create a VM on a slave node.
+
+        With a progress callback the VM is provisioned as a job on the slave,
+        which is followed by the slave job poller instead of holding one long
+        request.
+        """
+        if progress is not None:
+            slave, future = VmService._submit_slave_job(vm_create, progress)
+            return VmService._finish_slave_job(
+                vm_create, slave, future.result(), pool_profile_id)
+
         from app.services.slave_client import slave_create_vm
+        slave = VmService._online_slave(vm_create.slave_id)
+        result = slave_create_vm(slave, VmService._slave_payload(vm_create))
+        return VmService._register_slave_vm(
+            vm_create, slave, result, pool_profile_id)
+
+    @staticmethod
+    def _online_slave(slave_id: uuid.UUID) -> SlaveORM:
         from app.services.slave_service import SlaveService
 
-        slave = SlaveService.get_slave(str(vm_create.slave_id))
+        slave = SlaveService.get_slave(str(slave_id))
         if slave.status != "online":
             raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT,
                 detail=f"Slave {slave.name} is not online",
             )
+        return slave
 
-        payload = {
+    @staticmethod
+    def _slave_payload(vm_create: VmCreate) -> dict:
+        """What a slave needs to create ``vm_create`` on itself."""
+        return {
             "os": vm_create.os,
             "name": vm_create.name,
             "mem": vm_create.mem,
@@ -504,10 +778,48 @@ class VmService:
             "keyboard_layout": vm_create.keyboard_layout,
             "activate_at_start": vm_create.activate_at_start,
         }
-        result = slave_create_vm(slave, payload)
-        vm_id = result["id"]
 
-        # Store a reference in the master DB
+    @staticmethod
+    def _submit_slave_job(
+        vm_create: VmCreate,
+        progress: Optional[ProvisionProgress] = None,
+    ) -> tuple[SlaveORM, Future]:
+        """Queue ``vm_create`` as a provisioning job on its slave.
+
+        The future resolves with the finished job, to be passed to
+        ``_finish_slave_job``.
+        """
+        from app.services.slave_client import slave_submit_provision_job
+        from app.services.slave_job_poller import slave_job_poller
+
+        slave = VmService._online_slave(vm_create.slave_id)
+        job = slave_submit_provision_job(
+            slave, VmService._slave_payload(vm_create))
+        return slave, slave_job_poller.follow(slave, job, progress)
+
+    @staticmethod
+    def _finish_slave_job(
+        vm_create: VmCreate,
+        slave: SlaveORM,
+        job: dict,
+        pool_profile_id: Optional[uuid.UUID] = None,
+    ) -> dict:
+        """Register the VM a slave job created."""
+        from app.services.slave_client import slave_get_vm
+
+        result = slave_get_vm(slave, job["vm_id"])
+        return VmService._register_slave_vm(
+            vm_create, slave, result, pool_profile_id)
+
+    @staticmethod
+    def _register_slave_vm(
+        vm_create: VmCreate,
+        slave: SlaveORM,
+        result: dict,
+        pool_profile_id: Optional[uuid.UUID] = None,
+    ) -> dict:
+        """Store a reference to a VM created on a slave in the master DB."""
+        vm_id = result["id"]
         with Session(engine) as session:
             vm_record = VmORM(
                 id=uuid.UUID(vm_id) if isinstance(vm_id, str) else vm_id,
@@ -518,6 +830,7 @@ class VmService:
                 disk_size=vm_create.disk_size,
                 keyboard_layout=vm_create.keyboard_layout,
                 slave_id=slave.id,
+                pool_profile_id=pool_profile_id,
             )
             session.add(vm_record)
             session.commit()
@@ -536,14 +849,54 @@ class VmService:
                 )
             from app.services.slave_client import slave_start_vm
             data = slave_start_vm(slave, vm_id)
+            VmService.set_hibernated(vm_id, False)
             data["slave_id"] = str(slave.id)
             data["slave_name"] = slave.name
             return data
         vm = Vm.get(vm_id)
         return vm.start()
 
-    def stop_vm(vm_id: str):
+    @staticmethod
+    def is_hibernated(vm_id: str) -> bool:
+        with Session(engine) as session:
+            hibernated_at = session.exec(
+                select(VmORM.hibernated_at)
+                .where(VmORM.id == VmService._parse_vm_id(vm_id))
+            ).first()
+        return hibernated_at is not None
+
+    @staticmethod
+    def set_hibernated(vm_id: str, hibernated: bool) -> None:
+        """Flag a VM as saved to disk for being idle, or clear the flag."""
+        statement = update(VmORM).where(
+            VmORM.id == VmService._parse_vm_id(vm_id))
+        if hibernated:
+            statement = statement.values(
+                hibernated_at=datetime.now(timezone.utc))
+        else:
+            statement = statement.where(
+                VmORM.hibernated_at.is_not(None)).values(hibernated_at=None)
+        with Session(engine) as session:
+            session.exec(statement)
+            session.commit()
+        domain_state_cache.mark_hibernated(vm_id, hibernated)
+
+    @staticmethod
+    def get_hibernated_ids() -> list[str]:
+        """VMs of this node flagged as hibernated."""
+        with Session(engine) as session:
+            vm_ids = session.exec(
+                select(VmORM.id).where(VmORM.hibernated_at.is_not(None),
+                                       VmORM.slave_id.is_(None))
+            ).all()
+        return [str(vm_id) for vm_id in vm_ids]
+
+    def stop_vm(vm_id: str, grace: Optional[float] = None):
+        """Stop a VM, destroying it after ``grace`` seconds, its shutdown
+        grace by default."""
         slave = VmService._get_slave_for_vm(vm_id)
+        if grace is None:
+            grace = VmService.get_shutdown_grace(vm_id)
         if slave:
             if slave.status != "online":
                 raise HTTPException(
@@ -551,12 +904,52 @@ class VmService:
                     detail=f"Slave {slave.name} is offline",
                 )
             from app.services.slave_client import slave_stop_vm
-            data = slave_stop_vm(slave, vm_id)
+            data = slave_stop_vm(slave, vm_id, grace)
             data["slave_id"] = str(slave.id)
             data["slave_name"] = slave.name
             return data
         vm = Vm.get(vm_id)
-        return vm.stop()
+        return vm.stop(grace)
+
+    @staticmethod
+    def get_shutdown_grace(vm_id: str) -> float:
+        """Seconds a stop gives a VM before destroying it: its own grace,
+        else the shortest of its events, else ``VM_STOP_TIMEOUT``."""
+        parsed_id = VmService._parse_vm_id(vm_id)
+        with Session(engine) as session:
+            grace = session.exec(
+                select(VmORM.shutdown_grace).where(VmORM.id == parsed_id)
+            ).first()
+            if grace is None:
+                grace = session.exec(
+                    select(func.min(EventORM.shutdown_grace))
+                    .join(EventParticipantORM,
+                          EventParticipantORM.event_id == EventORM.id)
+                    .where(EventParticipantORM.vm_id == parsed_id)
+                ).first()
+        return VM_STOP_TIMEOUT if grace is None else grace
+
+    @staticmethod
+    def get_shutdown_policy(vm_id: str) -> VmShutdownPolicyRead:
+        with Session(engine) as session:
+            vm = VmService._get_vm_or_404(session, vm_id)
+            grace = vm.shutdown_grace
+        return VmShutdownPolicyRead(
+            grace=grace,
+            effective_grace=VmService.get_shutdown_grace(vm_id),
+        )
+
+    @staticmethod
+    def set_shutdown_policy(
+        vm_id: str,
+        policy: VmShutdownPolicy,
+    ) -> VmShutdownPolicyRead:
+        with Session(engine) as session:
+            vm = VmService._get_vm_or_404(session, vm_id)
+            vm.shutdown_grace = policy.grace
+            session.add(vm)
+            session.commit()
+        return VmService.get_shutdown_policy(vm_id)
 
     def remove_vm(vm_id: str):
         slave = VmService._get_slave_for_vm(vm_id)
@@ -597,7 +990,7 @@ class VmService:
                     detail=f"Slave {slave.name} is offline",
                 )
             from app.services.slave_client import slave_stop_vm, slave_start_vm
-            slave_stop_vm(slave, vm_id)
+            slave_stop_vm(slave, vm_id, VmService.get_shutdown_grace(vm_id))
             data = slave_start_vm(slave, vm_id)
             data["slave_id"] = str(slave.id)
             data["slave_name"] = slave.name
@@ -761,6 +1154,7 @@ class VmService:
         for v in vm_root.iterdir():
             if v.name == vm_id:
                 rmtree(VMS_DIR / v.name)
+                _prune_bases()
                 return
         raise HTTPException(
             status.HTTP_404_NOT_FOUND,
@@ -776,6 +1170,7 @@ class VmService:
                 if v.name == str(x.vm_id):
                     rmtree(VMS_DIR / v.name)
                     break
+        _prune_bases()
         return
 
     @staticmethod
@@ -784,25 +1179,41 @@ class VmService:
             vm_to_duplicate = VmService._get_vm_or_404(session, vm_id)
             duplicate_vm = VmORM(**vm_to_duplicate.model_dump())
             duplicate_vm.id = uuid.uuid4()
+            # The copy has no save file and is nobody's warm pool member
+            duplicate_vm.hibernated_at = None
+            duplicate_vm.pool_profile_id = None
             duplicate_vm.name = VmService._get_duplicate_name(
                 session, duplicate_vm.name)
 
             src_dir = VMS_DIR / vm_id
             dest_path = VMS_DIR / str(duplicate_vm.id)
+            seed_src = src_dir / "seed.iso"
+            has_seed = seed_src.exists()
 
-            vm_xml = build_xml(VmCreateXML(**duplicate_vm.model_dump()))
+            vm_xml = build_xml(
+                VmCreateXML(**duplicate_vm.model_dump()),
+                seed_iso=dest_path / "seed.iso" if has_seed else None,
+            )
 
             try:
                 session.add(duplicate_vm)
                 session.commit()
 
                 dest_path.mkdir(parents=True, exist_ok=True)
-                copy(src_dir / duplicate_vm.os, dest_path / duplicate_vm.os)
-                seed_src = src_dir / "seed.iso"
-                if seed_src.exists():
-                    copy(seed_src, dest_path / "seed.iso")
-
+                src_disk = src_dir / duplicate_vm.os
+                dest_disk = dest_path / duplicate_vm.os
                 conn = QEMUConfig.get_connection()
+                src_domain = conn.lookupByName(vm_id)
+                # Branching swaps the source disk file, which is only safe
+                # while QEMU does not hold it open.
+                if (DISK_PROVISIONING == "linked" and
+                        not src_domain.isActive()):
+                    branch_disk(src_disk, dest_disk)
+                else:
+                    copy_disk(src_disk, dest_disk)
+                if has_seed:
+                    copy_disk(seed_src, dest_path / "seed.iso")
+
                 conn.defineXML(vm_xml)
             except Exception as e:
                 if dest_path.exists():
@@ -0,0 +1,125 @@
+"""Shutdown of the domains of this node, escalating until they are off.
+
+A guest is first asked to power off with the ACPI power button. If it
+still runs after half its grace period it is asked again through its guest
+agent, and if it still runs once the grace period is over it is destroyed.
+A stage whose request fails (no ACPI support, no agent) hands over to the
+next one at once, unless an earlier request went through.
+
+Every shutdown is a coroutine of one event loop running in its own thread,
+woken by libvirt events through the domain state cache or by its own
+timer, so a guest taking its time holds no thread. Shutting down a domain
+already being shut down joins the running shutdown.
+"""
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Optional
+
+import libvirt
+
+from app.core.config import QEMUConfig
+from app.services.domain_state_cache import domain_state_cache
+
+logger = logging.getLogger(__name__)
+
+STAGE_ACPI = "acpi"
+STAGE_AGENT = "agent"
+STAGE_DESTROY = "destroy"
+
+
+@dataclass
+class ShutdownResult:
+    # State of the domain once done
+    state: int
+    # Stage after which the domain was off, None if it already was
+    stage: Optional[str]
+
+
+def _lookup(name: str):
+    return QEMUConfig.get_connection().lookupByName(name)
+
+
+class ShutdownScheduler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # name -> shutdown in progress
+        self._running: dict[str, Future] = {}
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True,
+                                 name="vm-shutdown").start()
+            return self._loop
+
+    def submit(self, name: str, grace: float) -> Future:
+        """Shut ``name`` down within ``grace`` seconds, from any thread.
+
+        The future resolves with a ``ShutdownResult``.
+        """
+        loop = self._get_loop()
+        with self._lock:
+            future = self._running.get(name)
+            if future is not None:
+                return future
+            future = asyncio.run_coroutine_threadsafe(
+                self._shut_down(name, grace), loop)
+            self._running[name] = future
+        future.add_done_callback(lambda _: self._forget(name, future))
+        return future
+
+    def shut_down(self, name: str, grace: float) -> ShutdownResult:
+        """``submit`` and wait for the result."""
+        return self.submit(name, grace).result()
+
+    def _forget(self, name: str, future: Future) -> None:
+        with self._lock:
+            if self._running.get(name) is future:
+                del self._running[name]
+
+    async def _shut_down(self, name: str, grace: float) -> ShutdownResult:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + grace
+        domain = await asyncio.to_thread(_lookup, name)
+        if not await asyncio.to_thread(domain.isActive):
+            return ShutdownResult(libvirt.VIR_DOMAIN_SHUTOFF, None)
+
+        stages = (
+            (STAGE_ACPI, libvirt.VIR_DOMAIN_SHUTDOWN_ACPI_POWER_BTN,
+             loop.time() + grace / 2),
+            (STAGE_AGENT, libvirt.VIR_DOMAIN_SHUTDOWN_GUEST_AGENT, deadline),
+        )
+        requested = False
+        for stage, flags, until in stages:
+            try:
+                await asyncio.to_thread(domain.shutdownFlags, flags)
+                requested = True
+            except libvirt.libvirtError as e:
+                logger.info("%s shutdown of VM %s failed: %s",
+                            stage, name, e)
+                if not requested:
+                    continue
+            state = await domain_state_cache.wait_for_state_async(
+                name, libvirt.VIR_DOMAIN_SHUTOFF,
+                max(0.0, until - loop.time()))
+            if state == libvirt.VIR_DOMAIN_SHUTOFF:
+                return ShutdownResult(state, stage)
+
+        logger.warning("VM %s still running after %ss, destroying it",
+                       name, grace)
+        try:
+            await asyncio.to_thread(domain.destroy)
+        except libvirt.libvirtError:
+            # Powered off meanwhile
+            if await asyncio.to_thread(domain.isActive):
+                raise
+        state, _ = await asyncio.to_thread(domain.state)
+        return ShutdownResult(state, STAGE_DESTROY)
+
+
+shutdown_scheduler = ShutdownScheduler()
@@ -0,0 +1,417 @@
+"""Warm pools of pre-provisioned VMs.
+
+A pool profile describes a VM shape (image, mem, vcpus, disk, keyboard
+layout). Every node keeps ``target`` VMs of each profile ready, so joining
+an event only claims one: the VM is renamed and handed over in a single
+database update instead of being provisioned while the participant waits.
+
+Profiles are either managed through ``/pools``, one per shape, or made for
+an event with a ``warm_pool_size`` and released with it once the event is
+deleted or past its deadline.
+"""
+import logging
+import time
+import uuid
+from typing import Optional
+
+from fastapi import HTTPException, status
+from sqlmodel import Session, select, func, or_
+
+from app.core.config import (
+    engine,
+    WARM_POOL_MIN_FREE_MEM_GB,
+    WARM_POOL_RECLAIM_BACKOFF,
+)
+from app.models.vm import VmCreate
+from app.models.vm_pool import (
+    VmPoolNodeStatus,
+    VmPoolProfileBase,
+    VmPoolProfileCreate,
+    VmPoolProfileRead,
+    VmPoolProfileUpdate,
+)
+from app.orm.slave import SlaveORM
+from app.orm.vm import VmORM
+from app.orm.vm_pool import VmPoolProfileORM
+from app.services.host_service import HostService
+from app.services.slave_service import SlaveService
+from app.services.vm_service import Vm, VmService
+
+logger = logging.getLogger(__name__)
+
+# Node (slave id, None for the master) -> monotonic time until which
+# refills leave it alone, after members were reclaimed from it
+_backoff_until: dict[Optional[uuid.UUID], float] = {}
+
+
+def _parse_profile_id(profile_id: str) -> uuid.UUID:
+    try:
+        return uuid.UUID(profile_id)
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid ID format",
+        ) from exc
+
+
+class WarmPoolService:
+
+    @staticmethod
+    def _nodes() -> list[Optional[SlaveORM]]:
+        """Master (None) followed by every online slave."""
+        return [None, *SlaveService.get_online_slaves()]
+
+    @staticmethod
+    def _to_read(
+        session: Session,
+        profile: VmPoolProfileORM,
+    ) -> VmPoolProfileRead:
+        counts = dict(session.exec(
+            select(VmORM.slave_id, func.count())
+            .where(VmORM.pool_profile_id == profile.id)
+            .group_by(VmORM.slave_id)
+        ).all())
+        nodes = [
+            VmPoolNodeStatus(
+                node_id=slave.id if slave else None,
+                node_name=slave.name if slave else "Master",
+                ready=counts.get(slave.id if slave else None, 0),
+            )
+            for slave in WarmPoolService._nodes()
+        ]
+        return VmPoolProfileRead(**profile.model_dump(), nodes=nodes)
+
+    @staticmethod
+    def _get_profile_or_404(
+        session: Session,
+        profile_id: str,
+    ) -> VmPoolProfileORM:
+        profile = session.get(VmPoolProfileORM, _parse_profile_id(profile_id))
+        if not profile:
+            raise HTTPException(status.HTTP_404_NOT_FOUND,
+                                f"Pool profile {profile_id} not found")
+        return profile
+
+    @staticmethod
+    def _shape(
+        os: str,
+        mem: int,
+        vcpus: int,
+        disk_size: int,
+        keyboard_layout: Optional[str],
+    ) -> tuple:
+        """Conditions matching the profiles of a VM shape."""
+        return (
+            VmPoolProfileORM.os == os,
+            VmPoolProfileORM.mem == mem,
+            VmPoolProfileORM.vcpus == vcpus,
+            VmPoolProfileORM.disk_size == disk_size,
+            VmPoolProfileORM.keyboard_layout == keyboard_layout,
+        )
+
+    @staticmethod
+    def _find_profile(
+        session: Session,
+        os: str,
+        mem: int,
+        vcpus: int,
+        disk_size: int,
+        keyboard_layout: Optional[str],
+    ) -> Optional[VmPoolProfileORM]:
+        """The profile of this shape managed through /pools."""
+        return session.exec(
+            select(VmPoolProfileORM).where(
+                *WarmPoolService._shape(os, mem, vcpus, disk_size,
+                                        keyboard_layout),
+                VmPoolProfileORM.event_id.is_(None),
+            )
+        ).first()
+
+    @staticmethod
+    def list_profiles() -> list[VmPoolProfileRead]:
+        with Session(engine) as session:
+            profiles = session.exec(
+                select(VmPoolProfileORM)
+                .order_by(VmPoolProfileORM.created_at)
+            ).all()
+            return [WarmPoolService._to_read(session, p) for p in profiles]
+
+    @staticmethod
+    def get_profile(profile_id: str) -> VmPoolProfileRead:
+        with Session(engine) as session:
+            profile = WarmPoolService._get_profile_or_404(session, profile_id)
+            return WarmPoolService._to_read(session, profile)
+
+    @staticmethod
+    def create_profile(payload: VmPoolProfileCreate) -> VmPoolProfileRead:
+        Vm._resolve_image_name(payload.os)
+        with Session(engine) as session:
+            if WarmPoolService._find_profile(
+                session, payload.os, payload.mem, payload.vcpus,
+                payload.disk_size, payload.keyboard_layout,
+            ):
+                raise HTTPException(
+                    status.HTTP_409_CONFLICT,
+                    "A pool profile with this VM shape already exists",
+                )
+            profile = VmPoolProfileORM(**payload.model_dump())
+            session.add(profile)
+            session.commit()
+            session.refresh(profile)
+            return WarmPoolService._to_read(session, profile)
+
+    @staticmethod
+    def create_event_profile(
+        event_id: uuid.UUID,
+        payload: VmPoolProfileCreate,
+    ) -> VmPoolProfileRead:
+        """Create the pool of an event, released by ``release_event``."""
+        Vm._resolve_image_name(payload.os)
+        with Session(engine) as session:
+            profile = VmPoolProfileORM(**payload.model_dump(),
+                                       event_id=event_id)
+            session.add(profile)
+            session.commit()
+            session.refresh(profile)
+            return WarmPoolService._to_read(session, profile)
+
+    @staticmethod
+    def get_event_profile(event_id: uuid.UUID) -> Optional[VmPoolProfileORM]:
+        with Session(engine) as session:
+            return session.exec(
+                select(VmPoolProfileORM)
+                .where(VmPoolProfileORM.event_id == event_id)
+            ).first()
+
+    @staticmethod
+    def reshape_event_profile(
+        event_id: uuid.UUID,
+        shape: VmPoolProfileBase,
+    ) -> None:
+        """Replace the pool of an event whose VM shape changed."""
+        profile = WarmPoolService.get_event_profile(event_id)
+        if profile is None or VmPoolProfileBase.model_validate(
+                profile, from_attributes=True) == shape:
+            return
+        WarmPoolService.release_event(event_id)
+        WarmPoolService.create_event_profile(event_id, VmPoolProfileCreate(
+            **shape.model_dump(),
+            target=profile.target,
+            max=profile.max,
+            boot=profile.boot,
+        ))
+
+    @staticmethod
+    def release_event(event_id: uuid.UUID) -> None:
+        """Delete the pools of an event along with their ready VMs."""
+        with Session(engine) as session:
+            profile_ids = session.exec(
+                select(VmPoolProfileORM.id)
+                .where(VmPoolProfileORM.event_id == event_id)
+            ).all()
+        for profile_id in profile_ids:
+            logger.info("Releasing pool %s of event %s", profile_id,
+                        event_id)
+            WarmPoolService.delete_profile(str(profile_id))
+
+    @staticmethod
+    def update_profile(
+        profile_id: str,
+        payload: VmPoolProfileUpdate,
+    ) -> VmPoolProfileRead:
+        with Session(engine) as session:
+            profile = WarmPoolService._get_profile_or_404(session, profile_id)
+            for key, value in payload.model_dump(exclude_unset=True).items():
+                setattr(profile, key, value)
+            if profile.target > profile.max:
+                raise HTTPException(status.HTTP_400_BAD_REQUEST,
+                                    "target must not exceed max")
+            session.add(profile)
+            session.commit()
+            session.refresh(profile)
+            return WarmPoolService._to_read(session, profile)
+
+    @staticmethod
+    def delete_profile(profile_id: str) -> None:
+        with Session(engine) as session:
+            profile = WarmPoolService._get_profile_or_404(session, profile_id)
+            member_ids = session.exec(
+                select(VmORM.id).where(VmORM.pool_profile_id == profile.id)
+            ).all()
+        for vm_id in member_ids:
+            WarmPoolService._remove_member(vm_id)
+        with Session(engine) as session:
+            # Members that could not be removed become regular VMs
+            for vm_record in session.exec(
+                select(VmORM).where(VmORM.pool_profile_id == profile.id)
+            ).all():
+                vm_record.pool_profile_id = None
+                session.add(vm_record)
+            profile = session.get(VmPoolProfileORM, profile.id)
+            if profile:
+                session.delete(profile)
+            session.commit()
+
+    @staticmethod
+    def claim(
+        vm_name: str,
+        os: str,
+        mem: int,
+        vcpus: int,
+        disk_size: int,
+        keyboard_layout: Optional[str],
+        slave_id: Optional[uuid.UUID] = None,
+        any_node: bool = True,
+        event_id: Optional[uuid.UUID] = None,
+    ) -> Optional[VmORM]:
+        """Take a ready VM of this shape out of a pool and rename it.
+
+        Only the pools of ``event_id`` and those of no event are used.
+        Prefers a member of the pool of ``event_id``, then a member on
+        ``slave_id`` (None is the master), and falls back to any node when
+        ``any_node`` is set. Returns None when no pool of this shape has a
+        ready VM, in which case the caller provisions a VM as usual.
+        """
+        pools = VmPoolProfileORM.event_id.is_(None)
+        if event_id is not None:
+            pools = or_(VmPoolProfileORM.event_id == event_id, pools)
+        with Session(engine) as session:
+            statement = (
+                select(VmORM)
+                .join(VmPoolProfileORM,
+                      VmORM.pool_profile_id == VmPoolProfileORM.id)
+                .where(pools, *WarmPoolService._shape(
+                    os, mem, vcpus, disk_size, keyboard_layout))
+                .order_by(
+                    func.coalesce(
+                        VmPoolProfileORM.event_id == event_id, False).desc(),
+                    func.coalesce(VmORM.slave_id == slave_id, False).desc())
+                .limit(1)
+                .with_for_update(skip_locked=True, of=VmORM)
+            )
+            if not any_node:
+                statement = statement.where(VmORM.slave_id == slave_id)
+            vm_record = session.exec(statement).first()
+            if not vm_record:
+                return None
+            profile = session.get(VmPoolProfileORM, vm_record.pool_profile_id)
+            vm_record.pool_profile_id = None
+            vm_record.name = vm_name
+            session.add(vm_record)
+            session.commit()
+            session.refresh(vm_record)
+            boot = profile.boot
+
+        logger.info("Claimed pooled VM %s as %s", vm_record.id, vm_name)
+        if not boot:
+            VmService.start_vm(str(vm_record.id))
+        return vm_record
+
+    @staticmethod
+    def _remove_member(vm_id: uuid.UUID) -> None:
+        try:
+            VmService.remove_vm(str(vm_id))
+        except Exception:
+            logger.exception("Failed to remove pooled VM %s", vm_id)
+
+    @staticmethod
+    def _free_mem(slave: Optional[SlaveORM]) -> float:
+        if slave is None:
+            return HostService.get_host_info().mem.available
+        return slave.available_mem
+
+    @staticmethod
+    def _reclaim(slave: Optional[SlaveORM], free_mem: float) -> None:
+        """Remove running pool members from a node short of memory, the
+        largest first and only as many as it takes to get back to
+        ``WARM_POOL_MIN_FREE_MEM_GB``, then leave the node out of refills
+        for ``WARM_POOL_RECLAIM_BACKOFF`` seconds."""
+        slave_id = slave.id if slave else None
+        _backoff_until[slave_id] = (time.monotonic() +
+                                    WARM_POOL_RECLAIM_BACKOFF)
+        with Session(engine) as session:
+            members = session.exec(
+                select(VmORM.id, VmORM.mem).where(
+                    VmORM.pool_profile_id.is_not(None),
+                    VmORM.slave_id == slave_id,
+                ).order_by(VmORM.mem.desc(), VmORM.id)
+            ).all()
+        missing = WARM_POOL_MIN_FREE_MEM_GB - free_mem
+        for vm_id, mem in members:
+            if missing <= 0:
+                break
+            try:
+                vm = VmService.get_vm(str(vm_id))
+                state = vm["state"] if isinstance(vm, dict) else vm.state
+            except Exception:
+                logger.exception("Failed to get state of pooled VM %s", vm_id)
+                continue
+            if state == "Running":
+                logger.info("Reclaiming pooled VM %s under memory pressure",
+                            vm_id)
+                WarmPoolService._remove_member(vm_id)
+                missing -= mem
+
+    @staticmethod
+    def _provision_member(
+        profile: VmPoolProfileORM,
+        slave: Optional[SlaveORM],
+    ) -> None:
+        vm_create = VmCreate(
+            name=f"pool-{str(profile.id)[:8]}-{uuid.uuid4().hex[:8]}",
+            os=profile.os,
+            mem=profile.mem,
+            vcpus=profile.vcpus,
+            disk_size=profile.disk_size,
+            keyboard_layout=profile.keyboard_layout,
+            activate_at_start=profile.boot,
+            slave_id=slave.id if slave else None,
+        )
+        # Inserted as a member, so it is never listed or announced as a
+        # regular VM before it is claimed
+        VmService.create_vm(vm_create, pool_profile_id=profile.id)
+
+    @staticmethod
+    def refill() -> None:
+        """Bring every profile back to its target on every node."""
+        with Session(engine) as session:
+            profiles = session.exec(select(VmPoolProfileORM)).all()
+        for slave in WarmPoolService._nodes():
+            slave_id = slave.id if slave else None
+            try:
+                free_mem = WarmPoolService._free_mem(slave)
+            except Exception:
+                logger.exception("Failed to read free memory of %s",
+                                 slave.name if slave else "master")
+                continue
+            if free_mem < WARM_POOL_MIN_FREE_MEM_GB:
+                WarmPoolService._reclaim(slave, free_mem)
+                continue
+            backing_off = time.monotonic() < _backoff_until.get(slave_id, 0)
+            for profile in profiles:
+                with Session(engine) as session:
+                    member_ids = session.exec(
+                        select(VmORM.id).where(
+                            VmORM.pool_profile_id == profile.id,
+                            VmORM.slave_id == slave_id,
+                        ).order_by(VmORM.id)
+                    ).all()
+                for vm_id in member_ids[profile.max:]:
+                    WarmPoolService._remove_member(vm_id)
+                if backing_off:
+                    continue
+                # Members that boot count against free memory: stopping
+                # short of the threshold keeps the next pass from
+                # reclaiming what this one creates
+                needed = profile.mem if profile.boot else 0
+                for _ in range(profile.target - len(member_ids)):
+                    if free_mem - needed < WARM_POOL_MIN_FREE_MEM_GB:
+                        break
+                    try:
+                        WarmPoolService._provision_member(profile, slave)
+                        free_mem -= needed
+                    except Exception:
+                        logger.exception(
+                            "Failed to refill pool %s on %s", profile.id,
+                            slave.name if slave else "master")
+                        break
@@ -30,6 +30,10 @@ class SystemMonitor:
             "cpu_count": 0
         }
         self.cpu_counter = {}
+        # VM name -> percent of the host CPU it used in the last sample
+        self.percent_used_by_vm: dict[str, float] = {}
+        # Incremented after every sample, tells readers the stats changed
+        self.generation = 0
         self._thread = Thread(target=self._update_loop, daemon=True).start()
 
     def _get_running_vms(self):
@@ -50,8 +54,8 @@ class SystemMonitor:
             cpu_total_counter.update(cpu.cpu_state_snapshot._asdict())
 
         stats = self._get_running_vms()
-        per_vm_counter = (
-            {"id": s[0].name(), "cpu_time": s[1]["cpu.time"] / 100000000} for s in stats)
+        per_vm_counter = [
+            {"id": s[0].name(), "cpu_time": s[1]["cpu.time"] / 100000000} for s in stats]
         return {
             "per_cpus_counter": per_cpus_counter,
             "cpu_total_counter": CPUStateSnapshot(
@@ -87,6 +91,7 @@ class SystemMonitor:
                         2))
 
             self.cpu["percent_used_per_vm"] = []
+            percent_used_by_vm = {}
             total_vms_cpu_usage = 0.0
             for vm_counter_t1 in cpu_usage_t1["per_vm_counter"]:
                 vm_counter_t2 = next(
@@ -103,7 +108,10 @@ class SystemMonitor:
                         cpu_usage_t1["cpu_total_counter"].total_time),
                     2)
                 total_vms_cpu_usage += vm_cpu_percentage
+                percent_used_by_vm[vm_counter_t1["id"]] = vm_cpu_percentage
                 self.cpu["percent_used_per_vm"].append(
                     f"{vm_counter_t1['id']}: {vm_cpu_percentage}%")
 
             self.cpu["percent_used_total_vms"] = round(total_vms_cpu_usage, 2)
+            self.percent_used_by_vm = percent_used_by_vm
+            self.generation += 1
@@ -3,7 +3,7 @@ import jwt
 from datetime import datetime, timedelta
 from typing import Callable, Optional
 from os import getenv
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlmodel import Session
 from app.core.config import engine
@@ -63,7 +63,10 @@ async def get_current_user(
     Dependency to get the current authenticated user from JWT token.
     Use this in your route handlers to protect endpoints.
     """
-    token = credentials.credentials
+    return _user_from_token(credentials.credentials)
+
+
+def _user_from_token(token: str) -> UserORM:
     payload = decode_access_token(token)
 
     if payload is None:
@@ -116,6 +119,24 @@ def require_policy(policy: str) -> Callable:
     return checker
 
 
+def require_policy_query_token(policy: str) -> Callable:
+    """``require_policy`` for clients that cannot send headers, such as
+    ``EventSource``: the JWT comes in the ``token`` query parameter."""
+    async def checker(token: str = Query(...)) -> UserORM:
+        current_user = _user_from_token(token)
+        if not user_has_policy(current_user, policy):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail={
+                    "message": "Missing required policies",
+                    "missing_policies": [policy],
+                }
+            )
+        return current_user
+
+    return checker
+
+
 async def get_current_admin_user(
         current_user: UserORM = Depends(get_current_user)) -> UserORM:
     """
@@ -0,0 +1,164 @@
+"""Minimal in-memory ISO 9660 writer with Joliet extensions.
+
+Only supports what cloud-init seeds need: a handful of small files in the
+root directory. File names are kept verbatim in the Joliet tree (which is
+what Linux mounts) and mapped to 8.3 names in the primary tree. The output
+is deterministic: timestamps are left unset so identical input always gives
+byte-identical images.
+"""
+import re
+import struct
+
+SECTOR_SIZE = 2048
+# Sectors 0-15 are the system area
+FIRST_DESCRIPTOR = 16
+# Primary, Joliet supplementary, terminator
+DESCRIPTOR_COUNT = 3
+# UCS-2 level 3
+JOLIET_ESCAPE = b"%/E"
+UNSET_DATE = b"0" * 16 + b"\x00"
+
+
+def _both16(value: int) -> bytes:
+    return struct.pack("<H", value) + struct.pack(">H", value)
+
+
+def _both32(value: int) -> bytes:
+    return struct.pack("<I", value) + struct.pack(">I", value)
+
+
+def _pad(data: bytes, size: int, fill: bytes = b"\x00") -> bytes:
+    return data + (fill * size)[:size - len(data)]
+
+
+def _sectors(size: int) -> int:
+    return max(1, -(-size // SECTOR_SIZE))
+
+
+def _primary_name(name: str) -> bytes:
+    stem, _, ext = name.upper().partition(".")
+    stem = re.sub(r"[^A-Z0-9_]", "_", stem)[:8]
+    ext = re.sub(r"[^A-Z0-9_]", "_", ext)[:3]
+    return f"{stem}.{ext};1".encode("ascii")
+
+
+def _dir_record(identifier: bytes, extent: int, size: int,
+                is_dir: bool) -> bytes:
+    length = 33 + len(identifier) + (1 - len(identifier) % 2)
+    record = (
+        bytes([length, 0]) +
+        _both32(extent) +
+        _both32(size) +
+        b"\x00" * 7 +
+        bytes([0x02 if is_dir else 0x00, 0, 0]) +
+        _both16(1) +
+        bytes([len(identifier)]) +
+        identifier
+    )
+    return _pad(record, length)
+
+
+def _path_table(root_extent: int, big_endian: bool) -> bytes:
+    fmt = ">IH" if big_endian else "<IH"
+    return bytes([1, 0]) + struct.pack(fmt, root_extent, 1) + b"\x00\x00"
+
+
+def _volume_descriptor(
+    joliet: bool,
+    volume_id: str,
+    total_sectors: int,
+    path_tables: tuple[int, int],
+    root_record: bytes,
+) -> bytes:
+    if joliet:
+        kind = 2
+        system_id = _pad(b"", 32, b"\x00 ")
+        vol_id = _pad(volume_id.encode("utf-16-be")[:32], 32, b"\x00 ")
+        escape = _pad(JOLIET_ESCAPE, 32)
+        text_field = _pad(b"", 128, b"\x00 ")
+        file_id = _pad(b"", 37, b" ")
+    else:
+        kind = 1
+        system_id = _pad(b"", 32, b" ")
+        vol_id = _pad(volume_id.encode("ascii")[:32], 32, b" ")
+        escape = b"\x00" * 32
+        text_field = _pad(b"", 128, b" ")
+        file_id = _pad(b"", 37, b" ")
+    l_table, m_table = path_tables
+    descriptor = (
+        bytes([kind]) + b"CD001" + bytes([1, 0]) +
+        system_id +
+        vol_id +
+        b"\x00" * 8 +
+        _both32(total_sectors) +
+        escape +
+        _both16(1) +
+        _both16(1) +
+        _both16(SECTOR_SIZE) +
+        _both32(10) +
+        struct.pack("<I", l_table) + b"\x00" * 4 +
+        struct.pack(">I", m_table) + b"\x00" * 4 +
+        root_record +
+        text_field * 4 +
+        file_id * 3 +
+        UNSET_DATE * 4 +
+        bytes([1, 0])
+    )
+    return _pad(descriptor, SECTOR_SIZE)
+
+
+def build_iso(volume_id: str, files: dict[str, bytes]) -> bytes:
+    """Return an ISO image containing ``files`` in its root directory."""
+    names = sorted(files)
+    primary_names = {name: _primary_name(name) for name in names}
+    if len(set(primary_names.values())) != len(names):
+        raise ValueError("File names collide once mapped to 8.3 names")
+
+    l_primary = FIRST_DESCRIPTOR + DESCRIPTOR_COUNT
+    m_primary = l_primary + 1
+    l_joliet = m_primary + 1
+    m_joliet = l_joliet + 1
+    primary_root = m_joliet + 1
+    joliet_root = primary_root + 1
+
+    extents = {}
+    next_sector = joliet_root + 1
+    for name in names:
+        extents[name] = next_sector
+        next_sector += _sectors(len(files[name]))
+    total_sectors = next_sector
+
+    def root_dir(extent: int, identifiers: dict[str, bytes]) -> bytes:
+        records = (
+            _dir_record(b"\x00", extent, SECTOR_SIZE, True) +
+            _dir_record(b"\x01", extent, SECTOR_SIZE, True)
+        )
+        for name in sorted(names, key=lambda n: identifiers[n]):
+            records += _dir_record(
+                identifiers[name], extents[name], len(files[name]), False)
+        if len(records) > SECTOR_SIZE:
+            raise ValueError("Too many files for a single directory sector")
+        return _pad(records, SECTOR_SIZE)
+
+    joliet_names = {name: name.encode("utf-16-be") for name in names}
+    sectors = [
+        _volume_descriptor(
+            False, volume_id, total_sectors, (l_primary, m_primary),
+            _dir_record(b"\x00", primary_root, SECTOR_SIZE, True),
+        ),
+        _volume_descriptor(
+            True, volume_id, total_sectors, (l_joliet, m_joliet),
+            _dir_record(b"\x00", joliet_root, SECTOR_SIZE, True),
+        ),
+        _pad(bytes([255]) + b"CD001" + bytes([1]), SECTOR_SIZE),
+        _pad(_path_table(primary_root, False), SECTOR_SIZE),
+        _pad(_path_table(primary_root, True), SECTOR_SIZE),
+        _pad(_path_table(joliet_root, False), SECTOR_SIZE),
+        _pad(_path_table(joliet_root, True), SECTOR_SIZE),
+        root_dir(primary_root, primary_names),
+        root_dir(joliet_root, joliet_names),
+    ]
+    for name in names:
+        data = files[name]
+        sectors.append(_pad(data, _sectors(len(data)) * SECTOR_SIZE))
+    return b"\x00" * (FIRST_DESCRIPTOR * SECTOR_SIZE) + b"".join(sectors)
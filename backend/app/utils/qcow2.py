@@ -0,0 +1,179 @@
+"""Helpers for qcow2 linked clones.
+
+A linked clone is a thin qcow2 overlay whose backing file is a shared,
+read-only base layer stored in ``BASES_DIR``. Base layers are either pinned
+revisions of registry images or frozen VM disks created by ``branch_disk``.
+A base layer must never be modified or removed while an overlay still
+references it.
+"""
+import logging
+import os
+import struct
+import subprocess
+import threading
+import uuid
+from pathlib import Path
+from typing import Iterable, Optional
+
+from app.core.constants import VMS_DIR, BASES_DIR
+
+logger = logging.getLogger(__name__)
+
+QCOW2_MAGIC = b"QFI\xfb"
+# magic, version, backing_file_offset, backing_file_size, cluster_bits, size
+QCOW2_HEADER = struct.Struct(">4sIQIIQ")
+
+# Serializes layer creation against pruning, so a freshly pinned base is not
+# removed before its first overlay exists.
+_layers_lock = threading.RLock()
+
+
+def read_header(disk: Path) -> Optional[tuple[Optional[str], int]]:
+    """Return ``(backing_file, virtual_size)`` for a qcow2 file.
+
+    Parses the on-disk header directly so that scanning every VM disk for
+    references stays cheap (no ``qemu-img`` fork per file). Returns None if
+    the file is not a qcow2 image.
+    """
+    try:
+        with open(disk, "rb") as f:
+            raw = f.read(QCOW2_HEADER.size)
+            if len(raw) < QCOW2_HEADER.size:
+                return None
+            magic, _, backing_offset, backing_size, _, size = \
+                QCOW2_HEADER.unpack(raw)
+            if magic != QCOW2_MAGIC:
+                return None
+            if backing_offset == 0 or backing_size == 0:
+                return None, size
+            f.seek(backing_offset)
+            backing = f.read(backing_size).decode("utf-8")
+    except OSError:
+        return None
+    return backing, size
+
+
+def get_backing_file(disk: Path) -> Optional[Path]:
+    header = read_header(disk)
+    if header is None or header[0] is None:
+        return None
+    backing = Path(header[0])
+    if not backing.is_absolute():
+        backing = disk.parent / backing
+    return backing
+
+
+def create_overlay(backing: Path, dest: Path, grow_gb: int = 0) -> Path:
+    """Create a thin qcow2 overlay on top of ``backing``.
+
+    The overlay's virtual size is the backing size plus ``grow_gb`` GiB, so
+    no separate ``qemu-img resize`` pass is needed.
+    """
+    header = read_header(backing)
+    if header is None:
+        raise ValueError(f"{backing} is not a qcow2 image")
+    size = header[1] + grow_gb * 2**30
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    subprocess.run(
+        [
+            "qemu-img", "create", "-q",
+            "-f", "qcow2",
+            "-F", "qcow2",
+            "-b", str(backing),
+            str(dest), str(size),
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return dest
+
+
+def pin_base_image(image: Path, tag: str) -> Path:
+    """Expose a cached registry image as an immutable base layer.
+
+    The base layer is a hardlink, so pinning is instant and costs no disk
+    space. ``tag`` identifies the image revision; while the layer exists the
+    image cache sees an extra link on the file and will not evict it.
+    """
+    BASES_DIR.mkdir(parents=True, exist_ok=True)
+    pinned = BASES_DIR / f"{tag}.qcow2"
+    if not pinned.exists():
+        os.link(image, pinned)
+    return pinned
+
+
+def clone_image(image: Path, tag: str, dest: Path, grow_gb: int = 0) -> Path:
+    """Create ``dest`` as a linked clone of a registry image revision."""
+    with _layers_lock:
+        base = pin_base_image(image, tag)
+        return create_overlay(base, dest, grow_gb)
+
+
+def branch_disk(disk: Path, new_disk: Path) -> Path:
+    """Fork ``disk`` into two overlays that share its current content.
+
+    ``disk`` is moved into ``BASES_DIR`` as a frozen layer, then both the
+    original path and ``new_disk`` are recreated as overlays on top of it.
+    The owning domain must be shut off while this runs.
+    """
+    BASES_DIR.mkdir(parents=True, exist_ok=True)
+    frozen = BASES_DIR / f"{uuid.uuid4()}.qcow2"
+    with _layers_lock:
+        os.rename(disk, frozen)
+        try:
+            create_overlay(frozen, disk)
+        except Exception:
+            os.rename(frozen, disk)
+            raise
+        try:
+            create_overlay(frozen, new_disk)
+        except Exception:
+            disk.unlink(missing_ok=True)
+            os.rename(frozen, disk)
+            raise
+        frozen.chmod(0o444)
+    return new_disk
+
+
+def _iter_disks(roots: Iterable[Path]):
+    for root in roots:
+        if not root.exists():
+            continue
+        for disk in root.rglob("*.qcow2"):
+            if disk.is_file():
+                yield disk
+
+
+def referenced_bases() -> set[Path]:
+    """Return every base layer referenced by a VM disk or another layer."""
+    referenced: set[Path] = set()
+    for disk in _iter_disks((VMS_DIR, BASES_DIR)):
+        backing = get_backing_file(disk)
+        if backing is not None:
+            referenced.add(backing.resolve())
+    return referenced
+
+
+def prune_unused_bases() -> list[Path]:
+    """Remove base layers that no overlay references anymore.
+
+    Frozen layers can back other frozen layers, so this repeats until the
+    set of removable layers is empty.
+    """
+    removed: list[Path] = []
+    if not BASES_DIR.exists():
+        return removed
+    with _layers_lock:
+        while True:
+            referenced = referenced_bases()
+            unused = [
+                base for base in BASES_DIR.glob("*.qcow2")
+                if base.resolve() not in referenced
+            ]
+            if not unused:
+                return removed
+            for base in unused:
+                base.unlink(missing_ok=True)
+                logger.info("Removed unused base layer %s", base)
+                removed.append(base)
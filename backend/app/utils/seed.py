@@ -1,11 +1,14 @@
-import subprocess
-import tempfile
+import hashlib
+import os
+import uuid
 from pathlib import Path
 from typing import Optional
 
 from fastapi import HTTPException, status
 
-from app.core.constants import IMAGES_DIR
+from app.core.constants import IMAGES_DIR, SEEDS_DIR
+from app.utils.disk_copy import copy_disk
+from app.utils.iso9660 import build_iso
 
 
 LAYOUT_TO_XKB = {
@@ -73,54 +76,57 @@ def _build_user_data(base_text: str, keyboard_layout: Optional[str]) -> str:
     return base_text.rstrip() + "\n" + keyboard_block
 
 
-def _generate_seed_iso(
-    output_path: Path,
-    keyboard_layout: Optional[str] = None,
-) -> Path:
+def _render_seed(keyboard_layout: Optional[str]) -> dict[str, bytes]:
     seed_config_dir = _resolve_seed_config_dir()
-    user_data_path = seed_config_dir / "user-data"
-    meta_data_path = seed_config_dir / "meta-data"
+    user_data = (seed_config_dir / "user-data").read_text()
+    meta_data = (seed_config_dir / "meta-data").read_text()
+    return {
+        "user-data": _build_user_data(user_data, keyboard_layout).encode(),
+        "meta-data": meta_data.encode(),
+    }
+
+
+def cached_seed_iso(keyboard_layout: Optional[str] = None) -> Path:
+    """Return the shared seed ISO for this layout, building it if needed.
+
+    ISOs are cached by the hash of their rendered user-data and meta-data,
+    so every VM with the same configuration shares one file.
+    """
+    files = _render_seed(keyboard_layout)
+    digest = hashlib.sha256()
+    for name in sorted(files):
+        digest.update(name.encode() + b"\0" + files[name] + b"\0")
+    seed_iso_path = SEEDS_DIR / f"{digest.hexdigest()}.iso"
+    if seed_iso_path.exists():
+        return seed_iso_path
 
+    SEEDS_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = seed_iso_path.with_name(
+        f".{seed_iso_path.name}.{uuid.uuid4().hex}")
+    try:
+        tmp_path.write_bytes(build_iso("cidata", files))
+        os.replace(tmp_path, seed_iso_path)
+    except OSError as exc:
+        tmp_path.unlink(missing_ok=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to create seed.iso: {exc}",
+        ) from exc
+    return seed_iso_path
+
+
+def _link_seed_iso(cached: Path, output_path: Path) -> Path:
+    """Point ``output_path`` at the cached ISO, falling back to a copy."""
+    if output_path.exists() and output_path.samefile(cached):
+        return output_path
     output_path.parent.mkdir(parents=True, exist_ok=True)
-
-    base_user_data = user_data_path.read_text()
-    final_user_data = _build_user_data(base_user_data, keyboard_layout)
-
-    with tempfile.TemporaryDirectory() as temp_dir:
-        temp_dir_path = Path(temp_dir)
-        temp_user_data_path = temp_dir_path / "user-data"
-        temp_meta_data_path = temp_dir_path / "meta-data"
-        temp_user_data_path.write_text(final_user_data)
-        temp_meta_data_path.write_text(meta_data_path.read_text())
-
-        try:
-            subprocess.run(
-                [
-                    "genisoimage",
-                    "-output",
-                    str(output_path),
-                    "-volid",
-                    "cidata",
-                    "-joliet",
-                    "-rock",
-                    str(temp_user_data_path),
-                    str(temp_meta_data_path),
-                ],
-                capture_output=True,
-                text=True,
-                check=True,
-            )
-        except FileNotFoundError as exc:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="genisoimage is required to create seed.iso but was not found",
-            ) from exc
-        except subprocess.CalledProcessError as exc:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Failed to create seed.iso: {exc.stderr.strip()}",
-            ) from exc
-
+    tmp_path = output_path.with_name(f".{output_path.name}.tmp")
+    tmp_path.unlink(missing_ok=True)
+    try:
+        os.link(cached, tmp_path)
+    except OSError:
+        copy_disk(cached, tmp_path)
+    os.replace(tmp_path, output_path)
     return output_path
 
 
@@ -132,10 +138,10 @@ def ensure_seed_iso(
         seed_iso_path = vm_dir / "seed.iso"
         if seed_iso_path.exists() and not keyboard_layout:
             return seed_iso_path
-        return _generate_seed_iso(seed_iso_path, keyboard_layout)
+        return _link_seed_iso(cached_seed_iso(keyboard_layout), seed_iso_path)
 
     seed_iso_path = IMAGES_DIR / "seed.iso"
     if seed_iso_path.exists():
         return seed_iso_path
 
-    return _generate_seed_iso(seed_iso_path)
+    return _link_seed_iso(cached_seed_iso(), seed_iso_path)
@@ -1,7 +1,25 @@
-from time import sleep
-import subprocess
-import json
-from typing import Optional
+from time import sleep, monotonic
+import logging
+import threading
+from typing import Iterable, Optional
+
+import libvirt
+from lxml import etree
+
+from app.core.config import QEMUConfig, VM_IP_CACHE_TTL
+from app.core.inventory import inventory_version
+
+logger = logging.getLogger(__name__)
+
+# A VM without an address yet is looked up again sooner than VM_IP_CACHE_TTL
+IP_MISS_TTL = 5.0
+LEASE_NETWORK = "default"
+
+# vm name -> (expires_at, ipv4)
+_ip_cache: dict[str, tuple[float, Optional[str]]] = {}
+# vm name -> MAC addresses, read once from the domain XML
+_mac_cache: dict[str, tuple[str, ...]] = {}
+_cache_lock = threading.Lock()
 
 
 def wait_for_state(vm, state_code: int, timeout: float, retries: int):
@@ -13,30 +31,118 @@ def wait_for_state(vm, state_code: int, timeout: float, retries: int):
     return code
 
 
-def get_vm_ip(vm_name: str, interface: str = "ens3") -> Optional[str]:
+def _first_ipv4(interfaces: dict) -> Optional[str]:
+    for name, iface in interfaces.items():
+        if name == "lo":
+            continue
+        for addr in iface.get("addrs") or []:
+            if (addr["type"] == libvirt.VIR_IP_ADDR_TYPE_IPV4 and
+                    not addr["addr"].startswith("127.")):
+                return addr["addr"]
+    return None
+
+
+def _cache_ip(vm_name: str, ipv4: Optional[str]) -> None:
+    ttl = VM_IP_CACHE_TTL if ipv4 else min(VM_IP_CACHE_TTL, IP_MISS_TTL)
+    with _cache_lock:
+        previous = _ip_cache.get(vm_name)
+        _ip_cache[vm_name] = (monotonic() + ttl, ipv4)
+    if (previous[1] if previous else None) != ipv4:
+        inventory_version.bump()
+
+
+def _cached_ip(vm_name: str) -> tuple[bool, Optional[str]]:
+    with _cache_lock:
+        entry = _ip_cache.get(vm_name)
+    if entry is None or entry[0] <= monotonic():
+        return False, None
+    return True, entry[1]
+
+
+def invalidate_vm_ip(vm_name: str) -> None:
+    """Forget the address of a VM, after it was started, stopped or removed."""
+    with _cache_lock:
+        _ip_cache.pop(vm_name, None)
+        _mac_cache.pop(vm_name, None)
+
+
+def get_vm_ip(vm_name: str) -> Optional[str]:
+    """IPv4 address of a VM, from its guest agent or else its DHCP lease."""
+    hit, ipv4 = _cached_ip(vm_name)
+    if hit:
+        return ipv4
     try:
-        cmd = [
-            "virsh",
-            "qemu-agent-command",
-            vm_name,
-            '{"execute":"guest-network-get-interfaces"}'
-        ]
-
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            check=True
-        )
-
-        data = json.loads(result.stdout)
-
-        for iface in data.get("return", []):
-            if iface.get("name") == interface:
-                for addr in iface.get("ip-addresses", []):
-                    if addr.get("ip-address-type") == "ipv4":
-                        return addr.get("ip-address")
+        domain = QEMUConfig.get_connection().lookupByName(vm_name)
+    except libvirt.libvirtError as e:
+        logger.warning("Failed to look up VM %s for its IP: %s", vm_name, e)
         return None
+    for source in (libvirt.VIR_DOMAIN_INTERFACE_ADDRESSES_SRC_AGENT,
+                   libvirt.VIR_DOMAIN_INTERFACE_ADDRESSES_SRC_LEASE):
+        try:
+            ipv4 = _first_ipv4(domain.interfaceAddresses(source))
+        except libvirt.libvirtError as e:
+            # Expected while the guest boots or has no agent installed
+            logger.debug("No addresses for VM %s from source %s: %s",
+                         vm_name, source, e)
+            continue
+        if ipv4:
+            break
+    _cache_ip(vm_name, ipv4)
+    return ipv4
 
-    except Exception:
-        return None
+
+def _domain_macs(conn, vm_name: str) -> tuple[str, ...]:
+    with _cache_lock:
+        macs = _mac_cache.get(vm_name)
+    if macs is not None:
+        return macs
+    xml = etree.fromstring(conn.lookupByName(vm_name).XMLDesc().encode())
+    macs = tuple(mac.lower() for mac in xml.xpath(
+        "devices/interface/mac/@address"))
+    with _cache_lock:
+        _mac_cache[vm_name] = macs
+    return macs
+
+
+def get_vm_ips(vm_names: Iterable[str]) -> dict[str, Optional[str]]:
+    """IPv4 addresses of many VMs from one read of the DHCP lease table.
+
+    Meant for list views: cached addresses are reused and the others are
+    matched against the leases of the ``default`` network by MAC address,
+    without asking each guest agent.
+    """
+    ips: dict[str, Optional[str]] = {}
+    missing = []
+    for vm_name in vm_names:
+        hit, ipv4 = _cached_ip(vm_name)
+        if hit:
+            ips[vm_name] = ipv4
+        else:
+            missing.append(vm_name)
+    if not missing:
+        return ips
+
+    try:
+        conn = QEMUConfig.get_connection()
+        leases = {
+            lease["mac"].lower(): lease["ipaddr"]
+            for lease in conn.networkLookupByName(LEASE_NETWORK).DHCPLeases()
+            if lease["type"] == libvirt.VIR_IP_ADDR_TYPE_IPV4
+        }
+    except libvirt.libvirtError as e:
+        logger.warning("Failed to read DHCP leases of network %s: %s",
+                       LEASE_NETWORK, e)
+        return {**ips, **{vm_name: None for vm_name in missing}}
+
+    for vm_name in missing:
+        try:
+            macs = _domain_macs(conn, vm_name)
+        except libvirt.libvirtError as e:
+            logger.warning("Failed to read MAC addresses of VM %s: %s",
+                           vm_name, e)
+            ips[vm_name] = None
+            continue
+        ipv4 = next((leases[mac] for mac in macs if mac in leases), None)
+        _cache_ip(vm_name, ipv4)
+        ips[vm_name] = ipv4
+    return ips
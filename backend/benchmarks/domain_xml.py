@@ -0,0 +1,57 @@
+"""Compare building domain XML per VM with rendering a compiled template.
+
+Run from the backend directory: ``python -m benchmarks.domain_xml``.
+The baseline compiles a fresh skeleton for every VM, which is what
+``build_xml`` cost before templates were cached.
+"""
+import argparse
+import timeit
+import uuid
+
+from app.core.config import VIRT_TYPE
+from app.core.xml_builder import (
+    DEFAULT_DEVICE_PROFILE,
+    SHARED_SEED_ISO,
+    DomainSkeleton,
+    DomainTemplate,
+    LAYOUT_TO_KEYMAP,
+)
+from app.models.vm import VmCreate
+
+VM = VmCreate(
+    name="bench",
+    os="ubuntu-24.04.qcow2",
+    mem=2,
+    vcpus=2,
+    disk_size=10,
+    keyboard_layout="fr-fr-azerty",
+    activate_at_start=False,
+)
+
+
+def build_from_scratch() -> str:
+    skeleton = DomainSkeleton.compile(
+        VIRT_TYPE, DEFAULT_DEVICE_PROFILE,
+        LAYOUT_TO_KEYMAP[VM.keyboard_layout])
+    return skeleton.render(
+        id=uuid.uuid4(), mem=VM.mem * 1024, vcpus=VM.vcpus, os=VM.os,
+        seed=SHARED_SEED_ISO)
+
+
+def render_template() -> str:
+    return DomainTemplate(VM).render(uuid.uuid4(), SHARED_SEED_ISO)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--number", type=int, default=10000)
+    args = parser.parse_args()
+
+    for label, func in [("lxml build per VM", build_from_scratch),
+                        ("compiled template", render_template)]:
+        best = min(timeit.repeat(func, number=args.number, repeat=5))
+        print(f"{label:>20}: {best / args.number * 1e6:8.1f} us/VM")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Compare per-VM libvirt lookups with the bulk inventory of ``GET /vms``.
+
+Run from the backend directory: ``python -m benchmarks.vm_inventory``.
+Domains are defined on the in-memory ``test:///default`` driver, so no
+hypervisor is needed. The per-VM path is what the VM list did before:
+``lookupByName`` then ``state()`` for every VM. The bulk path is a single
+``getAllDomainStats`` call whatever the number of VMs.
+"""
+import argparse
+import time
+import uuid
+
+import libvirt
+
+DOMAIN_XML = """<domain type="test">
+  <name>{name}</name>
+  <memory unit="MiB">128</memory>
+  <vcpu>1</vcpu>
+  <os><type arch="x86_64">hvm</type></os>
+</domain>"""
+
+
+def per_vm(conn: libvirt.virConnect, names: list[str]) -> dict[str, int]:
+    states = {}
+    for name in names:
+        states[name], _ = conn.lookupByName(name).state()
+    return states
+
+
+def bulk(conn: libvirt.virConnect, names: list[str]) -> dict[str, int]:
+    return {
+        domain.name(): stats["state.state"]
+        for domain, stats in conn.getAllDomainStats(
+            libvirt.VIR_DOMAIN_STATS_STATE)
+    }
+
+
+def timed(func, conn, names, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(conn, names)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--uri", default="test:///default")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[10, 50, 200, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    conn = libvirt.open(args.uri)
+    names: list[str] = []
+    print(f"{'VMs':>6} {'per-VM (ms)':>12} {'bulk (ms)':>10}")
+    for size in sorted(args.sizes):
+        while len(names) < size:
+            name = str(uuid.uuid4())
+            conn.defineXML(DOMAIN_XML.format(name=name))
+            names.append(name)
+        per_vm_time = timed(per_vm, conn, names, args.repeat)
+        bulk_time = timed(bulk, conn, names, args.repeat)
+        print(f"{size:>6} {per_vm_time * 1e3:>12.2f} {bulk_time * 1e3:>10.2f}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Freshness of the domain state cache entries."""
+import time
+import unittest
+from unittest import mock
+
+import libvirt
+
+from app.core.constants import VM_HIBERNATED_STATE
+from app.services.domain_state_cache import DomainState, DomainStateCache
+
+
+class DomainStateCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = DomainStateCache("test:///default", max_age=60.0)
+        # Connected and synced, without the threads
+        self.cache._conn = mock.Mock()
+        now = time.monotonic()
+        self.cache._synced_at = now
+        self.cache._domains = {
+            "running": DomainState(libvirt.VIR_DOMAIN_RUNNING,
+                                   updated_at=now),
+            "stopped": DomainState(libvirt.VIR_DOMAIN_SHUTOFF,
+                                   updated_at=now),
+        }
+
+    def test_invalidated_domain_is_left_to_readers(self):
+        self.cache.invalidate("stopped")
+        self.assertIsNone(self.cache.get("stopped"))
+        self.assertEqual(self.cache.states(),
+                         {"running": libvirt.VIR_DOMAIN_RUNNING})
+        self.assertEqual(list(self.cache.entries()), ["running"])
+
+    def test_invalidated_domain_is_kept_for_its_refresh(self):
+        self.cache.invalidate("stopped")
+        self.assertIn("stopped", self.cache._domains)
+        self.assertEqual(self.cache._queue.get_nowait(), "stopped")
+
+    def test_hibernated_domain_is_not_reported_stopped(self):
+        self.cache.mark_hibernated("stopped", True)
+        self.assertEqual(
+            self.cache.state_name("stopped", libvirt.VIR_DOMAIN_SHUTOFF),
+            VM_HIBERNATED_STATE)
+        self.cache.mark_hibernated("stopped", False)
+        self.assertEqual(
+            self.cache.state_name("stopped", libvirt.VIR_DOMAIN_SHUTOFF),
+            "Stopped")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+"""When slave heartbeats and slave power operations bump the inventory
+version."""
+import unittest
+import uuid
+from datetime import datetime, timezone
+from unittest import mock
+
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine
+
+from app.core.inventory import inventory_version
+from app.models.slave import SlaveHeartbeat, SlaveVmState
+from app.orm.slave import SlaveORM
+from app.services.change_stream import ChangeStream
+from app.services.slave_client import slave_start_vm
+from app.services.slave_service import SlaveService
+
+
+def heartbeat(cpu: float = 50.0, state: str = "Running") -> SlaveHeartbeat:
+    return SlaveHeartbeat(
+        total_cpu=4, total_mem=16, total_disk=100,
+        available_cpu=cpu, available_mem=8.0, available_disk=50.0,
+        vms=[SlaveVmState(id="vm", state=state, ipv4=None, cpu=1.0)],
+    )
+
+
+class InventoryVersionTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        self.addCleanup(self.engine.dispose)
+        SQLModel.metadata.create_all(self.engine, tables=[
+            SlaveORM.__table__])
+        for target, value in (
+            ("app.services.slave_service.engine", self.engine),
+            ("app.services.slave_service.change_stream", ChangeStream(16)),
+            # SQLite through recent SQLModel versions wants aware datetimes
+            ("app.services.slave_service.datetime",
+             mock.Mock(utcnow=lambda: datetime.now(timezone.utc))),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        with Session(self.engine) as session:
+            slave = SlaveORM(name="slave", hostname="slave", port=8000,
+                             api_key="key", status="online")
+            session.add(slave)
+            session.commit()
+            self.slave_id = str(slave.id)
+        SlaveService.handle_heartbeat(self.slave_id, heartbeat())
+
+    def test_same_heartbeat_keeps_version(self):
+        version = inventory_version.value
+        SlaveService.handle_heartbeat(self.slave_id, heartbeat())
+        self.assertEqual(inventory_version.value, version)
+
+    def test_new_usage_bumps_version(self):
+        version = inventory_version.value
+        SlaveService.handle_heartbeat(self.slave_id, heartbeat(cpu=20.0))
+        self.assertGreater(inventory_version.value, version)
+
+    def test_new_vm_state_bumps_version(self):
+        version = inventory_version.value
+        SlaveService.handle_heartbeat(self.slave_id,
+                                      heartbeat(state="Stopped"))
+        self.assertGreater(inventory_version.value, version)
+
+    def test_slave_coming_back_bumps_version(self):
+        with Session(self.engine) as session:
+            session.get(SlaveORM, uuid.UUID(self.slave_id)).status = (
+                "offline")
+            session.commit()
+        version = inventory_version.value
+        SlaveService.handle_heartbeat(self.slave_id, heartbeat())
+        self.assertGreater(inventory_version.value, version)
+
+    def test_failed_slave_power_operation_bumps_version(self):
+        version = inventory_version.value
+        with mock.patch("app.services.slave_client.slave_request",
+                        side_effect=TimeoutError):
+            with self.assertRaises(TimeoutError):
+                slave_start_vm(mock.Mock(), "vm")
+        self.assertGreater(inventory_version.value, version)
+
+
+if __name__ == "__main__":
+    unittest.main()
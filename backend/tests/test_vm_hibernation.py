@@ -0,0 +1,68 @@
+"""Idle hibernation against tunnel sessions opening meanwhile."""
+import threading
+import unittest
+import uuid
+from unittest import mock
+
+from app.services import vm_hibernation
+from app.services.vm_hibernation import HibernationService, IdleTracker
+
+
+class HibernationSessionTest(unittest.TestCase):
+    def setUp(self):
+        self.vm_id = str(uuid.uuid4())
+        self.tracker = IdleTracker()
+        self.hibernated = False
+        self.domain = mock.Mock()
+        self.domain.isActive.return_value = True
+        conn = mock.Mock()
+        conn.lookupByName.return_value = self.domain
+
+        vm_service = mock.Mock()
+        vm_service.is_hibernated.side_effect = lambda vm_id: self.hibernated
+        vm_service.set_hibernated.side_effect = self._set_hibernated
+        vm_service._get_slave_for_vm.return_value = None
+        for target, value in (
+            ("idle_tracker", self.tracker),
+            ("VmService", vm_service),
+            ("QEMUConfig", mock.Mock(get_connection=lambda: conn)),
+            ("domain_state_cache", mock.Mock()),
+            ("invalidate_vm_ip", mock.Mock()),
+        ):
+            patcher = mock.patch.object(vm_hibernation, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _set_hibernated(self, vm_id, hibernated):
+        self.hibernated = hibernated
+
+    def test_vm_with_session_is_not_hibernated(self):
+        self.tracker.session_opened(self.vm_id)
+        self.assertFalse(HibernationService.hibernate_local(self.vm_id))
+        self.domain.managedSave.assert_not_called()
+        self.assertFalse(self.hibernated)
+
+    def test_session_opened_during_save_restores_vm(self):
+        saving, resumed = threading.Event(), threading.Event()
+
+        def managed_save(flags):
+            saving.set()
+            # The tunnel opens its session while the save runs
+            self.tracker.session_opened(self.vm_id)
+            threading.Thread(target=resume).start()
+            self.assertFalse(resumed.wait(0.2))
+            self.domain.isActive.return_value = False
+
+        def resume():
+            HibernationService.resume_vm(self.vm_id)
+            resumed.set()
+
+        self.domain.managedSave.side_effect = managed_save
+        self.assertTrue(HibernationService.hibernate_local(self.vm_id))
+        self.assertTrue(resumed.wait(5))
+        self.domain.create.assert_called_once()
+        self.assertFalse(self.hibernated)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+"""Number of SQL statements behind the VM read paths.
+
+Run from the backend directory: ``python -m unittest discover tests``.
+The queries run on an in-memory SQLite database and libvirt is replaced by
+the domain state cache, so neither Postgres nor a hypervisor is needed.
+"""
+import unittest
+import uuid
+from datetime import datetime, timezone
+from unittest import mock
+
+import libvirt
+from sqlalchemy import event
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine
+
+# Every table referenced by a foreign key of the tables below
+from app.orm.event import EventORM  # noqa: F401
+from app.orm.slave import SlaveORM
+from app.orm.vm import VmORM
+from app.orm.vm_credential import VmCredentialORM
+from app.orm.vm_pool import VmPoolProfileORM  # noqa: F401
+from app.services.domain_state_cache import DomainState
+from app.services.vm_query import VmFilters, VmQuery
+from app.services.vm_service import VmService
+
+LOCAL_VMS = 5
+
+
+class VmQueryCountTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        self.addCleanup(self.engine.dispose)
+        SQLModel.metadata.create_all(self.engine)
+        patcher = mock.patch("app.services.vm_query.engine", self.engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        with Session(self.engine) as session:
+            self.slave = SlaveORM(name="slave", hostname="slave", port=8000,
+                                  api_key="key", status="offline")
+            session.add(self.slave)
+            session.flush()
+            vms = [
+                VmORM(name=f"vm-{i}", os="debian", mem=1, vcpus=1,
+                      disk_size=10)
+                for i in range(LOCAL_VMS)
+            ]
+            vms.append(VmORM(name="remote", os="debian", mem=1, vcpus=1,
+                             disk_size=10, slave_id=self.slave.id))
+            session.add_all(vms)
+            session.flush()
+            for vm in vms:
+                for i in range(3):
+                    session.add(VmCredentialORM(
+                        vm_id=vm.id, name=f"user-{i}", password="secret",
+                        created_at=datetime.now(timezone.utc)))
+            session.commit()
+            self.vm_ids = [str(vm.id) for vm in vms]
+
+        # Every local domain is known to the state cache
+        states = {vm_id: libvirt.VIR_DOMAIN_SHUTOFF
+                  for vm_id in self.vm_ids[:LOCAL_VMS]}
+        cache = self.cache = mock.Mock()
+        cache.states.return_value = states
+        cache.get.side_effect = lambda name: (
+            DomainState(state=states[name]) if name in states else None)
+        patcher = mock.patch("app.services.vm_service.domain_state_cache",
+                             cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.statements = []
+        event.listen(self.engine, "before_cursor_execute", self._count)
+        self.addCleanup(event.remove, self.engine, "before_cursor_execute",
+                        self._count)
+
+    def _count(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def test_vm_list_is_one_statement(self):
+        vms = VmService.get_vm_list()
+        self.assertEqual(len(vms), LOCAL_VMS + 1)
+        self.assertEqual(len(self.statements), 1)
+
+    def test_vm_list_of_ids_is_one_statement(self):
+        vms = VmService.get_vm_list(vm_ids=self.vm_ids[:2])
+        self.assertEqual(len(vms), 2)
+        self.assertEqual(len(self.statements), 1)
+        # Filtered by the database, not after loading every VM
+        self.assertIn("vms.id IN", self.statements[0])
+
+    def test_vm_list_statements_do_not_grow_with_vms(self):
+        VmService.get_vm_list()
+        first = len(self.statements)
+        with Session(self.engine) as session:
+            session.add(VmORM(name="extra", os="debian", mem=1, vcpus=1,
+                              disk_size=10))
+            session.commit()
+        self.statements.clear()
+        VmService.get_vm_list()
+        self.assertEqual(len(self.statements), first)
+
+    def test_vm_list_looks_up_domains_missing_from_cache(self):
+        stale = self.vm_ids[0]
+        states = self.cache.states.return_value
+        del states[stale]
+        conn = mock.Mock()
+        conn.lookupByName.return_value.state.return_value = (
+            libvirt.VIR_DOMAIN_RUNNING, 0)
+        with mock.patch("app.services.vm_service.QEMUConfig") as qemu, \
+                mock.patch("app.services.vm_service.get_vm_ips",
+                           lambda names: dict.fromkeys(names)):
+            qemu.get_connection.return_value = conn
+            vms = VmService.get_vm_list()
+        conn.lookupByName.assert_called_once_with(stale)
+        self.assertEqual(len(vms), LOCAL_VMS + 1)
+        self.assertEqual(len(self.statements), 1)
+
+    def test_state_filtered_pages_skip_no_vm(self):
+        states = self.cache.states.return_value
+        running = self.vm_ids[1:4]
+        for vm_id in running:
+            states[vm_id] = libvirt.VIR_DOMAIN_RUNNING
+        seen = []
+        cursor = None
+        page_rows = mock.Mock(wraps=VmQuery.page_rows)
+        with mock.patch("app.services.vm_service.get_vm_ips",
+                        lambda names: dict.fromkeys(names)), \
+                mock.patch.object(VmQuery, "page_rows", page_rows):
+            while True:
+                vms, cursor = VmService.get_vm_page(
+                    VmFilters(master_only=True), state="running", limit=2,
+                    cursor=cursor)
+                self.assertLessEqual(len(vms), 2)
+                seen += [str(vm.id) for vm in vms]
+                if cursor is None:
+                    break
+        self.assertEqual(seen, running)
+        # Batches keep the page size while the page fills
+        self.assertEqual({call.args[2] for call in page_rows.call_args_list},
+                         {2})
+
+    def test_local_vm_is_one_statement(self):
+        vm = VmService.get_vm(self.vm_ids[0])
+        self.assertEqual(vm.credentials_count, 3)
+        self.assertEqual(len(self.statements), 1)
+
+    def test_offline_slave_vm_is_one_statement(self):
+        vm = VmService.get_vm(self.vm_ids[-1])
+        self.assertEqual(vm["slave_name"], "slave")
+        self.assertEqual(len(self.statements), 1)
+
+    def test_unknown_vm_is_one_statement(self):
+        with self.assertRaises(Exception) as raised:
+            VmService.get_vm(str(uuid.uuid4()))
+        self.assertEqual(raised.exception.status_code, 404)
+        self.assertEqual(len(self.statements), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
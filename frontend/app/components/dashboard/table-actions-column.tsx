@@ -97,7 +97,9 @@ export const TableActionsColumn = ({
               className="focus:bg-primary/10 focus:text-primary"
               disabled={
                 (vm.state !== VMState.RUNNING &&
-                  vm.state !== VMState.PMSUSPENDED) ||
+                  vm.state !== VMState.PMSUSPENDED &&
+                  // Opening the tunnel resumes it
+                  vm.state !== VMState.HIBERNATED) ||
                 missingForConnect.length > 0
               }
               onClick={(e) => onConnectVM(vm, e)}
@@ -352,7 +352,9 @@ export function VMDetailsDialog({
             variant="outline"
             disabled={
               (vm.state !== VMState.RUNNING &&
-                vm.state !== VMState.PMSUSPENDED) ||
+                vm.state !== VMState.PMSUSPENDED &&
+                // Opening the tunnel resumes it
+                vm.state !== VMState.HIBERNATED) ||
               missingForConnect.length > 0
             }
             onClick={(e) => onConnectVM?.(vm, e)}
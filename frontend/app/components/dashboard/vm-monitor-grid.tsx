@@ -5,8 +5,6 @@ import { VMState } from "@/lib/types";
 import { VmMonitorTile } from "./vm-monitor-tile";
 import { Monitor } from "lucide-react";
 
-const VM_LIST_POLL_INTERVAL = 5000;
-
 export function VmMonitorGrid() {
   const {
     data: vms,
@@ -16,7 +14,6 @@ export function VmMonitorGrid() {
   } = useQuery<VirtualMachineMetadata[]>({
     queryKey: ["vms"],
     queryFn: getVMs,
-    refetchInterval: VM_LIST_POLL_INTERVAL,
     retry: false,
   });
 
@@ -0,0 +1,76 @@
+import { useEffect } from "react";
+import { useQueryClient, type QueryClient } from "@tanstack/react-query";
+import { subscribeToChanges, type ChangeEventType } from "@/lib/api";
+import type { VirtualMachineMetadata } from "@/lib/types";
+
+function patchVM(
+  queryClient: QueryClient,
+  id: string,
+  patch: Partial<VirtualMachineMetadata>,
+) {
+  queryClient.setQueriesData<VirtualMachineMetadata[]>(
+    { queryKey: ["vms"], exact: true },
+    (vms) => vms?.map((vm) => (vm.id === id ? { ...vm, ...patch } : vm)),
+  );
+}
+
+function invalidateHostInfo(queryClient: QueryClient, nodeId: string | null) {
+  const keys = nodeId
+    ? [["host", "info", nodeId]]
+    : [
+        ["host", "info"],
+        ["host", "info", "master"],
+      ];
+  keys.push(["host", "info", "cluster"]);
+  for (const queryKey of keys) {
+    queryClient.invalidateQueries({ queryKey, exact: true });
+  }
+}
+
+/**
+ * Keep the VM, slave and host queries current from the change stream of
+ * the backend, instead of polling them.
+ */
+export function useChangeStream(enabled = true) {
+  const queryClient = useQueryClient();
+
+  useEffect(() => {
+    if (!enabled) {
+      return;
+    }
+
+    return subscribeToChanges((type: ChangeEventType, data) => {
+      switch (type) {
+        case "vm.state":
+          patchVM(queryClient, data.id as string, {
+            state: data.state as VirtualMachineMetadata["state"],
+          });
+          break;
+        case "vm.ip":
+          patchVM(queryClient, data.id as string, {
+            ipv4: data.ipv4 as string,
+          });
+          break;
+        case "vm.created":
+        case "vm.updated":
+        case "vm.deleted":
+          queryClient.invalidateQueries({ queryKey: ["vms"] });
+          break;
+        case "slave.online":
+        case "slave.offline":
+          queryClient.invalidateQueries({ queryKey: ["slaves"] });
+          queryClient.invalidateQueries({ queryKey: ["vms"] });
+          invalidateHostInfo(queryClient, data.id as string);
+          break;
+        case "host.metrics":
+          invalidateHostInfo(queryClient, data.node_id as string | null);
+          break;
+        case "reset":
+          queryClient.invalidateQueries({ queryKey: ["vms"] });
+          queryClient.invalidateQueries({ queryKey: ["slaves"] });
+          queryClient.invalidateQueries({ queryKey: ["host", "info"] });
+          break;
+      }
+    });
+  }, [enabled, queryClient]);
+}
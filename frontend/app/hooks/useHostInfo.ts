@@ -1,35 +1,31 @@
 import { useQuery } from "@tanstack/react-query";
 import { getHostInfo, getSlaveHostInfo, getClusterHostInfo } from "@/lib/api";
 
-export function useHostInfo(enabled = true, refetchInterval = 1000) {
+// Refetched on the host.metrics events of the change stream, see
+// useChangeStream, rather than on an interval.
+
+export function useHostInfo(enabled = true) {
   return useQuery({
     queryKey: ["host", "info"],
     queryFn: getHostInfo,
-    refetchInterval,
     enabled,
     retry: false,
   });
 }
 
-export function useTargetHostInfo(
-  slaveId: string | null,
-  enabled = true,
-  refetchInterval = 1000,
-) {
+export function useTargetHostInfo(slaveId: string | null, enabled = true) {
   return useQuery({
     queryKey: ["host", "info", slaveId ?? "master"],
     queryFn: () => (slaveId ? getSlaveHostInfo(slaveId) : getHostInfo()),
-    refetchInterval,
     enabled,
     retry: false,
   });
 }
 
-export function useClusterHostInfo(enabled = true, refetchInterval = 2000) {
+export function useClusterHostInfo(enabled = true) {
   return useQuery({
     queryKey: ["host", "info", "cluster"],
     queryFn: getClusterHostInfo,
-    refetchInterval,
     enabled,
     retry: false,
   });
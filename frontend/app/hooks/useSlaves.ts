@@ -8,7 +8,6 @@ export function useSlaves() {
   const slavesQuery = useQuery({
     queryKey: ["slaves"],
     queryFn: getSlaves,
-    refetchInterval: 10_000,
   });
 
   const createSlaveMutation = useMutation({
@@ -0,0 +1,94 @@
+import { API_BASE_URL, getAuthToken } from "./core";
+
+export type ChangeEventType =
+  | "vm.created"
+  | "vm.updated"
+  | "vm.deleted"
+  | "vm.state"
+  | "vm.ip"
+  | "slave.online"
+  | "slave.offline"
+  | "host.metrics"
+  | "reset";
+
+export type ChangeHandler = (
+  type: ChangeEventType,
+  data: Record<string, unknown>,
+) => void;
+
+const CHANGE_EVENT_TYPES: ChangeEventType[] = [
+  "vm.created",
+  "vm.updated",
+  "vm.deleted",
+  "vm.state",
+  "vm.ip",
+  "slave.online",
+  "slave.offline",
+  "host.metrics",
+  "reset",
+];
+
+const RECONNECT_MIN_DELAY = 1000;
+const RECONNECT_MAX_DELAY = 30_000;
+
+/**
+ * Subscribe to the server-sent VM, slave and host changes.
+ *
+ * The browser reconnects on its own and resumes from the last event it
+ * received; the backend answers with a `reset` event when that is no
+ * longer possible. A non-200 answer (backend restarting, expired token)
+ * closes the stream for good instead, so it is then reopened here with
+ * the current token and an exponential backoff, and a `reset` is passed
+ * on since changes may have been missed meanwhile. Returns a function
+ * closing the stream.
+ */
+export function subscribeToChanges(onChange: ChangeHandler): () => void {
+  let source: EventSource | null = null;
+  let retry: ReturnType<typeof setTimeout> | null = null;
+  let delay = RECONNECT_MIN_DELAY;
+  let closed = false;
+
+  const reopen = () => {
+    retry = setTimeout(open, delay);
+    delay = Math.min(delay * 2, RECONNECT_MAX_DELAY);
+  };
+
+  function open() {
+    retry = null;
+    const token = getAuthToken();
+    if (!token) {
+      reopen();
+      return;
+    }
+
+    source = new EventSource(
+      `${API_BASE_URL}/changes/?token=${encodeURIComponent(token)}`,
+    );
+    source.onopen = () => {
+      delay = RECONNECT_MIN_DELAY;
+    };
+    source.onerror = () => {
+      if (closed || source?.readyState !== EventSource.CLOSED) {
+        // Still connecting: the browser retries on its own
+        return;
+      }
+      onChange("reset", {});
+      reopen();
+    };
+    for (const type of CHANGE_EVENT_TYPES) {
+      source.addEventListener(type, (event) => {
+        onChange(type, JSON.parse((event as MessageEvent<string>).data));
+      });
+    }
+  }
+
+  open();
+
+  return () => {
+    closed = true;
+    if (retry !== null) {
+      clearTimeout(retry);
+    }
+    source?.close();
+  };
+}
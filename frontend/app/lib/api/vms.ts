@@ -1,6 +1,11 @@
-import type { CreateVMPayload, VirtualMachineMetadata } from "@/lib/types";
+import type {
+  CreateVMPayload,
+  ProvisionJob,
+  VirtualMachineMetadata,
+} from "@/lib/types";
 import {
   CreateVMPayloadSchema,
+  ProvisionJobSchema,
   VirtualMachineMetadataSchema,
 } from "@/lib/types";
 import {
@@ -22,6 +27,15 @@ export async function getVMs(): Promise<VirtualMachineMetadata[]> {
   return apiRequest("/vms", {}, VirtualMachineMetadataSchema.array());
 }
 
+const PROVISION_JOB_POLL_INTERVAL_MS = 1500;
+
+export async function getProvisionJob(id: string): Promise<ProvisionJob> {
+  return apiRequest(`/vms/jobs/${id}`, {}, ProvisionJobSchema);
+}
+
+/**
+ * Queue a VM for provisioning and resolve once the job has finished.
+ */
 export async function createVM(payload: CreateVMPayload): Promise<void> {
   const validatedPayload = validateWithSchema(
     CreateVMPayloadSchema,
@@ -29,10 +43,23 @@ export async function createVM(payload: CreateVMPayload): Promise<void> {
     "/vms",
   );
 
-  await apiRequest("/vms", {
-    method: "POST",
-    body: JSON.stringify(validatedPayload),
-  });
+  let job = await apiRequest(
+    "/vms",
+    {
+      method: "POST",
+      body: JSON.stringify(validatedPayload),
+    },
+    ProvisionJobSchema,
+  );
+  while (job.status === "queued" || job.status === "running") {
+    await new Promise((resolve) =>
+      setTimeout(resolve, PROVISION_JOB_POLL_INTERVAL_MS),
+    );
+    job = await getProvisionJob(job.id);
+  }
+  if (job.status === "failed") {
+    throw new Error(job.error ?? "VM provisioning failed");
+  }
 }
 
 export async function startVM(id: string): Promise<void> {
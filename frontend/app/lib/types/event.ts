@@ -19,6 +19,7 @@ export const EventSchema = z.object({
   keyboard_layout: z.string().nullable().optional(),
   deadline: z.string().transform((s) => (s.endsWith("Z") ? s : s + "Z")),
   max_vms: z.number(),
+  shutdown_grace: z.number().nullable().optional(),
   created_at: z.string(),
   created_by: z.string(),
   participants_count: z.number(),
@@ -42,6 +43,7 @@ export const CreateEventPayloadSchema = z.object({
   keyboard_layout: z.string().nullable().optional(),
   deadline: z.string(),
   max_vms: z.number().positive(),
+  shutdown_grace: z.number().nonnegative().nullable().optional(),
 });
 
 export type CreateEventPayload = z.infer<typeof CreateEventPayloadSchema>;
@@ -54,6 +56,7 @@ export const UpdateEventPayloadSchema = z.object({
   vm_disk_size: z.number().positive().optional(),
   deadline: z.string().optional(),
   max_vms: z.number().positive().optional(),
+  shutdown_grace: z.number().nonnegative().nullable().optional(),
 });
 
 export type UpdateEventPayload = z.infer<typeof UpdateEventPayloadSchema>;
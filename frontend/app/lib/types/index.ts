@@ -11,3 +11,4 @@ export * from "./recoverable-vm";
 export * from "./event";
 export * from "./user-settings";
 export * from "./slave";
+export * from "./provision-job";
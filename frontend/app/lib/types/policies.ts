@@ -6,6 +6,7 @@ export enum Policy {
   AUTH_CHANGE_PASSWORD = "auth:changePassword",
   HOST_GET = "host:get",
   IMAGES_GET = "images:get",
+  IMAGES_PREFETCH = "images:prefetch",
   POLICIES_GET = "policies:get",
   USERS_GET = "users:get",
   USERS_CREATE = "users:create",
@@ -17,6 +18,7 @@ export enum Policy {
   VMS_CREATE = "vms:create",
   VMS_START = "vms:start",
   VMS_STOP = "vms:stop",
+  VMS_SET_SHUTDOWN_POLICY = "vms:setShutdownPolicy",
   VMS_CONNECT = "vms:connect",
   VMS_CREDENTIALS_CREATE = "vms:credentials:create",
   VMS_DELETE = "vms:delete",
@@ -39,6 +41,8 @@ export enum Policy {
   SLAVES_GET_BY_ID = "slaves:getById",
   SLAVES_CREATE = "slaves:create",
   SLAVES_DELETE = "slaves:delete",
+  POOLS_GET = "pools:get",
+  POOLS_MANAGE = "pools:manage",
 }
 
 export const POLICY_DESCRIPTIONS: Record<Policy, string> = {
@@ -50,6 +54,8 @@ export const POLICY_DESCRIPTIONS: Record<Policy, string> = {
   [Policy.HOST_GET]: "Allows the user to fetch the host resources.",
   [Policy.IMAGES_GET]:
     "Allows the user to fetch images metadata from the registry.",
+  [Policy.IMAGES_PREFETCH]:
+    "Allows the user to pre-stage images on cluster nodes.",
   [Policy.POLICIES_GET]: "Allows the user to fetch policies.",
   [Policy.USERS_GET]: "Allows the user to fetch users.",
   [Policy.USERS_CREATE]: "Allows the user to create users.",
@@ -61,6 +67,8 @@ export const POLICY_DESCRIPTIONS: Record<Policy, string> = {
   [Policy.VMS_CREATE]: "Allows the user to create virtual machines.",
   [Policy.VMS_START]: "Allows the user to start virtual machines.",
   [Policy.VMS_STOP]: "Allows the user to stop virtual machines.",
+  [Policy.VMS_SET_SHUTDOWN_POLICY]:
+    "Allows the user to set how long a virtual machine is given to shut down before it is destroyed.",
   [Policy.VMS_CONNECT]:
     "Allows the user to connect to a virtual machine via the dashboard tunnel.",
   [Policy.VMS_CREDENTIALS_CREATE]:
@@ -91,6 +99,9 @@ export const POLICY_DESCRIPTIONS: Record<Policy, string> = {
   [Policy.SLAVES_GET_BY_ID]: "Allows the user to fetch a slave node by id.",
   [Policy.SLAVES_CREATE]: "Allows the user to register a new slave node.",
   [Policy.SLAVES_DELETE]: "Allows the user to unregister a slave node.",
+  [Policy.POOLS_GET]: "Allows the user to list warm VM pools.",
+  [Policy.POOLS_MANAGE]:
+    "Allows the user to create, resize and delete warm VM pools.",
 };
 
 export const PolicySchema = z.string().min(1);
@@ -127,6 +138,12 @@ export const POLICY_COLORS = {
     hover: "hover:bg-sky-500/30",
     text: "text-sky-600 dark:text-sky-400",
   },
+  [Policy.IMAGES_PREFETCH]: {
+    bg: "bg-sky-600/20",
+    border: "border-sky-600",
+    hover: "hover:bg-sky-600/30",
+    text: "text-sky-700 dark:text-sky-400",
+  },
   [Policy.POLICIES_GET]: {
     bg: "bg-violet-500/20",
     border: "border-violet-500",
@@ -193,6 +210,12 @@ export const POLICY_COLORS = {
     hover: "hover:bg-orange-500/30",
     text: "text-orange-600 dark:text-orange-400",
   },
+  [Policy.VMS_SET_SHUTDOWN_POLICY]: {
+    bg: "bg-orange-600/20",
+    border: "border-orange-600",
+    hover: "hover:bg-orange-600/30",
+    text: "text-orange-700 dark:text-orange-400",
+  },
   [Policy.VMS_CONNECT]: {
     bg: "bg-green-500/20",
     border: "border-green-500",
@@ -313,6 +336,18 @@ export const POLICY_COLORS = {
     hover: "hover:bg-red-500/30",
     text: "text-red-600 dark:text-red-400",
   },
+  [Policy.POOLS_GET]: {
+    bg: "bg-orange-500/20",
+    border: "border-orange-500",
+    hover: "hover:bg-orange-500/30",
+    text: "text-orange-600 dark:text-orange-400",
+  },
+  [Policy.POOLS_MANAGE]: {
+    bg: "bg-orange-600/20",
+    border: "border-orange-600",
+    hover: "hover:bg-orange-600/30",
+    text: "text-orange-700 dark:text-orange-400",
+  },
   default: {
     bg: "bg-gray-500/20",
     border: "border-gray-500",
@@ -0,0 +1,17 @@
+import { z } from "zod";
+
+export const ProvisionJobSchema = z.object({
+  id: z.string().uuid(),
+  status: z.enum(["queued", "running", "succeeded", "failed"]),
+  phase: z.string().nullable().optional(),
+  progress: z.number(),
+  error: z.string().nullable().optional(),
+  vm_id: z.string().uuid().nullable().optional(),
+  slave_id: z.string().uuid().nullable().optional(),
+  created_by: z.string().nullable().optional(),
+  created_at: z.string(),
+  updated_at: z.string(),
+  finished_at: z.string().nullable().optional(),
+});
+
+export type ProvisionJob = z.infer<typeof ProvisionJobSchema>;
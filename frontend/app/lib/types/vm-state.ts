@@ -9,6 +9,7 @@ export enum VMState {
   STOPPED = "Stopped",
   CRASHED = "Crashed",
   PMSUSPENDED = "Suspended (power management)",
+  HIBERNATED = "Hibernated",
   UNKNOWN = "Unknown",
 }
 
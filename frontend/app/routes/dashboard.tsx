@@ -2,6 +2,9 @@ import { Outlet } from "react-router";
 import type { Route } from "./+types/dashboard";
 import { DashboardSidenav } from "~/components/dashboard/sidenav";
 import { ProtectedRoute } from "@/components/ProtectedRoute";
+import { useAuthz } from "@/contexts/authz-context";
+import { useChangeStream } from "@/hooks/useChangeStream";
+import { Policy } from "@/lib/types";
 
 export function meta({}: Route.MetaArgs) {
   return [
@@ -10,9 +13,16 @@ export function meta({}: Route.MetaArgs) {
   ];
 }
 
+function ChangeStream() {
+  const authz = useAuthz();
+  useChangeStream(authz.hasPolicy(Policy.VMS_GET));
+  return null;
+}
+
 export default function DashboardLayout() {
   return (
     <ProtectedRoute>
+      <ChangeStream />
       <div className="flex h-screen overflow-hidden">
         <DashboardSidenav />
         <main className="flex-1 overflow-y-auto min-w-0">
@@ -37,7 +37,7 @@ ubuntu() {
     init
     set -x
     sudo apt update
-    sudo apt install -y qemu-kvm libvirt-daemon-system genisoimage libvirt-clients bridge-utils virtinst pkg-config libvirt-dev python3-dev libguestfs-tools
+    sudo apt install -y qemu-kvm libvirt-daemon-system libvirt-clients bridge-utils virtinst pkg-config libvirt-dev python3-dev libguestfs-tools
     set +x
 }
 